@@ -0,0 +1,65 @@
+import importlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from modules.utils import Emojis
+
+logger = logging.getLogger(__name__)
+
+# Nome do benchmark -> módulo com uma função run(input_path=None, ...) que retorna um dict serializável
+BENCHMARKS = {
+    "chunking": "benchmarks.chunking",
+    "search": "benchmarks.search",
+    "quantization": "benchmarks.quantization",
+    "service": "benchmarks.service",
+    "pipeline": "benchmarks.pipeline",
+    "startup": "benchmarks.startup",
+    "markdown": "benchmarks.markdown",
+}
+
+
+def environment():
+    """Identificação da execução, para comparar resultados entre commits."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmark(name, input_path=None, output_path=None, size=None, compare_path=None):
+    """
+    Executa um benchmark, imprime o resultado em JSON e opcionalmente salva em arquivo.
+
+    Com `compare_path` (um resultado salvo antes, ex.: de outro commit), imprime também
+    as métricas que pioraram ou melhoraram mais de 10%.
+    """
+    module = importlib.import_module(BENCHMARKS[name])
+    kwargs = {"size": size} if size else {}
+    result = module.run(input_path=input_path, **kwargs)
+    result["environment"] = environment()
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    print(report)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(report)
+        logger.info(f"{Emojis.SUCCESS.value} Resultado do benchmark salvo em {output_path}")
+    if compare_path:
+        from benchmarks.compare import compare_results, load_result
+        comparison = compare_results(load_result(compare_path), result)
+        print(json.dumps(comparison, indent=2, ensure_ascii=False))
+        if comparison["regressions"]:
+            logger.warning(f"{Emojis.WARNING.value} {len(comparison['regressions'])} métricas pioraram em relação a {compare_path}")
+    return result
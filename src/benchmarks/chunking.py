@@ -0,0 +1,49 @@
+import time
+from config.settings import config
+from modules.chunking import BoundaryChunker, split_text
+from benchmarks.corpus import synthetic_text
+
+
+def _measure(name, text, chunker, repeat, materialize=None):
+    best = float("inf")
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = chunker(text)
+        best = min(best, time.perf_counter() - start)
+    chunks = materialize(result) if materialize else result
+    megabytes = len(text.encode("utf-8")) / 1e6
+    cut_words = sum(1 for chunk in chunks[:-1] if chunk and chunk[-1].isalnum())
+    return {
+        "chunker": name,
+        "chunks": len(chunks),
+        "chunks_per_mb": len(chunks) / megabytes,
+        "mb_per_s": megabytes / best,
+        "avg_chunk_chars": sum(map(len, chunks)) / max(len(chunks), 1),
+        # Fração de chunks que terminam no meio de uma palavra
+        "cut_word_ratio": cut_words / max(len(chunks) - 1, 1),
+    }
+
+
+def run(input_path=None, size=5_000_000, repeat=3):
+    """Compara split_text (offsets fixos) com o BoundaryChunker em chunks/MB e MB/s."""
+    if input_path:
+        with open(input_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = synthetic_text(size)
+    boundary = BoundaryChunker()
+    return {
+        "benchmark": "chunking",
+        "input": input_path or f"synthetic:{size}",
+        "chunk_size": config.embedding.chunk_size,
+        "chunk_overlap": config.embedding.chunk_overlap,
+        "boundary_tolerance": config.embedding.boundary_tolerance,
+        "results": [
+            _measure("fixed (split_text)", text, split_text, repeat),
+            # Apenas offsets: mede o custo do chunker sem criar as strings
+            _measure("boundary (spans)", text, boundary.spans, repeat,
+                     materialize=lambda spans: [text[start:end] for start, end in spans]),
+            _measure("boundary (strings)", text, lambda t: [chunk.text for chunk in boundary.iter_chunks([t])], repeat),
+        ],
+    }
@@ -0,0 +1,58 @@
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+# Sufixos das chaves em que um valor maior é melhor; nas demais (tempos, latências) menor é melhor
+_HIGHER_IS_BETTER = ("per_s", "hit_rate", "speedup", "recall")
+# Chaves que descrevem a execução, não o desempenho
+_IGNORED = ("environment", "input", "vectors", "rows", "chunks", "files", "count", "questions",
+            "characters", "mb", "k", "lists", "nprobe", "api_calls", "sections",
+            "sections_with_headings", "max_heading_depth", "default_collection_hits")
+
+
+def _leaves(value: Any, path: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _IGNORED and not key.startswith("unique_"):
+                yield from _leaves(item, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _leaves(item, f"{path}[{index}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield path, float(value)
+
+
+def _higher_is_better(path: str) -> bool:
+    key = path.rsplit(".", 1)[-1]
+    return any(marker in key for marker in _HIGHER_IS_BETTER)
+
+
+def compare_results(base: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1) -> Dict[str, Any]:
+    """
+    Compara dois resultados do mesmo benchmark métrica a métrica.
+
+    Retorna as variações acima de `threshold` (fração), separadas em regressões e melhorias
+    conforme o sentido da métrica (ex.: mb_per_s maior é melhor, p99_ms menor é melhor).
+    """
+    base_values = dict(_leaves(base))
+    regressions, improvements = [], []
+    for path, value in _leaves(current):
+        previous = base_values.get(path)
+        if not previous:
+            continue
+        change = value / previous - 1
+        if abs(change) < threshold:
+            continue
+        better = change > 0 if _higher_is_better(path) else change < 0
+        (improvements if better else regressions).append({"metric": path, "base": previous, "current": value, "change": change})
+    return {
+        "base_commit": base.get("environment", {}).get("commit"),
+        "current_commit": current.get("environment", {}).get("commit"),
+        "threshold": threshold,
+        "regressions": regressions,
+        "improvements": improvements,
+    }
+
+
+def load_result(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,178 @@
+import os
+import random
+import textwrap
+from typing import List
+
+_WORDS = (
+    "dados modelo consulta documento vetor embedding busca contexto resposta pergunta "
+    "sistema arquivo processamento memória latência índice banco tabela registro chave "
+    "usuário serviço requisição lote cache métrica página seção título parágrafo texto"
+).split()
+
+
+def synthetic_text(size: int, seed: int = 0) -> str:
+    """
+    Gera um texto determinístico de aproximadamente `size` caracteres, com títulos,
+    parágrafos e frases de tamanhos variados (estrutura parecida com documentação real).
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    section = 0
+    while length < size:
+        if rng.random() < 0.15:
+            section += 1
+            heading = f"# Seção {section}: {' '.join(rng.choices(_WORDS, k=rng.randint(2, 5))).capitalize()}\n\n"
+            parts.append(heading)
+            length += len(heading)
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            words = rng.choices(_WORDS, k=rng.randint(6, 24))
+            sentences.append(" ".join(words).capitalize() + rng.choice(".!?."))
+        paragraph = " ".join(sentences) + "\n\n"
+        parts.append(paragraph)
+        length += len(paragraph)
+    return "".join(parts)[:size]
+
+
+def synthetic_markdown(size: int, seed: int = 0) -> str:
+    """
+    Gera um Markdown determinístico de aproximadamente `size` caracteres com a marcação
+    comum em documentação: títulos aninhados (H1-H4), ênfase, links, código inline e em
+    blocos, listas, citações e tabelas.
+    """
+    rng = random.Random(seed)
+
+    def words(low, high):
+        return " ".join(rng.choices(_WORDS, k=rng.randint(low, high)))
+
+    def inline(text):
+        tokens = text.split()
+        for i in range(len(tokens)):
+            roll = rng.random()
+            if roll < 0.04:
+                tokens[i] = f"**{tokens[i]}**"
+            elif roll < 0.07:
+                tokens[i] = f"*{tokens[i]}*"
+            elif roll < 0.09:
+                tokens[i] = f"`{tokens[i]}`"
+            elif roll < 0.11:
+                tokens[i] = f"[{tokens[i]}](https://exemplo.com/{tokens[i]})"
+        return " ".join(tokens)
+
+    parts = [f"# {words(2, 4).capitalize()}\n\n"]
+    length = len(parts[0])
+    level = 1
+    while length < size:
+        roll = rng.random()
+        if roll < 0.12:
+            level = max(2, min(4, level + rng.choice((-1, 0, 1))))
+            block = f"{'#' * level} {words(2, 5).capitalize()}\n\n"
+        elif roll < 0.22:
+            block = "".join(f"- {inline(words(3, 10))}\n" for _ in range(rng.randint(2, 6))) + "\n"
+        elif roll < 0.28:
+            block = "```python\n" + "".join(
+                f"{'    ' * rng.randint(0, 2)}{words(1, 1)} = \"{words(1, 3)}\"\n" for _ in range(rng.randint(2, 8))
+            ) + "```\n\n"
+        elif roll < 0.32:
+            block = f"> {inline(words(8, 20)).capitalize()}.\n\n"
+        elif roll < 0.36:
+            rows = [f"| {' | '.join(rng.choices(_WORDS, k=3))} |" for _ in range(rng.randint(2, 5))]
+            block = "\n".join([rows[0], "|---|---|---|", *rows[1:]]) + "\n\n"
+        else:
+            sentences = [inline(words(6, 24)).capitalize() + rng.choice(".!?.") for _ in range(rng.randint(2, 8))]
+            block = " ".join(sentences) + "\n\n"
+        parts.append(block)
+        length += len(block)
+    return "".join(parts)
+
+
+def write_markdown_tree(directory: str, documents: int = 200, document_size: int = 50_000, fanout: int = 8,
+                        seed: int = 0) -> List[str]:
+    """
+    Cria uma árvore de documentação sintética em `directory`: `documents` arquivos Markdown
+    de ~`document_size` caracteres, `fanout` por diretório em subpastas aninhadas. Retorna os caminhos.
+    """
+    paths = []
+    for index in range(documents):
+        folder = os.path.join(directory, *(f"secao_{part:02d}" for part in _tree_position(index // fanout, fanout)))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"pagina_{index:04d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(synthetic_markdown(document_size, seed=seed + index))
+        paths.append(path)
+    return paths
+
+
+def _tree_position(folder: int, fanout: int) -> List[int]:
+    parts = []
+    while folder:
+        folder, part = divmod(folder - 1, fanout)
+        parts.append(part)
+    return parts[::-1]
+
+
+def write_pdf(path: str, text: str, line_chars: int = 95, lines_per_page: int = 60) -> int:
+    """
+    Grava `text` como um PDF simples (Helvetica, WinAnsi) com texto extraível pelo PyPDF2.
+
+    Sem dependências além da biblioteca padrão. Retorna o número de páginas.
+    """
+    lines: List[str] = []
+    for paragraph in text.split("\n"):
+        lines.extend(textwrap.wrap(paragraph, line_chars) or [""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    def escape(line: str) -> bytes:
+        line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return line.encode("cp1252", errors="replace")
+
+    # 1: catálogo, 2: árvore de páginas, 3: fonte; depois (página, conteúdo) por página
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages))).encode("ascii"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for index, page in enumerate(pages):
+        stream = b"BT /F1 10 Tf 12 TL 40 800 Td " + b" ".join(b"(" + escape(line) + b") Tj T*" for line in page) + b" ET"
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * index} 0 R >>"
+        ).encode("ascii"))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+    return len(pages)
+
+
+def write_corpus(directory: str, documents: int = 20, document_size: int = 50_000, pdf_ratio: float = 0.5,
+                 seed: int = 0) -> List[str]:
+    """
+    Cria um corpus sintético em `directory`: `documents` arquivos de ~`document_size`
+    caracteres, uma fração `pdf_ratio` em PDF e o resto em Markdown. Retorna os caminhos.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pdfs = round(documents * pdf_ratio)
+    paths = []
+    for index in range(documents):
+        text = synthetic_text(document_size, seed=seed + index)
+        if index < pdfs:
+            path = os.path.join(directory, f"documento_{index:04d}.pdf")
+            write_pdf(path, text)
+        else:
+            path = os.path.join(directory, f"documento_{index:04d}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        paths.append(path)
+    return paths
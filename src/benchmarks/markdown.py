@@ -0,0 +1,77 @@
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from modules.files import HtmlMarkdownExtractor, MarkdownExtractor
+from benchmarks.corpus import write_markdown_tree
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _markdown_files(directory):
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names if name.endswith(".md")
+    )
+
+
+def _measure(extractor, paths, megabytes, repeat):
+    best = float("inf")
+    texts = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        texts = ["".join(extractor(path).iter_text()) for path in paths]
+        best = min(best, time.perf_counter() - start)
+    return texts, {
+        "seconds": best,
+        "mb_per_s": megabytes / best,
+        "files_per_s": len(paths) / best,
+    }
+
+
+def _word_recall(reference, texts):
+    """Fração das palavras do texto de referência (com repetição) presentes no texto extraído."""
+    expected, found = Counter(), Counter()
+    for reference_text, text in zip(reference, texts):
+        expected.update(_TOKEN.findall(reference_text.casefold()))
+        found.update(_TOKEN.findall(text.casefold()))
+    total = sum(expected.values())
+    return sum((expected & found).values()) / total if total else None
+
+
+def _run(paths, repeat):
+    megabytes = sum(os.path.getsize(path) for path in paths) / 1e6
+    html_texts, html = _measure(HtmlMarkdownExtractor, paths, megabytes, repeat)
+    texts, structured = _measure(MarkdownExtractor, paths, megabytes, repeat)
+    sections = [section for path in paths for section in MarkdownExtractor(path).iter_sections()]
+    return {
+        "files": len(paths),
+        "mb": megabytes,
+        "html": html,
+        "structured": {
+            **structured,
+            "sections": len(sections),
+            "sections_with_headings": sum(1 for section in sections if section.heading_path),
+            "max_heading_depth": max((len(section.heading_path) for section in sections), default=0),
+        },
+        "speedup": html["seconds"] / structured["seconds"],
+        # Quanto do texto do extrator antigo o novo preserva
+        "word_recall": _word_recall(html_texts, texts),
+    }
+
+
+def run(input_path=None, size=200, repeat=3):
+    """
+    Throughput da extração de Markdown: renderização para HTML + BeautifulSoup (HtmlMarkdownExtractor)
+    contra a conversão direta por seção (MarkdownExtractor), na mesma árvore de documentos.
+
+    `input_path` é um diretório com arquivos .md; sem ele, gera uma árvore sintética de
+    `size` páginas de ~50 KB com títulos aninhados, listas, tabelas e blocos de código.
+    """
+    if input_path:
+        return {"benchmark": "markdown", "input": input_path, **_run(_markdown_files(input_path), repeat)}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_markdown_tree(directory, documents=size)
+        return {"benchmark": "markdown", "input": f"synthetic:{size}", **_run(paths, repeat)}
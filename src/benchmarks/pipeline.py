@@ -0,0 +1,203 @@
+import os
+import tempfile
+import time
+import numpy as np
+from config.settings import config
+from modules import database
+from modules.chunking import iter_document_chunks
+from modules.files import FileExtractorFactory
+from modules.ingest import discover_files
+from modules.metrics import metrics
+from modules.search import ExactIndex
+from benchmarks.corpus import write_corpus
+from benchmarks.search import synthetic_vectors, _queries, _sqlite_vec_latency
+from benchmarks.stats import latency_summary, timed
+
+SEARCH_SIZES = (10_000, 100_000, 1_000_000)
+QUESTIONS = (
+    "Como o cache de embeddings é armazenado?",
+    "Qual a latência da busca no índice?",
+    "Como os documentos são divididos em chunks?",
+    "O que acontece quando a cota da API acaba?",
+    "Quais métricas o sistema registra?",
+)
+
+
+def _extraction(paths):
+    """MB/s de extração de texto por formato (leitura + parsing, sem chunking)."""
+    results = {}
+    for extension in sorted({os.path.splitext(path)[1] for path in paths}):
+        files = [path for path in paths if path.endswith(extension)]
+        size = sum(os.path.getsize(path) for path in files)
+        start = time.perf_counter()
+        characters = sum(len(page) for path in files for page in FileExtractorFactory.create_extractor(path).iter_text())
+        seconds = time.perf_counter() - start
+        results[extension.lstrip(".")] = {
+            "files": len(files),
+            "mb": size / 1e6,
+            "mb_per_s": size / 1e6 / seconds,
+            "characters": characters,
+        }
+    return results
+
+
+def _chunking(paths):
+    texts = ["".join(FileExtractorFactory.create_extractor(path).iter_text()) for path in paths]
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    start = time.perf_counter()
+    chunks = sum(1 for text in texts for _ in iter_document_chunks([text]))
+    seconds = time.perf_counter() - start
+    return {
+        "strategy": config.embedding.chunk_strategy,
+        "chunks": chunks,
+        "chunks_per_s": chunks / seconds,
+        "mb_per_s": megabytes / seconds,
+    }
+
+
+def _stage_latencies():
+    return {
+        name: {"count": stats["count"], **{f"{key}_ms": stats[key] * 1000 for key in ("p50", "p95", "p99")}}
+        for name, stats in metrics.get_stats().items() if isinstance(stats, dict)
+    }
+
+
+def _cache_hit_rate(counters, hits="cache_hits", misses="cache_misses"):
+    total = counters[hits] + counters[misses]
+    return counters[hits] / total if total else None
+
+
+def _ingest(corpus_dir, db_path, workers):
+    """Ingestão de ponta a ponta (extração, chunking, embedding falso, inserção) em um banco novo."""
+    from modules.ingest import ingest
+    database.close_database()
+    database.initialize_database(db_path)
+    metrics.reset()
+    try:
+        rows, seconds = timed(ingest, corpus_dir, workers=workers)
+        default_collection_hits = _check_collection_filter(rows)
+    finally:
+        database.close_database()
+    counters = metrics.snapshot()["counters"]
+    return {
+        "rows": rows,
+        "default_collection_hits": default_collection_hits,
+        "seconds": seconds,
+        "rows_per_s": rows / seconds,
+        "embedding_cache_hit_rate": _cache_hit_rate(counters),
+        "api_calls": counters["api_calls"],
+        "stages": _stage_latencies(),
+    }
+
+
+def _check_collection_filter(rows, k=5):
+    """
+    Busca um vetor ingerido filtrando pela coleção padrão: sem nenhum resultado, os vetores
+    foram gravados na partição errada do vec0 e as medições de busca não valem nada.
+    """
+    if not rows:
+        return 0
+    _, embedding = next(database.iter_embeddings(batch_size=1))
+    hits = len(database.search_vectors(embedding, k, collection=config.database.default_collection))
+    if not hits:
+        raise RuntimeError(f"Busca na coleção '{config.database.default_collection}' não encontrou os {rows} chunks ingeridos.")
+    return hits
+
+
+def _questions(db_path, count, unique_questions, k):
+    """Perguntas repetidas no pipeline do RAG: latência por pergunta e taxas de acerto dos caches."""
+    from modules.answer_cache import AnswerCache
+    from modules.google_ai_commands import generate_embeddings, stream_answer
+    from modules.service import RagService
+    pool = database.ConnectionPool(1, db_path)
+    answer_cache = AnswerCache(database.open_connection(path=db_path))
+    service = RagService(lambda texts: generate_embeddings(texts, task_type="RETRIEVAL_QUERY"), stream_answer, pool, answer_cache)
+    metrics.reset()
+    samples, cached = [], 0
+    try:
+        for i in range(count):
+            question = f"{QUESTIONS[i % len(QUESTIONS)]} #{i % unique_questions}"
+            result, seconds = timed(service._answer, question, k, {})
+            samples.append(seconds)
+            cached += result["cached"]
+    finally:
+        service.close()
+    counters = metrics.snapshot()["counters"]
+    return {
+        "questions": count,
+        "unique_questions": unique_questions,
+        "embedding_cache_hit_rate": _cache_hit_rate(counters),
+        "answer_cache_hit_rate": cached / count,
+        # Perguntas resolvidas pelo atalho lexical (BM25), sem embedding da consulta
+        "lexical_hit_rate": counters["lexical_fast_path"] / count,
+        **latency_summary(samples),
+        "stages": _stage_latencies(),
+    }
+
+
+def _search_scaling(max_size, queries, k):
+    """Latência p50/p99 da busca exata (NumPy) e do vec0 conforme o número de vetores cresce."""
+    results = []
+    for size in SEARCH_SIZES:
+        if size > max_size:
+            break
+        vectors = synthetic_vectors(size)
+        query_vectors = _queries(vectors, queries)
+        index = ExactIndex(vectors, np.arange(1, size + 1, dtype=np.int64))
+        samples = [timed(index.search, query, k)[1] for query in query_vectors]
+        results.append({
+            "vectors": size,
+            "exact_numpy": latency_summary(samples),
+            "sqlite_vec": _sqlite_vec_latency(vectors, query_vectors, k) if size <= 200_000 else None,
+        })
+    return results
+
+
+def run(input_path=None, size=100_000, documents=20, document_size=50_000, workers=None,
+        embedding_latency=0.0, generation_latency=0.0, questions=200, unique_questions=40, k=config.search.top_k):
+    """
+    Suíte offline: corpus sintético (PDF + Markdown) e FakeGenAI no lugar da API do Google.
+
+    Mede extração (MB/s por formato), chunking, ingestão (linhas/s, a frio e com o cache
+    de embeddings quente), perguntas repetidas (latência e taxas de acerto dos caches) e
+    a latência da busca para 10k..`size` vetores. `input_path` pode ser um diretório com
+    documentos reais no lugar do corpus sintético. Banco e cache ficam em um diretório
+    temporário; o banco configurado não é tocado.
+    """
+    from modules import google_ai_commands
+    from modules.cache import create_embedding_cache
+    from modules.fake_backend import FakeEmbedder, FakeGenAI, FakeGenerator, use_fake_genai
+    from modules.rate_limiter import AdaptiveRateLimiter, set_default_limiter
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_dir = input_path or os.path.join(workdir, "corpus")
+        if not input_path:
+            write_corpus(corpus_dir, documents, document_size)
+        paths = discover_files(corpus_dir)
+
+        fake = FakeGenAI(FakeEmbedder(latency=embedding_latency), FakeGenerator(latency=generation_latency))
+        # Sem cota para respeitar: o limiter padrão seguraria o embedder falso em 300 textos/min
+        previous_limiter = set_default_limiter(AdaptiveRateLimiter(requests_per_minute=10**9, texts_per_minute=10**9))
+        previous_cache = google_ai_commands.cache
+        google_ai_commands.cache = create_embedding_cache(os.path.join(workdir, "cache"))
+        try:
+            with use_fake_genai(fake):
+                cold = _ingest(corpus_dir, os.path.join(workdir, "cold.db"), workers)
+                warm = _ingest(corpus_dir, os.path.join(workdir, "warm.db"), workers)
+                rag = _questions(os.path.join(workdir, "warm.db"), questions, unique_questions, k)
+        finally:
+            google_ai_commands.cache = previous_cache
+            set_default_limiter(previous_limiter)
+
+        return {
+            "benchmark": "pipeline",
+            "input": input_path or f"synthetic:{documents}x{document_size}",
+            "embedding_latency": embedding_latency,
+            "generation_latency": generation_latency,
+            "extraction": _extraction(paths),
+            "chunking": _chunking(paths),
+            "ingest": cold,
+            "ingest_warm_cache": warm,
+            "questions": rag,
+            "search": _search_scaling(size, 100, k),
+        }
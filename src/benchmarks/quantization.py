@@ -0,0 +1,115 @@
+import numpy as np
+from config.settings import config
+from modules.search import ExactIndex, _top_k
+from modules.vectors import quantize_vector
+from benchmarks.search import synthetic_vectors, _queries
+from benchmarks.stats import latency_summary, timed
+
+STORAGES = ("float", "int8", "bit")
+OVERSAMPLES = (1, 2, 4, 8)
+
+
+def _quantize_all(vectors, storage):
+    dimension = vectors.shape[1]
+    return np.stack([np.frombuffer(quantize_vector(row, storage, dimension=dimension), dtype=np.uint8) for row in vectors])
+
+
+def _first_pass(codes, query_code, storage, count):
+    """Emula a primeira passada do vec0: L2 sobre int8 ou distância de Hamming sobre bits."""
+    if storage == "int8":
+        diff = codes.view(np.int8).astype(np.int32) - query_code.view(np.int8).astype(np.int32)
+        scores = np.einsum("ij,ij->i", diff, diff)
+    else:
+        scores = np.unpackbits(codes ^ query_code, axis=1).sum(axis=1)
+    return _top_k(scores, count)
+
+
+def _sqlite_vec_recall(vectors, queries, truth, storage, k, oversample):
+    """Mesma medição usando o vec0 real (primeira passada) quando o sqlite carrega extensões."""
+    try:
+        import sqlite3
+        import sqlite_vec
+        db = sqlite3.connect(":memory:")
+        db.enable_load_extension(True)
+        sqlite_vec.load(db)
+    except (ImportError, AttributeError, sqlite3.OperationalError):
+        return None
+    column = {"int8": "int8", "bit": "bit"}[storage]
+    wrap = {"int8": "vec_int8(?)", "bit": "vec_bit(?)"}[storage]
+    dimension = vectors.shape[1]
+    db.execute(f"CREATE VIRTUAL TABLE v USING vec0(id INTEGER PRIMARY KEY, embedding {column}[{dimension}])")
+    db.executemany(f"INSERT INTO v(id, embedding) VALUES (?, {wrap})",
+                   ((i, quantize_vector(row, storage, dimension=dimension)) for i, row in enumerate(vectors)))
+    hits, samples = 0, []
+    for q, expected in zip(queries, truth):
+        def search():
+            rows = db.execute(f"SELECT id FROM v WHERE embedding MATCH {wrap} AND k = ?",
+                              (quantize_vector(q, storage, dimension=dimension), k * oversample)).fetchall()
+            candidates = np.array([row[0] for row in rows], dtype=np.int64)
+            distances = np.linalg.norm(vectors[candidates] - q, axis=1)
+            return candidates[_top_k(distances, k)]
+        found, seconds = timed(search)
+        hits += len(expected & set(found.tolist()))
+        samples.append(seconds)
+    db.close()
+    return {f"recall@{k}": hits / (k * len(queries)), **latency_summary(samples)}
+
+
+def _run_size(vectors, query_count, k):
+    count, dimension = vectors.shape
+    ids = np.arange(count, dtype=np.int64)
+    queries = _queries(vectors, query_count)
+    exact = ExactIndex(vectors, ids)
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    float_bytes = vectors.dtype.itemsize * dimension
+
+    results = []
+    for storage in STORAGES:
+        if storage == "float":
+            samples = [timed(exact.search, q, k)[1] for q in queries]
+            results.append({"storage": "float", "index_bytes": float_bytes * count, "memory_saved": 0.0,
+                            "rerank": None, f"recall@{k}": 1.0, **latency_summary(samples)})
+            continue
+        codes = _quantize_all(vectors, storage)
+        index_bytes = codes.nbytes
+        for oversample in OVERSAMPLES:
+            hits, samples = 0, []
+            for q, expected in zip(queries, truth):
+                query_code = np.frombuffer(quantize_vector(q, storage, dimension=dimension), dtype=np.uint8)
+
+                def search():
+                    candidates = _first_pass(codes, query_code, storage, min(k * oversample, count))
+                    return candidates[_top_k(np.linalg.norm(vectors[candidates] - q, axis=1), k)]
+                found, seconds = timed(search)
+                hits += len(expected & set(ids[found].tolist()))
+                samples.append(seconds)
+            results.append({
+                "storage": storage,
+                "index_bytes": int(index_bytes),
+                # Os float32 continuam em vectors_full (disco), mas saem do índice vec0 consultado
+                "memory_saved": 1 - index_bytes / (float_bytes * count),
+                "rerank": {"oversample": oversample, "candidates": k * oversample},
+                f"recall@{k}": hits / (k * len(queries)),
+                **latency_summary(samples),
+                "sqlite_vec": _sqlite_vec_recall(vectors, queries, truth, storage, k, oversample)
+                if count <= 100_000 else None,
+            })
+    return {"vectors": int(count), "dimension": int(dimension), "results": results}
+
+
+def run(input_path=None, size=50_000, queries=100, k=10):
+    """
+    Relatório de memória x recall@k do armazenamento quantizado (int8, bit) com re-ranking float32.
+
+    O recall é medido contra a busca exata em float32. `input_path` pode apontar para uma
+    matriz float32 .npy (ex.: o vectors.npy da exportação binária).
+    """
+    vectors = np.load(input_path, mmap_mode="r") if input_path else synthetic_vectors(size, config.database.embedding_dimension)
+    return {
+        "benchmark": "quantization",
+        "input": input_path or "synthetic",
+        "int8_range": config.database.int8_range,
+        "k": k,
+        "queries": queries,
+        "results": [_run_size(np.asarray(vectors, dtype=np.float32), queries, k)],
+    }
@@ -0,0 +1,106 @@
+import numpy as np
+from config.settings import config
+from modules.search import ExactIndex, IVFIndex
+from benchmarks.stats import latency_summary, timed
+
+DEFAULT_SIZES = (10_000, 100_000)
+NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def synthetic_vectors(count, dimension=config.database.embedding_dimension, clusters=512, seed=0):
+    """Vetores normalizados agrupados em torno de centros aleatórios (mais realista que ruído uniforme)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = np.empty((count, dimension), dtype=np.float32)
+    for start in range(0, count, 65_536):
+        size = min(65_536, count - start)
+        block = centers[rng.integers(0, clusters, size)] + 0.6 * rng.standard_normal((size, dimension)).astype(np.float32)
+        vectors[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def _queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    base = vectors[rng.integers(0, vectors.shape[0], count)]
+    queries = base + 0.3 * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(base.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _sqlite_vec_latency(vectors, queries, k):
+    """Latência do vec0 em banco em memória, quando o sqlite desta instalação carrega extensões."""
+    try:
+        import sqlite3
+        import sqlite_vec
+        db = sqlite3.connect(":memory:")
+        db.enable_load_extension(True)
+        sqlite_vec.load(db)
+    except (ImportError, AttributeError, sqlite3.OperationalError):
+        return None
+    db.execute(f"CREATE VIRTUAL TABLE v USING vec0(id INTEGER PRIMARY KEY, embedding float[{vectors.shape[1]}])")
+    db.executemany("INSERT INTO v(id, embedding) VALUES (?, ?)", ((i + 1, memoryview(row)) for i, row in enumerate(vectors)))
+    samples = [
+        timed(lambda: db.execute("SELECT id FROM v WHERE embedding MATCH ? AND k = ?", (memoryview(q), k)).fetchall())[1]
+        for q in queries
+    ]
+    db.close()
+    return latency_summary(samples)
+
+
+def _run_size(vectors, query_count, k):
+    ids = np.arange(1, vectors.shape[0] + 1, dtype=np.int64)
+    queries = _queries(vectors, query_count)
+    exact = ExactIndex(vectors, ids)
+    truth, samples = [], []
+    for q in queries:
+        (found, _), seconds = timed(exact.search, q, k)
+        truth.append(set(found.tolist()))
+        samples.append(seconds)
+
+    ivf, build_seconds = timed(IVFIndex.build, vectors, ids)
+    ivf_results = []
+    for nprobe in NPROBES:
+        if nprobe > ivf.centroids.shape[0]:
+            break
+        hits, samples_ivf = 0, []
+        for q, expected in zip(queries, truth):
+            (found, _), seconds = timed(ivf.search, q, k, nprobe)
+            hits += len(expected & set(found.tolist()))
+            samples_ivf.append(seconds)
+        ivf_results.append({
+            "nprobe": nprobe,
+            f"recall@{k}": hits / (k * len(queries)),
+            "scanned_fraction": nprobe / ivf.centroids.shape[0],
+            **latency_summary(samples_ivf),
+        })
+
+    # Mesmas consultas de uma vez: um matmul por bloco em vez de um por consulta
+    _, batch_seconds = timed(exact.search_many, queries, k)
+    return {
+        "vectors": int(vectors.shape[0]),
+        "exact_numpy": latency_summary(samples),
+        "exact_numpy_batched": {
+            "queries_per_s": len(queries) / batch_seconds,
+            "speedup": sum(samples) / batch_seconds,
+        },
+        "sqlite_vec": _sqlite_vec_latency(vectors, queries, k) if vectors.shape[0] <= 200_000 else None,
+        "ivf": {"lists": int(ivf.centroids.shape[0]), "build_s": build_seconds, "results": ivf_results},
+    }
+
+
+def run(input_path=None, size=None, queries=200, k=10):
+    """
+    Relatório de recall x latência: busca exata (NumPy, sqlite-vec) vs. IVF com vários nprobe.
+
+    `input_path` pode apontar para uma matriz float32 .npy (ex.: o vectors.npy da exportação binária).
+    """
+    if input_path:
+        datasets = [np.load(input_path, mmap_mode="r")]
+    else:
+        datasets = (synthetic_vectors(count) for count in ([size] if size else DEFAULT_SIZES))
+    return {
+        "benchmark": "search",
+        "input": input_path or "synthetic",
+        "k": k,
+        "queries": queries,
+        "results": [_run_size(np.asarray(vectors, dtype=np.float32), queries, k) for vectors in datasets],
+    }
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from benchmarks.stats import latency_summary
+
+QUESTIONS = (
+    "O que é RAG?",
+    "Como funciona o chunking dos documentos?",
+    "Quais formatos de arquivo são suportados?",
+    "Como o cache de embeddings é armazenado?",
+    "Qual o limite de requisições da API?",
+)
+
+
+async def _request(reader, writer, host, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _load(url, path, total, concurrency, unique_questions):
+    parts = urlsplit(url)
+    counter = iter(range(total))
+    latencies, statuses = [], {}
+
+    async def client():
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+        try:
+            for i in counter:
+                # Poucas perguntas distintas: a maior parte do tráfego se repete
+                question = f"{QUESTIONS[i % len(QUESTIONS)]} #{i % unique_questions}"
+                payload = {"question": question} if path == "/ask" else {"query": question}
+                start = time.perf_counter()
+                status = await _request(reader, writer, parts.hostname, path, payload)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests_per_s": total / elapsed,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        **latency_summary(latencies),
+    }
+
+
+def _start_local_service():
+    """Sobe o serviço com o backend falso numa thread, em porta livre, sobre o banco configurado."""
+    from modules.service import create_service
+    service = create_service(fake=True)
+    started = threading.Event()
+    state = {}
+
+    def serve():
+        async def main():
+            server = await service.start("127.0.0.1", 0)
+            state["loop"], state["server"] = asyncio.get_running_loop(), server
+            state["url"] = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            started.set()
+            async with server:
+                try:
+                    await server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+        asyncio.run(main())
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        state["loop"].call_soon_threadsafe(state["server"].close)
+        thread.join(timeout=5)
+        service.close()
+
+    return state["url"], stop
+
+
+def run(input_path=None, size=2_000, concurrency=64, unique_questions=50):
+    """
+    Teste de carga dos endpoints /search e /ask.
+
+    `input_path` pode ser a URL de um serviço já em execução (--serve); sem ela, o
+    serviço sobe em processo com o backend falso (embeddings e respostas simulados)
+    sobre o banco configurado.
+    """
+    if input_path:
+        url, stop = input_path, None
+    else:
+        url, stop = _start_local_service()
+    try:
+        return {
+            "benchmark": "service",
+            "url": url,
+            "search": asyncio.run(_load(url, "/search", size, concurrency, unique_questions)),
+            "ask": asyncio.run(_load(url, "/ask", size, concurrency, unique_questions)),
+        }
+    finally:
+        if stop is not None:
+            stop()
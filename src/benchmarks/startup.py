@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.stats import latency_summary
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# Comandos baratos, que não devem carregar o SDK nem abrir o banco
+COMMANDS = {
+    "help": ["--help"],
+    "print-metrics": ["--print-metrics"],
+    "prometheus-metrics": ["--prometheus-metrics"],
+}
+# Módulos pesados cujo carregamento é verificado em cada comando
+HEAVY_MODULES = ("google.generativeai", "numpy", "PyPDF2", "bs4", "sqlite_vec")
+
+
+def _imported(args, cwd):
+    """
+    Módulos importados pelo comando (via -X importtime) e o tempo total de import, em ms
+    (soma dos imports de primeiro nível, que já incluem os aninhados).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, capture_output=True, text=True)
+    modules, total = set(), 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        # Imports aninhados vêm indentados depois do espaço separador
+        if not name[1:].startswith(" "):
+            total += int(cumulative) / 1000
+    return modules, total
+
+
+def _measure(args, cwd, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    modules, imports_ms = _imported(args, cwd)
+    return {
+        **latency_summary(samples),
+        "imports_ms": imports_ms,
+        "heavy_modules": [name for name in HEAVY_MODULES if name in modules],
+    }
+
+
+def run(input_path=None, size=10):
+    """
+    Tempo de inicialização do CLI: `size` execuções de cada comando barato em um processo novo.
+
+    Como referência, mede também o interpretador vazio e o import do google.generativeai,
+    que antes acontecia em toda execução do main.py. `input_path` pode ser outro script
+    de entrada no lugar do src/main.py. Roda em um diretório temporário.
+    """
+    main = input_path or MAIN
+    with tempfile.TemporaryDirectory() as cwd:
+        commands = {name: _measure([main, *args], cwd, size) for name, args in COMMANDS.items()}
+        return {
+            "benchmark": "startup",
+            "main": main,
+            "runs": size,
+            "python": _measure(["-c", "pass"], cwd, size),
+            "import_google_generativeai": _measure(["-c", "import google.generativeai"], cwd, min(size, 3)),
+            "commands": commands,
+        }
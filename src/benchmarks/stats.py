@@ -0,0 +1,22 @@
+import time
+import numpy as np
+
+
+def latency_summary(samples):
+    """Resumo de latências (em segundos) como p50/p95/p99/média em milissegundos."""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if values.size == 0:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def timed(func, *args, **kwargs):
+    """Executa func e retorna (resultado, segundos)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -1,19 +1,119 @@
 import os
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
 
 @dataclass
 class DatabaseConfig:
     url: str = "sqlite:///my_database.db"
     embedding_dimension: int = 768
+    bulk_insert_batch_size: int = 5_000
+    # "float" (float32), "int8" (escalar) ou "bit" (1 bit por dimensão) no índice vec0.
+    # Com quantização, os float32 ficam em vectors_full para o re-ranking.
+    vector_storage: str = "float"
+    # Componentes em [-int8_range, int8_range] são mapeados para [-127, 127]
+    int8_range: float = 0.25
+    # Candidatos da primeira passada quantizada = k * rerank_oversample
+    rerank_oversample: int = 4
+    # Partição (vec0 PARTITION KEY) usada quando a ingestão não informa uma coleção
+    default_collection: str = "default"
 
 @dataclass
 class EmbeddingConfig:
     model_name: str = "text-embedding-004"
     chunk_size: int = 384
     chunk_overlap: int = 38
+    # "boundary" ajusta os cortes a parágrafos/frases/palavras; "fixed" corta em offsets fixos
+    chunk_strategy: str = "boundary"
+    boundary_tolerance: int = 96
     batch_size: int = 5
+    # Teto (em segundos) do backoff aplicado após erros de cota (HTTP 429)
     rate_limit_delay: int = 65
+    requests_per_minute: int = 60
+    texts_per_minute: int = 300
+    max_concurrent_batches: int = 4
+    max_retries: int = 5
+    backoff_initial_delay: float = 2.0
+    # Quantas rodadas de lotes concorrentes ficam em memória no pipeline em streaming
+    pipeline_rounds: int = 2
+
+@dataclass
+class CacheConfig:
+    # "vector" (arquivo único memory-mapped) ou "pickle" (um arquivo por embedding)
+    backend: str = "vector"
+    max_entries: int = 500_000
+    hot_entries: int = 10_000
+    # Cache de respostas do RAG (tabela answer_cache no banco)
+    answer_cache_enabled: bool = True
+    answer_ttl_seconds: int = 7 * 24 * 3600
+    answer_max_entries: int = 10_000
+    # Similaridade de cosseno mínima entre perguntas para reaproveitar uma resposta
+    answer_similarity_threshold: float = 0.95
+
+@dataclass
+class DedupConfig:
+    # Duplicatas (mesmo hash) e quase duplicatas (MinHash/LSH) compartilham um único vetor
+    enabled: bool = True
+    # Similaridade de Jaccard estimada mínima entre os shingles de dois chunks
+    threshold: float = 0.9
+    # Palavras por shingle
+    shingle_size: int = 5
+    # Permutações do MinHash, divididas em `bands` faixas de num_perm / bands linhas no LSH
+    num_perm: int = 64
+    bands: int = 8
+
+@dataclass
+class IngestConfig:
+    # Processos de extração/chunking; None usa os.cpu_count()
+    workers: Optional[int] = None
+    extensions: Tuple[str, ...] = (".pdf", ".md")
+    # "structured" converte o Markdown direto em texto, por seção; "html" renderiza com markdown + BeautifulSoup
+    markdown_extractor: str = "structured"
+
+@dataclass
+class SearchConfig:
+    # "sqlite" (vec0), "numpy" (força bruta em memória) ou "ivf" (k-means + nprobe)
+    backend: str = "sqlite"
+    top_k: int = 10
+    # None usa 4 * sqrt(N) listas
+    ivf_lists: Optional[int] = None
+    nprobe: int = 8
+    kmeans_iterations: int = 10
+    kmeans_sample_size: int = 100_000
+    # "vector" (só embeddings) ou "hybrid" (BM25 do FTS5 + vetorial, fundidos por reciprocal rank fusion)
+    retrieval: str = "hybrid"
+    # Constante do RRF: score = soma de 1 / (rrf_k + posição) em cada lista
+    rrf_k: int = 60
+    # Candidatos buscados em cada lista antes da fusão, como múltiplo de k
+    hybrid_oversample: int = 3
+    # Atalho lexical: sem embedding da consulta quando o melhor resultado do BM25 tem
+    # score >= lexical_min_score e pelo menos lexical_margin vezes o score do segundo
+    lexical_fast_path: bool = True
+    lexical_min_score: float = 5.0
+    lexical_margin: float = 2.0
+
+@dataclass
+class ContextConfig:
+    # Orçamento de tokens do contexto enviado ao modelo
+    max_tokens: int = 2_000
+    # Estimativa de caracteres por token (sem tokenizer local)
+    chars_per_token: float = 4.0
+
+@dataclass
+class ServiceConfig:
+    host: str = "127.0.0.1"
+    port: int = 8080
+    # Conexões somente leitura do pool de busca
+    pool_size: int = 4
+    # Requisições processadas ao mesmo tempo; acima disso esperam na fila
+    max_concurrency: int = 8
+    # Requisições aguardando; acima disso o serviço responde 503 (backpressure)
+    max_pending: int = 64
+    request_timeout: float = 60.0
+    max_body_bytes: int = 1_000_000
+    # Latências simuladas do backend falso (--serve --fake-backend)
+    fake_embedding_latency: float = 0.05
+    fake_generation_latency: float = 0.5
+    fake_first_token_latency: float = 0.15
 
 @dataclass
 class AppConfig:
@@ -22,6 +122,12 @@ class AppConfig:
     google_api_key: Optional[str]
     logging_level: str
     gen_ai_model: str
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    ingest: IngestConfig = field(default_factory=IngestConfig)
+    dedup: DedupConfig = field(default_factory=DedupConfig)
+    search: SearchConfig = field(default_factory=SearchConfig)
+    context: ContextConfig = field(default_factory=ContextConfig)
+    service: ServiceConfig = field(default_factory=ServiceConfig)
 
     @classmethod
     def from_env(cls) -> 'AppConfig':
@@ -30,7 +136,13 @@ class AppConfig:
             embedding=EmbeddingConfig(),
             google_api_key=os.getenv("GOOGLE_AI_API"),
             logging_level="INFO",
-            gen_ai_model="gemini-2.5-flash-preview-05-20"
+            gen_ai_model="gemini-2.5-flash-preview-05-20",
+            cache=CacheConfig(),
+            ingest=IngestConfig(),
+            dedup=DedupConfig(),
+            search=SearchConfig(),
+            context=ContextConfig(),
+            service=ServiceConfig()
         )
     
 # Global config instance
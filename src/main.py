@@ -1,9 +1,10 @@
 import logging
 import argparse
-from modules.google_ai_commands import process_embeddings, carregar_modelos, prompt_request
-from modules.files import import_embeddings_from_csv, get_csv_file_path
-from modules.database import initialize_database, insert_vector, recreate_tables
-from modules.metrics import MetricsDashboard
+from benchmarks import BENCHMARKS
+from config.settings import config
+
+# Os módulos de cada comando são importados dentro do seu bloco: o SDK do Google,
+# numpy e os extratores de PDF/Markdown só são carregados pelos comandos que os usam
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,29 +13,103 @@ logger = logging.getLogger(__name__)
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="IA com RAG.")
-    parser.add_argument('--import-csv', action='store_true', help='Importar embeddings de um arquivo CSV')
+    parser.add_argument('--import-csv', action='store_true', help='Importar embeddings de um arquivo CSV (formato legado)')
+    parser.add_argument('--export', nargs='?', const='', metavar='DIR', help='Exportar os embeddings do banco no formato binário (vectors.npy + records.jsonl)')
+    parser.add_argument('--import', dest='import_dir', nargs='?', const='', metavar='DIR', help='Importar embeddings no formato binário para o banco')
     parser.add_argument('--recreate-tables', action='store_true', help='Recriar tabelas no banco de dados')
     parser.add_argument('--rag-prompt', action='store_true', help='Prompt para RAG')
     parser.add_argument('--load-models', action='store_true', help='Carregar modelos do Google Generative AI')
     parser.add_argument('--print-metrics', action='store_true', help='Imprimir métricas de desempenho')
-    parser.add_argument('--generate-embeddings', type=str, choices=['db', 'file'], help='Gerar embeddings a partir de um arquivo')
+    parser.add_argument('--prometheus-metrics', nargs='?', const='', metavar='FILE', help='Exportar o histórico de métricas no formato texto do Prometheus (stdout ou arquivo)')
+    parser.add_argument('--generate-embeddings', type=str, choices=['db', 'file'], help='Gerar embeddings a partir de um arquivo (db: banco, file: exportação binária)')
+    parser.add_argument('--ingest', metavar='DIR|GLOB', help='Ingerir todos os PDFs/Markdown de um diretório ou glob, sem interação')
+    parser.add_argument('--incremental', action='store_true', help='Com --ingest: pular arquivos inalterados, reembedar só chunks alterados e remover documentos apagados')
+    parser.add_argument('--resume', nargs='?', const='', metavar='JOB_ID', help='Retomar o job de embedding interrompido mais recente (ou JOB_ID) a partir do último lote gravado')
+    parser.add_argument('--workers', type=int, help='Número de processos de extração usados pelo --ingest')
+    parser.add_argument('--collection', help='Coleção (partição do índice vetorial) usada pelo --ingest e pelo --rag-prompt')
+    parser.add_argument('--source', action='append', help='Com --rag-prompt: buscar só nos chunks desta fonte (pode repetir)')
+    parser.add_argument('--section', action='append', help='Com --rag-prompt: buscar só nesta seção (caminho de títulos, ex.: "Guia > Instalação") e subseções (pode repetir)')
+    parser.add_argument('--top-k', type=int, help='Com --rag-prompt: número de chunks recuperados por pergunta')
+    parser.add_argument('--build-index', action='store_true', help='Reconstruir o índice de busca em processo (backends numpy/ivf)')
+    parser.add_argument('--serve', action='store_true', help='Iniciar o serviço HTTP de busca e RAG (/health, /search, /ask)')
+    parser.add_argument('--host', default=config.service.host, help='Endereço do --serve')
+    parser.add_argument('--port', type=int, default=config.service.port, help='Porta do --serve')
+    parser.add_argument('--fake-backend', action='store_true', help='Com --serve: embeddings e respostas simulados, sem chamar a API (testes de carga)')
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS), help='Executar um benchmark local (sem chamadas à API)')
+    parser.add_argument('--benchmark-input', metavar='PATH', help='Arquivo de entrada do benchmark (padrão: corpus sintético)')
+    parser.add_argument('--benchmark-size', type=int, help='Tamanho do corpus sintético do benchmark')
+    parser.add_argument('--benchmark-output', metavar='FILE', help='Salvar o resultado do benchmark em JSON')
+    parser.add_argument('--benchmark-compare', metavar='FILE', help='Comparar com um resultado salvo (ex.: de outro commit) e listar regressões')
     args = parser.parse_args()
     
     if args.import_csv:
+        from modules.database import initialize_database, bulk_insert_vectors
+        from modules.files import import_embeddings_from_csv, get_csv_file_path
         initialize_database()
         csv_file_path = get_csv_file_path()
-        import_embeddings_from_csv(csv_file_path, insert_vector)
+        import_embeddings_from_csv(csv_file_path, bulk_insert_vectors)
+    if args.export is not None:
+        from modules.database import initialize_database
+        from modules.export import export_database
+        from modules.files import get_export_dir_path
+        initialize_database()
+        export_database(args.export or get_export_dir_path())
+    if args.import_dir is not None:
+        from modules.database import initialize_database, bulk_insert_vectors
+        from modules.export import import_export
+        from modules.files import get_export_dir_path
+        initialize_database()
+        import_export(args.import_dir or get_export_dir_path(), bulk_insert_vectors)
     if args.recreate_tables:
+        from modules.database import recreate_tables
         recreate_tables()
     if args.rag_prompt:
+        from modules.database import initialize_database
+        from modules.google_ai_commands import prompt_request
         initialize_database()
-        prompt_request()
+        prompt_request(args.top_k, args.collection, args.source, args.section)
     if args.load_models:
+        from modules.google_ai_commands import carregar_modelos
         carregar_modelos()
     if args.print_metrics:
+        from modules.metrics import MetricsDashboard
         metrics = MetricsDashboard()
         metrics.print_dashboard()
+    if args.prometheus_metrics is not None:
+        from modules.metrics import MetricsDashboard
+        MetricsDashboard().print_prometheus(output=args.prometheus_metrics or None)
     if args.generate_embeddings and args.generate_embeddings in ["db", "file"]:
+        from modules.database import initialize_database
+        from modules.google_ai_commands import process_embeddings
+        from modules.metrics import MetricsDashboard
         initialize_database()
         process_embeddings(args.generate_embeddings)
-
+        # Depois do retorno, para incluir o processing_time registrado pelo track_time
+        MetricsDashboard().save_metrics_to_file()
+    if args.ingest:
+        from modules.database import initialize_database
+        from modules.ingest import ingest
+        from modules.metrics import MetricsDashboard
+        initialize_database()
+        ingest(args.ingest, workers=args.workers, incremental=args.incremental,
+               collection=args.collection or config.database.default_collection)
+        MetricsDashboard().save_metrics_to_file()
+    if args.resume is not None:
+        from modules.database import initialize_database
+        from modules.jobs import resume_job
+        from modules.metrics import MetricsDashboard
+        initialize_database()
+        resume_job(int(args.resume) if args.resume else None, workers=args.workers)
+        MetricsDashboard().save_metrics_to_file()
+    if args.build_index:
+        from modules.database import initialize_database
+        from modules.search import NumpyBackend
+        initialize_database()
+        NumpyBackend(use_ivf=config.search.backend == "ivf").build()
+    if args.serve:
+        from modules.service import run_service
+        run_service(args.host, args.port, fake=args.fake_backend)
+    if args.benchmark:
+        from benchmarks import run_benchmark
+        run_benchmark(args.benchmark, input_path=args.benchmark_input, output_path=args.benchmark_output, size=args.benchmark_size,
+                      compare_path=args.benchmark_compare)
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from config.settings import config
+from modules.utils import Emojis
+from modules.vectors import VECTOR_DTYPE, as_vector, vector_blob
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Normaliza a pergunta para comparação exata: Unicode NFKC, minúsculas, espaços e pontuação final."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE.sub(" ", text).strip().rstrip("?!.;: ").strip()
+
+
+def chunk_fingerprint(chunks: Iterable[Tuple[int, str]]) -> str:
+    """
+    Identifica o conjunto de chunks recuperados, como pares (vector_id, content).
+
+    O conteúdo entra no hash porque ids podem ser reaproveitados depois de uma remoção.
+    """
+    digest = hashlib.sha256()
+    for vector_id, content in sorted(chunks, key=lambda chunk: chunk[0]):
+        digest.update(f"{vector_id}\0{content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache de respostas do RAG em uma tabela do próprio banco.
+
+    A busca é feita primeiro pela pergunta normalizada e, se não houver entrada,
+    pela pergunta mais parecida (cosseno dos embeddings de consulta) acima de
+    `similarity_threshold`. Uma resposta só é reaproveitada se o conjunto de chunks
+    recuperado agora for o mesmo usado para gerá-la; entradas expiram após `ttl`
+    segundos e as menos usadas são removidas acima de `max_entries`.
+    """
+
+    def __init__(self, connection, ttl: float = config.cache.answer_ttl_seconds,
+                 max_entries: int = config.cache.answer_max_entries,
+                 similarity_threshold: float = config.cache.answer_similarity_threshold,
+                 clock=time.time):
+        self.db = connection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Matriz dos embeddings (normalizados) para o fallback por similaridade, carregada sob demanda
+        self._keys = None
+        self._matrix = None
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answer_cache(
+                question_key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON answer_cache(last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    def _load_matrix(self) -> None:
+        rows = self.db.execute("SELECT question_key, embedding FROM answer_cache WHERE embedding IS NOT NULL").fetchall()
+        self._keys = [row[0] for row in rows]
+        if rows:
+            matrix = np.stack([as_vector(row[1], dimension=None) for row in rows])
+            self._matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            self._matrix = np.empty((0, 0), dtype=VECTOR_DTYPE)
+
+    def _similar_key(self, embedding) -> Optional[str]:
+        if self._matrix is None:
+            self._load_matrix()
+        if not self._keys:
+            return None
+        query = as_vector(embedding, dimension=self._matrix.shape[1])
+        scores = self._matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        best = int(np.argmax(scores))
+        return self._keys[best] if scores[best] >= self.similarity_threshold else None
+
+    def get(self, question: str, fingerprint: str, embedding=None) -> Optional[str]:
+        """Retorna a resposta em cache para a pergunta, ou None."""
+        with self._lock:
+            now = self._clock()
+            keys = [self._key(question)]
+            if embedding is not None:
+                similar = self._similar_key(embedding)
+                if similar is not None and similar != keys[0]:
+                    keys.append(similar)
+            for key in keys:
+                row = self.db.execute(
+                    "SELECT answer, fingerprint, created_at FROM answer_cache WHERE question_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                answer, cached_fingerprint, created_at = row
+                if now - created_at > self.ttl or cached_fingerprint != fingerprint:
+                    # Expirada ou gerada com outro conjunto de chunks
+                    self._delete(key)
+                    continue
+                self.db.execute("UPDATE answer_cache SET last_used = ?, hits = hits + 1 WHERE question_key = ?", (now, key))
+                self.db.commit()
+                return answer
+            return None
+
+    def set(self, question: str, answer: str, fingerprint: str, embedding=None) -> None:
+        with self._lock:
+            now = self._clock()
+            key = self._key(question)
+            self.db.execute(
+                """
+                INSERT OR REPLACE INTO answer_cache
+                    (question_key, question, embedding, answer, fingerprint, created_at, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, question, vector_blob(embedding, dimension=None) if embedding is not None else None,
+                 answer, fingerprint, now, now)
+            )
+            self._evict(now)
+            self.db.commit()
+            self._matrix = None
+
+    def _delete(self, key: str) -> None:
+        self.db.execute("DELETE FROM answer_cache WHERE question_key = ?", (key,))
+        self.db.commit()
+        self._matrix = None
+
+    def _evict(self, now: float) -> None:
+        self.db.execute("DELETE FROM answer_cache WHERE created_at < ?", (now - self.ttl,))
+        self.db.execute(
+            """
+            DELETE FROM answer_cache WHERE question_key IN (
+                SELECT question_key FROM answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self.db.execute("DELETE FROM answer_cache")
+            self.db.commit()
+            self._matrix = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Cache de respostas compartilhado (None se desabilitado em CacheConfig)."""
+    global _answer_cache
+    if not config.cache.answer_cache_enabled:
+        return None
+    if _answer_cache is None:
+        from modules.database import get_database_connection
+        _answer_cache = AnswerCache(get_database_connection())
+        logger.info(f"{Emojis.INFO.value} Cache de respostas: {len(_answer_cache)} entradas.")
+    return _answer_cache
@@ -0,0 +1,68 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+@dataclass
+class BatchPlan:
+    """
+    Plano de envio de textos para a API de embeddings.
+
+    Separa os textos já em cache (hits) dos que precisam ser gerados (misses).
+    Apenas os misses, sem repetição, são empacotados em lotes de `batch_size`.
+    """
+    texts: Sequence[str]
+    hits: Dict[int, Any] = field(default_factory=dict)
+    # Para cada texto único a gerar, as posições em que ele aparece na entrada
+    miss_positions: Dict[str, List[int]] = field(default_factory=dict)
+    batches: List[List[str]] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.texts)
+
+    @property
+    def hit_count(self) -> int:
+        return len(self.hits)
+
+    @property
+    def miss_count(self) -> int:
+        return self.total - self.hit_count
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hit_count / self.total if self.total else 0.0
+
+    def assemble(self, batch_results: List[List[Any]]) -> List[Any]:
+        """Recoloca hits e resultados da API na ordem original dos textos."""
+        if len(batch_results) != len(self.batches):
+            raise ValueError("Numero de resultados deve ser igual ao numero de lotes")
+        results: List[Optional[Any]] = [None] * self.total
+        for position, embedding in self.hits.items():
+            results[position] = embedding
+        for batch, embeddings in zip(self.batches, batch_results):
+            if len(batch) != len(embeddings):
+                raise ValueError("Numero de textos deve ser igual ao numero de embeddings")
+            for text, embedding in zip(batch, embeddings):
+                for position in self.miss_positions[text]:
+                    results[position] = embedding
+        return results
+
+
+def plan_batches(texts: Sequence[str], lookup: Callable[[str], Optional[Any]], batch_size: int) -> BatchPlan:
+    """Consulta o cache para cada texto e monta lotes cheios apenas com os misses."""
+    if batch_size <= 0:
+        raise ValueError("batch_size deve ser maior que zero")
+    plan = BatchPlan(texts=texts)
+    for position, text in enumerate(texts):
+        if text in plan.miss_positions:
+            plan.miss_positions[text].append(position)
+            continue
+        cached = lookup(text)
+        if cached is not None:
+            plan.hits[position] = cached
+        else:
+            plan.miss_positions[text] = [position]
+
+    unique_misses = list(plan.miss_positions)
+    plan.batches = [unique_misses[i:i + batch_size] for i in range(0, len(unique_misses), batch_size)]
+    return plan
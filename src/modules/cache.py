@@ -2,7 +2,17 @@ import hashlib
 import os
 import pickle
 import json
+import logging
+import struct
+import threading
+from collections import OrderedDict
 from typing import Optional, Any, List
+import numpy as np
+from config.settings import config
+from modules.utils import Emojis
+from modules.vectors import as_vector
+
+logger = logging.getLogger(__name__)
 
 class EmbeddingCache:
     def __init__(self, cache_dir: str = "cache"):
@@ -65,4 +75,232 @@ class EmbeddingCache:
         cache_file = os.path.join(self.cache_dir, f"{key}.pkl")
         
         with open(cache_file, 'wb') as f:
-            pickle.dump(embedding, f)
\ No newline at end of file
+            pickle.dump(embedding, f)
+
+class VectorStoreCache:
+    """
+    Cache de embeddings em um único arquivo float32 append-only e memory-mapped.
+
+    - `vectors.f32`: vetores gravados sequencialmente (um slot por embedding)
+    - `index.bin`: log append-only de (md5 de 16 bytes, slot); slot -1 marca remoção
+    - Camada quente em memória (LRU) para os embeddings mais acessados
+    - Limite de entradas com despejo LRU; slots mortos são compactados periodicamente
+
+    As chaves usam o mesmo esquema do EmbeddingCache (md5 de "texto:modelo"),
+    então o cache em pickle pode ser migrado sem conhecer os textos originais.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.bin"
+    _INDEX_RECORD = struct.Struct("<16sq")
+
+    def __init__(self, cache_dir: str = "cache", dimension: int = config.database.embedding_dimension,
+                 max_entries: int = config.cache.max_entries, hot_entries: int = config.cache.hot_entries):
+        self.cache_dir = cache_dir
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.hot_entries = hot_entries
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, self.VECTORS_FILE)
+        self.index_path = os.path.join(cache_dir, self.INDEX_FILE)
+
+        self._lock = threading.RLock()
+        # Ordem de inserção/acesso do OrderedDict define a fila de despejo
+        self._index: "OrderedDict[bytes, int]" = OrderedDict()
+        self._hot: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._index_records = 0
+        self._slots = 0
+        self._map: Optional[np.memmap] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @staticmethod
+    def _get_cache_key(text: str, model: str) -> bytes:
+        return hashlib.md5(f"{text}:{model}".encode('utf-8')).digest()
+
+    def _load(self) -> None:
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % self._INDEX_RECORD.size  # ignora registro truncado
+            for key, slot in self._INDEX_RECORD.iter_unpack(data[:usable]):
+                self._index_records += 1
+                if slot < 0:
+                    self._index.pop(key, None)
+                else:
+                    self._index.pop(key, None)
+                    self._index[key] = slot
+        if os.path.exists(self.vectors_path):
+            self._slots = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+            # Descarta bytes de uma escrita interrompida: o próximo append começa no slot self._slots
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self._slots * 4 * self.dimension)
+        # Descarta entradas cujo vetor não chegou a ser gravado por completo
+        for key in [key for key, slot in self._index.items() if slot >= self._slots]:
+            del self._index[key]
+
+    def _vectors(self) -> np.ndarray:
+        if self._map is None or self._map.shape[0] < self._slots:
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._slots, self.dimension))
+        return self._map
+
+    def _as_vector(self, embedding: Any) -> np.ndarray:
+        return as_vector(embedding, self.dimension)
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if self.hot_entries <= 0:
+            return
+        self._hot[key] = vector
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def get_many(self, texts: List[str], model: str) -> List[Optional[np.ndarray]]:
+        """Busca vários embeddings de uma vez; posições sem cache retornam None."""
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        cold = []
+        with self._lock:
+            for position, text in enumerate(texts):
+                key = self._get_cache_key(text, model)
+                slot = self._index.get(key)
+                if slot is None:
+                    continue
+                self._index.move_to_end(key)
+                hot = self._hot.get(key)
+                if hot is not None:
+                    self._hot.move_to_end(key)
+                    results[position] = hot
+                else:
+                    cold.append((position, key, slot))
+            if cold:
+                # Uma única leitura indexada no memmap, em ordem de slot
+                cold.sort(key=lambda item: item[2])
+                rows = np.array(self._vectors()[[slot for _, _, slot in cold]])
+                for (position, key, _), row in zip(cold, rows):
+                    results[position] = row
+                    self._remember(key, row)
+        return results
+
+    def set_many(self, texts: List[str], model: str, embeddings: List[Any]) -> None:
+        """Grava vários embeddings com um único append no arquivo de vetores."""
+        if len(texts) != len(embeddings):
+            raise ValueError("Numero de textos deve ser igual ao numero de embeddings")
+        if not texts:
+            return
+        pending: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        for text, embedding in zip(texts, embeddings):
+            pending[self._get_cache_key(text, model)] = self._as_vector(embedding)
+        self._append(pending)
+
+    def _append(self, entries: "OrderedDict[bytes, np.ndarray]") -> None:
+        with self._lock:
+            first_slot = self._slots
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.stack(list(entries.values())).tobytes())
+            records = bytearray()
+            for offset, (key, vector) in enumerate(entries.items()):
+                slot = first_slot + offset
+                self._index.pop(key, None)
+                self._index[key] = slot
+                self._remember(key, vector)
+                records += self._INDEX_RECORD.pack(key, slot)
+            self._slots += len(entries)
+            self._write_index_records(records, len(entries))
+            self._evict()
+
+    def _write_index_records(self, records: bytes, count: int) -> None:
+        with open(self.index_path, 'ab') as f:
+            f.write(records)
+        self._index_records += count
+
+    def _evict(self) -> None:
+        overflow = len(self._index) - self.max_entries
+        if overflow > 0:
+            records = bytearray()
+            for _ in range(overflow):
+                key, _ = self._index.popitem(last=False)
+                self._hot.pop(key, None)
+                records += self._INDEX_RECORD.pack(key, -1)
+            self._write_index_records(records, overflow)
+        # Compacta quando mais da metade dos slots ou registros do índice está morta
+        if self._slots > 2 * max(len(self._index), 1) or self._index_records > 2 * max(len(self._index), 1):
+            self.compact()
+
+    def compact(self) -> None:
+        """Reescreve os arquivos mantendo apenas as entradas vivas, na ordem LRU."""
+        with self._lock:
+            keys = list(self._index)
+            tmp_vectors = self.vectors_path + ".tmp"
+            tmp_index = self.index_path + ".tmp"
+            if keys:
+                slots = np.fromiter(self._index.values(), dtype=np.int64, count=len(keys))
+                live = np.ascontiguousarray(self._vectors()[slots])
+            else:
+                live = np.empty((0, self.dimension), dtype=np.float32)
+            with open(tmp_vectors, 'wb') as f:
+                f.write(live.tobytes())
+            with open(tmp_index, 'wb') as f:
+                f.write(b"".join(self._INDEX_RECORD.pack(key, slot) for slot, key in enumerate(keys)))
+            self._map = None
+            os.replace(tmp_vectors, self.vectors_path)
+            os.replace(tmp_index, self.index_path)
+            self._index = OrderedDict((key, slot) for slot, key in enumerate(keys))
+            self._slots = len(keys)
+            self._index_records = len(keys)
+
+    def get(self, text: str, model: str) -> Optional[np.ndarray]:
+        """Get cached embedding"""
+        return self.get_many([text], model)[0]
+
+    def set(self, text: str, model: str, embedding: Any) -> None:
+        """Cache embedding"""
+        self.set_many([text], model, [embedding])
+
+    def get_batch(self, texts: List[str], model: str) -> Optional[List[np.ndarray]]:
+        """Get cached embeddings for batch of texts"""
+        embeddings = self.get_many(texts, model)
+        if any(embedding is None for embedding in embeddings):
+            return None
+        return embeddings
+
+    def set_batch(self, texts: List[str], model: str, embeddings: List[Any]) -> None:
+        """Cache embeddings for batch of texts"""
+        self.set_many(texts, model, embeddings)
+
+    def migrate_from(self, legacy: EmbeddingCache) -> int:
+        """Importa os embeddings individuais de um EmbeddingCache em pickle. Retorna quantos migraram."""
+        entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        for file_name in sorted(os.listdir(legacy.cache_dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension != ".pkl" or len(name) != 32:
+                continue
+            try:
+                with open(os.path.join(legacy.cache_dir, file_name), 'rb') as f:
+                    value = pickle.load(f)
+                # Arquivos de lote guardam listas de embeddings; os individuais já foram salvos à parte
+                if isinstance(value, list):
+                    continue
+                key = bytes.fromhex(name)
+                if key not in self._index:
+                    entries[key] = self._as_vector(value)
+            except (ValueError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f"{Emojis.WARNING.value} Ignorando entrada de cache inválida {file_name}: {e}")
+        if entries:
+            self._append(entries)
+        logger.info(f"{Emojis.SUCCESS.value} {len(entries)} embeddings migrados do cache em pickle.")
+        return len(entries)
+
+
+def create_embedding_cache(cache_dir: str):
+    """Cria o backend de cache configurado, migrando o cache em pickle na primeira execução."""
+    if config.cache.backend == "pickle":
+        return EmbeddingCache(cache_dir=cache_dir)
+
+    needs_migration = not os.path.exists(os.path.join(cache_dir, VectorStoreCache.INDEX_FILE))
+    cache = VectorStoreCache(cache_dir=cache_dir)
+    if needs_migration and any(name.endswith(".pkl") for name in os.listdir(cache_dir)):
+        logger.info(f"{Emojis.PROCESSING.value} Migrando cache em pickle para {cache.vectors_path}")
+        cache.migrate_from(EmbeddingCache(cache_dir=cache_dir))
+    return cache
@@ -0,0 +1,228 @@
+import bisect
+import hashlib
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+from config.settings import config
+
+
+class Chunk(NamedTuple):
+    """Chunk com seus offsets (em caracteres) no texto do documento: text == documento[start:end]."""
+    text: str
+    start: int
+    end: int
+
+
+def _check_chunk_params(chunk_size, chunk_overlap):
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise ValueError("chunk_size deve ser positivo e chunk_overlap menor que chunk_size")
+
+
+# chunk_size=1536, chunk_overlap=153 config para gemini
+def split_text(text, chunk_size=config.embedding.chunk_size, chunk_overlap=config.embedding.chunk_overlap):
+    """Divide o texto em chunks com sobreposição."""
+    _check_chunk_params(chunk_size, chunk_overlap)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+        start += chunk_size - chunk_overlap
+        if end >= len(text):
+            break
+    return chunks
+
+
+def _iter_fixed_chunks(segments: Iterable[str], chunk_size: int, chunk_overlap: int) -> Iterator[Chunk]:
+    _check_chunk_params(chunk_size, chunk_overlap)
+    step = chunk_size - chunk_overlap
+    buffer = ""
+    # Offset do início do buffer no texto original (antes do strip)
+    base = 0
+    started = False
+    for segment in segments:
+        if not started:
+            stripped = segment.lstrip()
+            base += len(segment) - len(stripped)
+            segment = stripped
+            if not segment:
+                continue
+            started = True
+        buffer += segment
+        # Espaços no final podem ser removidos pelo strip final; só emite o que certamente não é o último chunk
+        content_length = len(buffer.rstrip())
+        start = 0
+        while content_length - start > chunk_size:
+            yield Chunk(buffer[start:start + chunk_size], base + start, base + start + chunk_size)
+            start += step
+        buffer = buffer[start:]
+        base += start
+
+    buffer = buffer.rstrip()
+    for index, text in enumerate(split_text(buffer, chunk_size, chunk_overlap) if buffer else []):
+        start = base + index * step
+        yield Chunk(text, start, start + len(text))
+
+
+def iter_chunks(segments: Iterable[str], chunk_size: int = config.embedding.chunk_size,
+                chunk_overlap: int = config.embedding.chunk_overlap) -> Iterator[str]:
+    """
+    Versão em streaming de split_text para textos que chegam em pedaços (páginas, seções).
+
+    Produz exatamente os mesmos chunks que split_text("".join(segments).strip()),
+    carregando a sobreposição entre páginas. A memória usada fica limitada ao
+    tamanho de um chunk mais o segmento atual.
+    """
+    for chunk in _iter_fixed_chunks(segments, chunk_size, chunk_overlap):
+        yield chunk.text
+
+
+# Fronteiras em ordem de preferência: parágrafo/título, fim de frase, palavra
+_BOUNDARY_PATTERNS = (
+    re.compile(r"\n[ \t]*\n\s*|\n(?=#)"),
+    re.compile(r"[.!?…][\"'”’)\]]*\s+"),
+    re.compile(r"\s+"),
+)
+_WHITESPACE = re.compile(r"\s+")
+_NON_WHITESPACE = re.compile(r"\S")
+
+
+def _rstrip_end(text: str, start: int, end: int) -> int:
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+class BoundaryChunker:
+    """
+    Chunker que trabalha com offsets e ajusta os cortes a fronteiras do texto.
+
+    Cada corte é deslocado para a fronteira de maior prioridade (parágrafo ou título,
+    fim de frase, espaço entre palavras) a até `tolerance` caracteres do tamanho alvo.
+    O início do chunk seguinte recua `chunk_overlap` caracteres e avança até o começo
+    de uma palavra. Os spans são calculados sobre o texto original, sem fatiá-lo;
+    a string do chunk só é criada ao emitir.
+    """
+
+    def __init__(self, chunk_size: int = config.embedding.chunk_size,
+                 chunk_overlap: int = config.embedding.chunk_overlap,
+                 tolerance: int = config.embedding.boundary_tolerance):
+        _check_chunk_params(chunk_size, chunk_overlap)
+        if not 0 <= tolerance < chunk_size:
+            raise ValueError("tolerance deve ser menor que chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.tolerance = tolerance
+
+    def _find_boundary(self, text: str, target: int, low: int, high: int) -> int:
+        for pattern in _BOUNDARY_PATTERNS:
+            best = None
+            for match in pattern.finditer(text, low, high):
+                end = match.end()
+                if best is None or abs(end - target) < abs(best - target):
+                    best = end
+                if end > target:
+                    break
+            if best is not None:
+                return best
+        return target
+
+    def _next_start(self, text: str, previous_start: int, end: int) -> int:
+        start = end - self.chunk_overlap
+        if self.chunk_overlap and start > 0 and not text[start - 1].isspace():
+            # Evita começar no meio de uma palavra
+            match = _WHITESPACE.search(text, start, end)
+            if match:
+                start = match.end()
+        return max(start, previous_start + 1)
+
+    def _spans(self, text: str, pos: int, final: bool, out: List[tuple]) -> int:
+        """Calcula spans a partir de `pos` e retorna onde parou (texto insuficiente se `final` for False)."""
+        length = len(text)
+        while True:
+            match = _NON_WHITESPACE.search(text, pos)
+            if match is None:
+                return length
+            pos = match.start()
+            remaining = length - pos
+            if not final and remaining <= self.chunk_size + self.tolerance:
+                return pos
+            if final and remaining <= self.chunk_size:
+                out.append((pos, _rstrip_end(text, pos, length)))
+                return length
+            target = pos + self.chunk_size
+            end = self._find_boundary(text, target, target - self.tolerance, min(length, target + self.tolerance))
+            out.append((pos, _rstrip_end(text, pos, end)))
+            pos = self._next_start(text, pos, end)
+
+    def spans(self, text: str) -> List[tuple]:
+        """Retorna os spans (start, end) de todo o texto, sem materializar os chunks."""
+        out: List[tuple] = []
+        self._spans(text, 0, True, out)
+        return out
+
+    def iter_chunks(self, segments: Iterable[str]) -> Iterator[Chunk]:
+        """Chunking em streaming; offsets relativos a "".join(segments)."""
+        buffer = ""
+        base = 0
+        pos = 0
+        spans: List[tuple] = []
+        for segment in segments:
+            buffer += segment
+            pos = self._spans(buffer, pos, False, spans)
+            for start, end in spans:
+                yield Chunk(buffer[start:end], base + start, base + end)
+            spans.clear()
+            # Descarta o que já foi emitido; sobra no máximo um chunk + tolerância + segmento
+            buffer = buffer[pos:]
+            base += pos
+            pos = 0
+        self._spans(buffer, pos, True, spans)
+        for start, end in spans:
+            yield Chunk(buffer[start:end], base + start, base + end)
+
+
+def iter_document_chunks(segments: Iterable[str], strategy: str = config.embedding.chunk_strategy) -> Iterator[Chunk]:
+    """Aplica o chunker configurado (`fixed` ou `boundary`) a um texto em streaming."""
+    if strategy == "boundary":
+        return BoundaryChunker().iter_chunks(segments)
+    if strategy == "fixed":
+        return _iter_fixed_chunks(segments, config.embedding.chunk_size, config.embedding.chunk_overlap)
+    raise ValueError(f"Estratégia de chunking desconhecida: {strategy}")
+
+
+def iter_section_chunks(sections: Iterable, strategy: str = config.embedding.chunk_strategy) -> Iterator[Tuple[Chunk, tuple]]:
+    """
+    Chunking em streaming de seções (ver modules.files.Section): gera (chunk, heading_path),
+    com o caminho de títulos da seção em que o chunk começa. Offsets relativos ao texto inteiro.
+    """
+    starts: List[int] = []
+    paths: List[tuple] = []
+
+    def texts():
+        offset = 0
+        for heading_path, text in sections:
+            starts.append(offset)
+            paths.append(heading_path)
+            offset += len(text)
+            yield text
+
+    # O chunker só emite um chunk depois de ler a seção em que ele começa
+    for chunk in iter_document_chunks(texts(), strategy):
+        yield chunk, paths[bisect.bisect_right(starts, chunk.start) - 1]
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Agrupa um iterável em listas de até `size` elementos."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_chunk(text: str) -> str:
+    """Hash de conteúdo de um chunk, usado na reindexação incremental."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
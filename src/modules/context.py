@@ -0,0 +1,116 @@
+import math
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from config.settings import config
+from modules import database
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _Span(NamedTuple):
+    start: int
+    end: int
+    text: str
+
+
+class _Group:
+    """Trechos selecionados de uma mesma fonte (seção de um documento ou, sem offsets, descrição)."""
+
+    def __init__(self, source: Optional[str], rank: int, section: Optional[str] = None):
+        self.source = source
+        self.section = section
+        self.rank = rank
+        self.spans: List[_Span] = []
+        # Chunks sem offsets (bancos antigos) não podem ser mesclados
+        self.loose: List[str] = []
+
+    def new_characters(self, span: _Span) -> int:
+        """Caracteres que o span acrescenta além do que já está no grupo."""
+        covered = sum(max(0, min(span.end, other.end) - max(span.start, other.start)) for other in self.spans)
+        return max(0, len(span.text) - covered)
+
+    def merged(self) -> List[str]:
+        """Textos do grupo em ordem de documento, com spans sobrepostos ou vizinhos mesclados."""
+        texts = []
+        current = None
+        for span in sorted(self.spans):
+            if current is not None and span.start <= current.end:
+                # Acrescenta só o que passa do fim do trecho atual
+                extra = span.text[current.end - span.start:] if span.end > current.end else ""
+                current = _Span(current.start, max(current.end, span.end), current.text + extra)
+                continue
+            if current is not None:
+                texts.append(current.text)
+            current = span
+        if current is not None:
+            texts.append(current.text)
+        return texts + self.loose
+
+
+def estimate_tokens(text: str, chars_per_token: float = config.context.chars_per_token) -> int:
+    return math.ceil(len(text) / chars_per_token)
+
+
+def build_context(hits: Sequence, max_tokens: int = config.context.max_tokens,
+                  positions: Optional[Dict[Tuple[int, str], Tuple]] = None) -> str:
+    """
+    Monta o contexto do prompt a partir dos SearchHit, em ordem de relevância, até `max_tokens`.
+
+    - chunks repetidos (mesmo texto) entram uma vez;
+    - chunks da mesma seção de um documento que se sobrepõem ou se tocam (offsets em
+      metadata) são mesclados, sem repetir a sobreposição;
+    - o resultado é agrupado por fonte e seção (caminho de títulos), com o nome da fonte
+      e a seção uma única vez por grupo.
+
+    Chunks que não cabem no orçamento restante são pulados (um menor ainda pode caber).
+    `positions` evita a consulta ao banco:
+    {(vector_id, fonte): (document_id, chunk_index, start, end, section)} (ver database.get_chunk_positions).
+    """
+    if positions is None:
+        positions = database.get_chunk_positions([hit.vector_id for hit in hits])
+    chars_per_token = config.context.chars_per_token
+    budget = max_tokens * chars_per_token
+    groups: Dict[object, _Group] = {}
+    seen = set()
+    used = 0
+    for rank, hit in enumerate(hits):
+        text = hit.content.strip()
+        fingerprint = _WHITESPACE.sub(" ", text)
+        if not text or fingerprint in seen:
+            continue
+        document_id, _, start, end, section = positions.get((hit.vector_id, hit.description), (None, None, None, None, None))
+        has_offsets = document_id is not None and start is not None and end is not None
+        key = ("document", document_id, section) if has_offsets else ("source", hit.description)
+        group = groups.get(key) or _Group(hit.description, rank, section if has_offsets else None)
+        if has_offsets:
+            span = _Span(start, end, hit.content)
+            cost = group.new_characters(span)
+        else:
+            cost = len(text)
+        if used + cost > budget:
+            continue
+        seen.add(fingerprint)
+        used += cost
+        groups[key] = group
+        if has_offsets:
+            group.spans.append(span)
+        else:
+            group.loose.append(text)
+
+    sections = []
+    for index, group in enumerate(sorted(groups.values(), key=lambda g: g.rank), start=1):
+        body = "\n[...]\n".join(text.strip() for text in group.merged())
+        heading = f" — {group.section}" if group.section else ""
+        sections.append(f"[{index}] Fonte: {group.source or 'desconhecida'}{heading}\n{body}")
+    return "\n\n---\n\n".join(sections)
+
+
+def build_rag_prompt(question: str, context: str) -> str:
+    """Monta o prompt do RAG com o contexto já montado por build_context."""
+    return f"""Use o seguinte contexto para responder à pergunta. Se a resposta não estiver no contexto, diga que não sabe.
+
+Contexto:
+{context}
+
+Pergunta: {question}
+"""
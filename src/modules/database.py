@@ -1,107 +1,926 @@
 import sqlite3
 import sqlite_vec
 import logging
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from itertools import groupby, islice
+from typing import Callable, Iterable, List, Optional, Tuple
+import numpy as np
 from config.settings import config
 from modules.files import get_database_path
+from modules.metrics import metrics
+from modules.utils import Emojis
+from modules.vectors import vector_blob, quantize_vector, as_vector
 
 # Logger configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 db = None  # Variável global para a conexão com o banco de dados
+
+# Tipo da coluna vec0 e expressão SQL que converte o blob quantizado, por formato de armazenamento
+_VECTOR_COLUMN_TYPES = {"float": "float", "int8": "int8", "bit": "bit"}
+_VECTOR_SQL = {"float": "?", "int8": "vec_int8(?)", "bit": "vec_bit(?)"}
     
-def get_database_connection():
-    """Obtém a conexão com o banco de dados."""
+def get_database_connection(path: Optional[str] = None):
+    """Obtém a conexão com o banco de dados (em `path`, se ainda não houver conexão aberta)."""
     global db
     if db is None:
-        db_path = get_database_path()
+        db_path = path or get_database_path()
         db = sqlite3.connect(db_path)
     return db
 
-def initialize_database():
+def close_database():
+    """Fecha a conexão global; a próxima initialize_database abre outra (ex.: outro arquivo)."""
+    global db, _existing_storage
+    if db is not None:
+        db.close()
+    db = None
+    _existing_storage = None
+
+def open_connection(read_only: bool = False, path: Optional[str] = None):
+    """
+    Abre uma conexão independente da global, com o sqlite-vec carregado, que pode ser
+    usada por outras threads (uma thread por vez). `read_only` abre o arquivo em mode=ro.
+    """
+    path = path or get_database_path()
+    if read_only:
+        connection = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        connection = sqlite3.connect(path, check_same_thread=False)
+    connection.enable_load_extension(True)
+    sqlite_vec.load(connection)
+    connection.enable_load_extension(False)
+    return connection
+
+# Conexão emprestada de um ConnectionPool para a thread atual (ver _db)
+_local = threading.local()
+
+def _db():
+    """Conexão usada pelas funções de leitura: a emprestada do pool nesta thread ou a global."""
+    return getattr(_local, "connection", None) or db
+
+class ConnectionPool:
+    """
+    Pool de conexões somente leitura para servir buscas em várias threads.
+
+    O sqlite-vec é carregado uma vez por conexão, na criação. Dentro de
+    `with pool.connection():` as funções de leitura deste módulo (search_vectors,
+    get_chunks, iter_embeddings...) usam a conexão emprestada em vez da global.
+    """
+
+    def __init__(self, size: int = config.service.pool_size, path: Optional[str] = None):
+        self.size = size
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(open_connection(read_only=True, path=path))
+
+    @contextmanager
+    def connection(self):
+        connection = self._connections.get()
+        previous = getattr(_local, "connection", None)
+        _local.connection = connection
+        try:
+            yield connection
+        finally:
+            _local.connection = previous
+            self._connections.put(connection)
+
+    def close(self):
+        for _ in range(self.size):
+            self._connections.get().close()
+
+def initialize_database(path: Optional[str] = None):
     """
     Inicializa o banco de dados e cria as tabelas necessárias.
     """
-    enable_extensions()
+    enable_extensions(path)
     create_tables()
 
-def enable_extensions():
+def enable_extensions(path: Optional[str] = None):
     """
     Habilita as extensões necessárias para o banco de dados.
     """
     global db
-    db = get_database_connection()
+    db = get_database_connection(path)
     db.enable_load_extension(True)
     sqlite_vec.load(db)
     db.enable_load_extension(False)
 
-def create_tables():
+# Formato da tabela vectors existente quando difere do configurado (ver create_tables)
+_existing_storage = None
+
+def _vector_storage():
+    return _existing_storage or config.database.vector_storage
+
+def _is_quantized():
+    return _vector_storage() != "float"
+
+def _full_vectors_table():
+    """Tabela com os vetores float32 originais (a própria vectors quando não há quantização)."""
+    return "vectors_full" if _is_quantized() else "vectors"
+
+def _detect_vector_storage():
+    row = db.execute("SELECT sql FROM sqlite_master WHERE name = 'vectors'").fetchone()
+    if row is None:
+        return None
+    for storage, column_type in _VECTOR_COLUMN_TYPES.items():
+        if f"embedding {column_type}[" in row[0]:
+            return storage
+    return None
+
+def _create_vectors_table(name="vectors"):
+    """
+    Índice vec0 particionado por coleção (PARTITION KEY), com a fonte e o documento
+    como colunas de metadata: filtros nesses campos são aplicados durante o KNN.
+    O vec0 não aceita NULL em metadata, então documento ausente é 0 e fonte ausente é ''.
+    """
+    column_type = _VECTOR_COLUMN_TYPES[_vector_storage()]
+    dimension = config.database.embedding_dimension
     db.execute(
         f"""
-        CREATE VIRTUAL TABLE IF NOT EXISTS vectors
+        CREATE VIRTUAL TABLE IF NOT EXISTS {name}
         USING vec0(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            embedding float[{config.database.embedding_dimension}],
+            collection TEXT PARTITION KEY,
+            embedding {column_type}[{dimension}],
+            source TEXT,
+            document_id INTEGER,
         )
         """
     )
+
+def _has_vector_partitions():
+    row = db.execute("SELECT sql FROM sqlite_master WHERE name = 'vectors'").fetchone()
+    return row is not None and "PARTITION KEY" in row[0].upper()
+
+def _migrate_vector_partitions():
+    """
+    Reconstrói a tabela vectors de bancos anteriores às partições por coleção.
+
+    O vec0 não suporta ALTER TABLE, então os vetores passam por uma tabela auxiliar
+    (no próprio arquivo do banco, sem carregar tudo em memória) e são reinseridos
+    com a coleção padrão e a fonte/documento vindos de metadata.
+    """
+    logger.info(f"{Emojis.PROCESSING.value} Migrando a tabela vectors para partições por coleção...")
+    storage = _vector_storage()
+    try:
+        db.execute("DROP TABLE IF EXISTS vectors_migration")
+        db.execute("CREATE TABLE vectors_migration AS SELECT id, embedding FROM vectors")
+        db.execute("DROP TABLE vectors")
+        _create_vectors_table()
+        db.execute(
+            f"""
+            INSERT INTO vectors (id, collection, embedding, source, document_id)
+            SELECT vm.id, ?, {_VECTOR_SQL[storage].replace("?", "vm.embedding")},
+                   COALESCE(mtd.description, ''), COALESCE(mtd.document_id, 0)
+            FROM vectors_migration vm
+            LEFT JOIN metadata mtd ON mtd.vector_id = vm.id
+            """,
+            (config.database.default_collection,)
+        )
+        db.execute("DROP TABLE vectors_migration")
+        db.execute("UPDATE metadata SET collection = ? WHERE collection IS NULL", (config.database.default_collection,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"{Emojis.SUCCESS.value} Tabela vectors migrada.")
+
+# Uma linha por chunk de documento; cópias (quase) idênticas apontam para o mesmo vetor (ver modules.dedup)
+_METADATA_SCHEMA = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content TEXT NOT NULL,
+    description TEXT,
+    vector_id INTEGER NOT NULL,
+    document_id INTEGER REFERENCES documents(id),
+    chunk_hash TEXT,
+    chunk_index INTEGER,
+    start_offset INTEGER,
+    end_offset INTEGER,
+    collection TEXT,
+    section TEXT,
+    FOREIGN KEY (vector_id) REFERENCES vectors(id) ON DELETE CASCADE
+"""
+
+def _has_unique_vector_ids():
+    for _, name, unique, origin, *_ in db.execute("PRAGMA index_list(metadata)").fetchall():
+        if unique and origin == "u" and [row[2] for row in db.execute(f"PRAGMA index_info({name})")] == ["vector_id"]:
+            return True
+    return False
+
+def _migrate_shared_vectors():
+    """
+    Remove o UNIQUE de metadata.vector_id de bancos anteriores à deduplicação, para que
+    vários chunks compartilhem um vetor. O SQLite não remove restrições com ALTER TABLE:
+    a tabela é copiada mantendo os ids, o que preserva o índice FTS5 (rowid = id).
+    """
+    logger.info(f"{Emojis.PROCESSING.value} Migrando a tabela metadata para vetores compartilhados...")
+    columns = ", ".join(("id", "content", "description", "vector_id", *METADATA_FIELDS))
+    try:
+        db.execute("DROP TABLE IF EXISTS metadata_migration")
+        db.execute(f"CREATE TABLE metadata_migration({_METADATA_SCHEMA})")
+        db.execute(f"INSERT INTO metadata_migration ({columns}) SELECT {columns} FROM metadata")
+        db.execute("DROP TABLE metadata")
+        db.execute("ALTER TABLE metadata_migration RENAME TO metadata")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"{Emojis.SUCCESS.value} Tabela metadata migrada.")
+
+def create_tables():
+    global _existing_storage
+    if config.database.vector_storage not in _VECTOR_COLUMN_TYPES:
+        raise ValueError(f"Formato de armazenamento de vetor desconhecido: {config.database.vector_storage}")
+    existing = _detect_vector_storage()
+    if existing and existing != config.database.vector_storage:
+        # Continua usando o formato do banco; a conversão exige --export, --recreate-tables e --import
+        _existing_storage = existing
+        logger.warning(
+            f"{Emojis.WARNING.value} A tabela vectors usa o armazenamento '{existing}', não '{config.database.vector_storage}'. "
+            "Exporte os embeddings (--export), recrie as tabelas (--recreate-tables) e importe novamente para converter."
+        )
+    _create_vectors_table()
+    if _is_quantized():
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vectors_full(
+                id INTEGER PRIMARY KEY,
+                embedding BLOB NOT NULL
+            )
+            """
+        )
+    db.execute(f"CREATE TABLE IF NOT EXISTS metadata({_METADATA_SCHEMA})")
     db.execute(
         """
-        CREATE TABLE IF NOT EXISTS metadata(
+        CREATE TABLE IF NOT EXISTS documents(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            content TEXT NOT NULL,
-            description TEXT,
-            vector_id INTEGER NOT NULL UNIQUE,
-            FOREIGN KEY (vector_id) REFERENCES vectors(id) ON DELETE CASCADE
+            path TEXT NOT NULL UNIQUE,
+            content_hash TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            collection TEXT
         )
         """
     )
+    # Bancos criados antes do registro de documentos não têm estas colunas
+    ensure_columns("metadata", {
+        "document_id": "INTEGER REFERENCES documents(id)",
+        "chunk_hash": "TEXT",
+        "chunk_index": "INTEGER",
+        "start_offset": "INTEGER",
+        "end_offset": "INTEGER",
+        "collection": "TEXT",
+        "section": "TEXT",
+    })
+    ensure_columns("documents", {"collection": "TEXT"})
+    if not _has_vector_partitions():
+        _migrate_vector_partitions()
+    if _has_unique_vector_ids():
+        _migrate_shared_vectors()
+    db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_document ON metadata(document_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_vector ON metadata(vector_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_chunk_hash ON metadata(chunk_hash)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_section ON metadata(section)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_description ON metadata(description)")
+    # Assinaturas MinHash e chaves LSH de cada vetor, para achar quase duplicatas
+    db.execute("CREATE TABLE IF NOT EXISTS chunk_minhash(vector_id INTEGER PRIMARY KEY, signature BLOB NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS chunk_lsh(band_key INTEGER NOT NULL, vector_id INTEGER NOT NULL)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chunk_lsh_band ON chunk_lsh(band_key)")
+    _create_lexical_index()
     db.commit()
 
+def _create_lexical_index():
+    """
+    Índice FTS5 (BM25) sobre metadata.content no modo external content: o texto não é
+    duplicado e os triggers mantêm o índice em sincronia com inserções, remoções e
+    alterações de conteúdo. Bancos anteriores ao índice são preenchidos uma vez.
+    """
+    existed = has_lexical_index()
+    try:
+        db.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS metadata_fts USING fts5(
+                content, content='metadata', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"{Emojis.WARNING.value} FTS5 indisponível neste SQLite ({e}); busca lexical desativada.")
+        return
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_fts_insert AFTER INSERT ON metadata BEGIN
+            INSERT INTO metadata_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_fts_delete AFTER DELETE ON metadata BEGIN
+            INSERT INTO metadata_fts (metadata_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS metadata_fts_update AFTER UPDATE OF content ON metadata BEGIN
+            INSERT INTO metadata_fts (metadata_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO metadata_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """
+    )
+    if not existed:
+        logger.info(f"{Emojis.PROCESSING.value} Construindo o índice de texto (FTS5) dos chunks...")
+        db.execute("INSERT INTO metadata_fts (metadata_fts) VALUES ('rebuild')")
+
+def has_lexical_index() -> bool:
+    return _db().execute("SELECT 1 FROM sqlite_master WHERE name = 'metadata_fts'").fetchone() is not None
+
+def ensure_columns(table, columns):
+    """Adiciona com ALTER TABLE as colunas que ainda não existem na tabela."""
+    existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    for name, declaration in columns.items():
+        if name not in existing:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
 def recreate_tables():
     """Recria as tabelas com as dimensões corretas"""
+    global _existing_storage
 
     # Re-enable extensions
     enable_extensions()
     
     # Drop existing tables
+    db.execute("DROP TABLE IF EXISTS metadata_fts")
     db.execute("DROP TABLE IF EXISTS metadata")
     db.execute("DROP TABLE IF EXISTS vectors")
+    db.execute("DROP TABLE IF EXISTS vectors_full")
+    db.execute("DROP TABLE IF EXISTS documents")
+    db.execute("DROP TABLE IF EXISTS chunk_minhash")
+    db.execute("DROP TABLE IF EXISTS chunk_lsh")
+    # Respostas em cache referenciam ids de vetores que serão reutilizados
+    db.execute("DROP TABLE IF EXISTS answer_cache")
+    # Jobs pendentes apontam para vetores e documentos que deixam de existir
+    for table in ("job_batches", "job_chunks", "job_files", "jobs"):
+        db.execute(f"DROP TABLE IF EXISTS {table}")
     db.commit()
+    _existing_storage = None
     
     # Recreate with correct dimensions
     create_tables()
 
-def insert_vector(vector, content, description=None):
+# Colunas opcionais de metadata aceitas no dict de campos do bulk_insert_vectors
+METADATA_FIELDS = ("document_id", "chunk_hash", "chunk_index", "start_offset", "end_offset", "collection", "section")
+# Posições em _metadata_fields das colunas que também vão para o vec0 (sempre pelo nome, nunca pela ordem)
+_COLLECTION_FIELD = METADATA_FIELDS.index("collection")
+_DOCUMENT_ID_FIELD = METADATA_FIELDS.index("document_id")
+
+def bulk_insert_vectors(rows: Iterable[Tuple], batch_size: int = config.database.bulk_insert_batch_size,
+                        on_batch: Optional[Callable[[sqlite3.Cursor, int, List[int]], None]] = None) -> List[int]:
+    """
+    Insere (vector, content, description) em lote com executemany.
+
+    Cada linha pode trazer um quarto elemento opcional: um dict com colunas de
+    METADATA_FIELDS (ex.: {"document_id": 1, "chunk_hash": "...", "chunk_index": 0}).
+    Sem "collection", a linha vai para DatabaseConfig.default_collection.
+
+    Os vetores são validados contra DatabaseConfig.embedding_dimension e gravados como blob float32.
+
+    Cada lote de `batch_size` linhas é gravado em uma única transação, com WAL e
+    pragmas de carga ativos durante a importação (o journal_mode e o synchronous
+    anteriores são restaurados no fim). Retorna os ids atribuídos, na ordem de entrada.
 
+    `on_batch(cursor, offset, ids)` é chamado dentro da transação de cada lote, com a
+    posição da primeira linha do lote na entrada: o que ele gravar (ex.: o diário de um
+    job, ver modules.jobs) é confirmado junto com os vetores.
+    """
+    ids = []
+    previous_journal_mode = db.execute("PRAGMA journal_mode").fetchone()[0]
+    previous_synchronous = db.execute("PRAGMA synchronous").fetchone()[0]
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("PRAGMA temp_store=MEMORY")
+    db.execute("PRAGMA cache_size=-65536")
+    try:
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            offset = len(ids)
+            on_commit = (lambda cursor, batch_ids: on_batch(cursor, offset, batch_ids)) if on_batch else None
+            with metrics.time('insert_time'):
+                ids.extend(_insert_batch(batch, on_commit))
+            logger.info(f"{Emojis.INFO.value} {len(ids)} vetores inseridos.")
+    finally:
+        db.execute(f"PRAGMA synchronous={previous_synchronous}")
+        db.execute(f"PRAGMA journal_mode={previous_journal_mode}")
+    return ids
+
+def _insert_batch(batch, on_commit=None):
     cursor = db.cursor()
-    cursor.execute(
-        "INSERT INTO vectors (embedding) VALUES (?)",
-        (vector,)  # Convert numpy array to bytes for storage
-    )
-    vector_id = cursor.lastrowid
-    cursor.execute(
-        "INSERT INTO metadata (content, description, vector_id) VALUES (?, ?, ?)",
-        (content, description, vector_id)
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        # ids reservados dentro da transação: o vec0 aceita id explícito e o executemany não devolve lastrowid.
+        # Todo vetor tem ao menos um chunk (ver _release_vectors), então o maior vector_id de metadata é o
+        # maior id do vec0, lido pelo índice em vez de uma varredura da tabela virtual
+        first_id = cursor.execute("SELECT COALESCE(MAX(vector_id), 0) + 1 FROM metadata").fetchone()[0]
+        ids = list(range(first_id, first_id + len(batch)))
+        storage = _vector_storage()
+        fields = [_metadata_fields(row) for row in batch]
+        cursor.executemany(
+            f"INSERT INTO vectors (id, collection, embedding, source, document_id) VALUES (?, ?, {_VECTOR_SQL[storage]}, ?, ?)",
+            (
+                (vector_id, row_fields[_COLLECTION_FIELD], quantize_vector(row[0], storage), row[2] or '',
+                 row_fields[_DOCUMENT_ID_FIELD] or 0)
+                for vector_id, row, row_fields in zip(ids, batch, fields)
+            )
+        )
+        if _is_quantized():
+            cursor.executemany(
+                "INSERT INTO vectors_full (id, embedding) VALUES (?, ?)",
+                ((vector_id, vector_blob(row[0])) for vector_id, row in zip(ids, batch))
+            )
+        columns = ", ".join(METADATA_FIELDS)
+        placeholders = ", ".join("?" for _ in METADATA_FIELDS)
+        cursor.executemany(
+            f"INSERT INTO metadata (content, description, vector_id, {columns}) VALUES (?, ?, ?, {placeholders})",
+            ((row[1], row[2], vector_id, *row_fields) for vector_id, row, row_fields in zip(ids, batch, fields))
+        )
+        if on_commit is not None:
+            on_commit(cursor, ids)
+        db.commit()
+        return ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _metadata_fields(row):
+    fields = row[3] if len(row) > 3 and row[3] else {}
+    unknown = set(fields) - set(METADATA_FIELDS)
+    if unknown:
+        raise ValueError(f"Campos de metadata desconhecidos: {sorted(unknown)}")
+    values = {**fields, "collection": fields.get("collection") or config.database.default_collection}
+    return tuple(values.get(name) for name in METADATA_FIELDS)
+
+def add_chunk_references(rows: Iterable[Tuple], on_batch: Optional[Callable[[sqlite3.Cursor, int, List[int]], None]] = None) -> List[int]:
+    """
+    Grava chunks que reaproveitam um vetor já gravado: linhas (vector_id, content, description, fields),
+    com `fields` como no bulk_insert_vectors. Tudo numa transação; `on_batch(cursor, 0, vector_ids)`
+    é chamado antes do commit. Retorna os vector_ids, na ordem de entrada.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    columns = ", ".join(METADATA_FIELDS)
+    placeholders = ", ".join("?" for _ in METADATA_FIELDS)
+    vector_ids = [row[0] for row in rows]
+    cursor = db.cursor()
+    try:
+        cursor.executemany(
+            f"INSERT INTO metadata (content, description, vector_id, {columns}) VALUES (?, ?, ?, {placeholders})",
+            ((row[1], row[2], row[0], *_metadata_fields(row)) for row in rows)
+        )
+        if on_batch is not None:
+            on_batch(cursor, 0, vector_ids)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    return vector_ids
+
+def find_vectors_by_hash(chunk_hashes: List[str], collection: Optional[str] = None):
+    """Retorna {chunk_hash: vector_id} dos chunks já gravados na coleção com algum desses hashes."""
+    collection = collection or config.database.default_collection
+    found = {}
+    for start in range(0, len(chunk_hashes), 500):
+        batch = list(chunk_hashes[start:start + 500])
+        placeholders = ", ".join("?" for _ in batch)
+        for chunk_hash, vector_id in db.execute(
+            f"SELECT chunk_hash, MIN(vector_id) FROM metadata WHERE chunk_hash IN ({placeholders}) AND collection = ? GROUP BY chunk_hash",
+            (*batch, collection)
+        ):
+            found[chunk_hash] = vector_id
+    return found
+
+def find_lsh_candidates(band_keys: List[int]):
+    """Retorna [(band_key, vector_id, assinatura MinHash)] dos vetores com alguma das chaves LSH."""
+    rows = []
+    for start in range(0, len(band_keys), 500):
+        batch = list(band_keys[start:start + 500])
+        placeholders = ", ".join("?" for _ in batch)
+        rows.extend(db.execute(
+            f"""
+            SELECT lsh.band_key, lsh.vector_id, mh.signature
+            FROM chunk_lsh lsh
+            JOIN chunk_minhash mh ON mh.vector_id = lsh.vector_id
+            WHERE lsh.band_key IN ({placeholders})
+            """,
+            batch
+        ))
+    return rows
+
+def store_minhash(cursor, rows: Iterable[Tuple[int, bytes, List[int]]]):
+    """Grava (vector_id, assinatura, chaves LSH) usando o cursor de uma transação em andamento."""
+    rows = list(rows)
+    cursor.executemany("INSERT OR REPLACE INTO chunk_minhash (vector_id, signature) VALUES (?, ?)",
+                       ((vector_id, signature) for vector_id, signature, _ in rows))
+    cursor.executemany("INSERT INTO chunk_lsh (band_key, vector_id) VALUES (?, ?)",
+                       ((band_key, vector_id) for vector_id, _, band_keys in rows for band_key in band_keys))
+
+def delete_vectors(vector_ids: List[int]):
+    """Remove vetores e todos os chunks que apontam para eles."""
+    cursor = db.cursor()
+    try:
+        for start in range(0, len(vector_ids), 500):
+            chunk = list(vector_ids[start:start + 500])
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(f"DELETE FROM metadata WHERE vector_id IN ({placeholders})", chunk)
+            _release_vectors(cursor, chunk)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def delete_chunks(chunk_ids: List[int]):
+    """
+    Remove chunks (metadata.id). Um vetor compartilhado só é apagado junto com o último
+    chunk que aponta para ele; até lá, fonte e documento gravados no vec0 passam para
+    a cópia mais antiga restante.
+    """
+    cursor = db.cursor()
+    try:
+        for start in range(0, len(chunk_ids), 500):
+            chunk = list(chunk_ids[start:start + 500])
+            placeholders = ", ".join("?" for _ in chunk)
+            vector_ids = [row[0] for row in cursor.execute(f"SELECT DISTINCT vector_id FROM metadata WHERE id IN ({placeholders})", chunk)]
+            cursor.execute(f"DELETE FROM metadata WHERE id IN ({placeholders})", chunk)
+            _release_vectors(cursor, vector_ids)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _release_vectors(cursor, vector_ids: List[int]):
+    """Apaga os vetores que ficaram sem chunks e atualiza o dono dos que ainda são compartilhados."""
+    if not vector_ids:
+        return
+    placeholders = ", ".join("?" for _ in vector_ids)
+    owners = cursor.execute(
+        f"""
+        SELECT mtd.vector_id, COALESCE(mtd.description, ''), COALESCE(mtd.document_id, 0)
+        FROM metadata mtd
+        WHERE mtd.id IN (SELECT MIN(id) FROM metadata WHERE vector_id IN ({placeholders}) GROUP BY vector_id)
+        """,
+        vector_ids
+    ).fetchall()
+    cursor.executemany("UPDATE vectors SET source = ?, document_id = ? WHERE id = ?",
+                       ((source, document_id, vector_id) for vector_id, source, document_id in owners))
+    shared = {vector_id for vector_id, _, _ in owners}
+    orphans = [vector_id for vector_id in vector_ids if vector_id not in shared]
+    if not orphans:
+        return
+    placeholders = ", ".join("?" for _ in orphans)
+    cursor.execute(f"DELETE FROM vectors WHERE id IN ({placeholders})", orphans)
+    if _is_quantized():
+        cursor.execute(f"DELETE FROM vectors_full WHERE id IN ({placeholders})", orphans)
+    cursor.execute(f"DELETE FROM chunk_minhash WHERE vector_id IN ({placeholders})", orphans)
+    cursor.execute(f"DELETE FROM chunk_lsh WHERE vector_id IN ({placeholders})", orphans)
+
+def get_documents():
+    """Retorna {path: (document_id, content_hash, collection)} dos documentos registrados."""
+    return {
+        path: (document_id, content_hash, collection or config.database.default_collection)
+        for document_id, path, content_hash, collection in db.execute("SELECT id, path, content_hash, collection FROM documents")
+    }
+
+def upsert_document(path: str, content_hash: str, collection: Optional[str] = None) -> int:
+    """Registra (ou atualiza) um documento e retorna seu id."""
+    db.execute(
+        """
+        INSERT INTO documents (path, content_hash, updated_at, collection) VALUES (?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET content_hash = excluded.content_hash, updated_at = excluded.updated_at,
+            collection = excluded.collection
+        """,
+        (path, content_hash, time.time(), collection or config.database.default_collection)
     )
     db.commit()
-    return vector_id
+    return db.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()[0]
 
-def query_embedding(query: str, embedding):
+def get_document_chunks(document_id: int):
+    """Retorna [(chunk_id, chunk_hash)] dos chunks de um documento, em ordem (chunk_id = metadata.id)."""
+    return db.execute(
+        "SELECT id, chunk_hash FROM metadata WHERE document_id = ? ORDER BY chunk_index",
+        (document_id,)
+    ).fetchall()
 
-    # Sqlite cursor *DOES NOT* support context manager
-    cursor = db.cursor()
-    cursor.execute(
-      """
-      SELECT 
-          mtd.content,
-          mtd.description
-      FROM vectors vct
-      JOIN metadata mtd ON vct.id = mtd.vector_id
-      WHERE vct.embedding MATCH ? AND k = 10
-      ORDER BY distance
-      """,
-      (embedding,))
-    results = cursor.fetchall()
-    cursor.close()
-    return results
\ No newline at end of file
+def update_chunk_positions(positions: List[Tuple[int, int, int, Optional[str], int]]):
+    """Atualiza a posição de chunks reaproveitados: tuplas (chunk_index, start_offset, end_offset, section, chunk_id)."""
+    db.executemany("UPDATE metadata SET chunk_index = ?, start_offset = ?, end_offset = ?, section = ? WHERE id = ?", positions)
+    db.commit()
+
+def delete_document(document_id: int):
+    """Remove um documento e todos os seus vetores."""
+    delete_chunks([chunk_id for chunk_id, _ in get_document_chunks(document_id)])
+    db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+    db.commit()
+
+def iter_vectors(batch_size: int = config.database.bulk_insert_batch_size):
+    """
+    Percorre o banco vetor a vetor, em ordem de id, lendo em lotes. Gera
+    (vector_id, embedding, chunks, assinatura MinHash ou None), com `chunks` =
+    [(content, description, fields)] de todos os chunks que compartilham o vetor, o dono
+    (mais antigo) primeiro. `fields` traz todas as colunas de METADATA_FIELDS, no formato
+    aceito pelo bulk_insert_vectors.
+    """
+    columns = ", ".join(f"mtd.{name}" for name in METADATA_FIELDS)
+    cursor = _db().cursor()
+
+    def rows():
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield from batch
+
+    try:
+        cursor.execute(
+            f"""
+            SELECT mtd.vector_id, vct.embedding, mh.signature, mtd.content, mtd.description, {columns}
+            FROM metadata mtd
+            JOIN {_full_vectors_table()} vct ON vct.id = mtd.vector_id
+            LEFT JOIN chunk_minhash mh ON mh.vector_id = mtd.vector_id
+            ORDER BY mtd.vector_id, mtd.id
+            """
+        )
+        for vector_id, group in groupby(rows(), key=lambda row: row[0]):
+            group = list(group)
+            _, embedding, signature = group[0][:3]
+            yield vector_id, embedding, [
+                (content, description, dict(zip(METADATA_FIELDS, values)))
+                for _, _, _, content, description, *values in group
+            ], signature
+    finally:
+        cursor.close()
+
+def iter_embeddings(batch_size: int = config.database.bulk_insert_batch_size):
+    """Percorre (vector_id, embedding) de todo o banco, em ordem de id, lendo em lotes (vetores compartilhados uma vez)."""
+    cursor = _db().cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT mtd.vector_id, vct.embedding
+            FROM (SELECT DISTINCT vector_id FROM metadata) mtd
+            JOIN {_full_vectors_table()} vct ON vct.id = mtd.vector_id
+            ORDER BY mtd.vector_id
+            """
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+def get_index_version():
+    """Retorna (quantidade, maior vector_id) dos vetores, usado para detectar índices desatualizados."""
+    count, max_id = _db().execute("SELECT COUNT(DISTINCT vector_id), COALESCE(MAX(vector_id), 0) FROM metadata").fetchone()
+    return count, max_id
+
+def get_chunks(vector_ids: List[int], source=None, document_id=None, section=None):
+    """
+    Retorna {vector_id: (content, description)} para os ids informados. Um vetor compartilhado
+    (ver modules.dedup) traz a cópia mais antiga entre as que passam nos filtros de metadata
+    (`source`, `document_id`, `section`, como em _knn_filters).
+    """
+    clauses, filter_params = _metadata_filters("", source, document_id, section)
+    filters = "".join(f" AND {clause}" for clause in clauses)
+    chunks = {}
+    for start in range(0, len(vector_ids), 500):
+        batch = [int(vector_id) for vector_id in vector_ids[start:start + 500]]
+        placeholders = ", ".join("?" for _ in batch)
+        # Em ordem decrescente de id: a cópia mais antiga é a última a ser gravada no dict
+        for vector_id, content, description in _db().execute(
+            f"SELECT vector_id, content, description FROM metadata WHERE vector_id IN ({placeholders}){filters} ORDER BY id DESC",
+            (*batch, *filter_params)
+        ):
+            chunks[vector_id] = (content, description)
+    return chunks
+
+def get_chunk_positions(vector_ids: List[int]):
+    """
+    Retorna {(vector_id, description): (document_id, chunk_index, start_offset, end_offset, section)}
+    para os ids informados: um vetor compartilhado tem uma posição por fonte (a cópia mais antiga).
+    """
+    positions = {}
+    for start in range(0, len(vector_ids), 500):
+        batch = [int(vector_id) for vector_id in vector_ids[start:start + 500]]
+        placeholders = ", ".join("?" for _ in batch)
+        for vector_id, description, *position in _db().execute(
+            f"SELECT vector_id, description, document_id, chunk_index, start_offset, end_offset, section FROM metadata "
+            f"WHERE vector_id IN ({placeholders}) ORDER BY id DESC", batch
+        ):
+            positions[(vector_id, description)] = tuple(position)
+    return positions
+
+def _section_clause(column: str, value):
+    """
+    Filtro por seção (caminho de títulos): "Guia" casa com "Guia" e com as subseções
+    ("Guia > Instalação"). O prefixo vira uma faixa de strings, que usa o índice de section.
+    """
+    values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+    clauses, params = [], []
+    for section in values:
+        clauses.append(f"{column} = ? OR ({column} >= ? AND {column} < ?)")
+        params.extend((section, section + " > ", section + " >!"))
+    return "(" + " OR ".join(clauses) + ")", params
+
+def _in_clause(column: str, value):
+    if isinstance(value, (list, tuple, set)):
+        values = list(value)
+        return f"{column} IN ({', '.join('?' for _ in values)})", values
+    return f"{column} = ?", [value]
+
+def _metadata_filters(prefix: str = "", source=None, document_id=None, section=None):
+    """Condições sobre as linhas de metadata (chunks): fonte (description), documento e seção. Retorna (condições, parâmetros)."""
+    clauses, params = [], []
+    for column, value in (("description", source), ("document_id", document_id)):
+        if value is not None:
+            clause, values = _in_clause(f"{prefix}{column}", value)
+            clauses.append(clause)
+            params.extend(values)
+    if section is not None:
+        clause, values = _section_clause(f"{prefix}section", section)
+        clauses.append(clause)
+        params.extend(values)
+    return clauses, params
+
+def _knn_filters(prefix: str = "", collection=None, source=None, document_id=None, section=None, on_metadata: bool = False):
+    """
+    Restrições aplicadas pelo vec0 durante o KNN (antes de escolher os k). Cada filtro
+    aceita um valor ou uma lista de valores. Retorna (trecho SQL, parâmetros).
+
+    A coleção seleciona a partição. Fonte, documento e seção são dos chunks, não do vetor:
+    um vetor compartilhado por duplicatas (ver modules.dedup) serve chunks de várias fontes,
+    então esses filtros viram um `id IN (SELECT vector_id FROM metadata ...)`, que o
+    sqlite-vec também aplica antes de escolher os k. Com `on_metadata`, os filtros são
+    aplicados direto às colunas da tabela metadata (`prefix` é o alias dela).
+    """
+    clauses, params = [], []
+    if collection is not None:
+        clause, values = _in_clause(f"{prefix}collection", collection)
+        clauses.append(clause)
+        params.extend(values)
+    metadata_clauses, metadata_params = _metadata_filters(prefix if on_metadata else "", source, document_id, section)
+    if metadata_clauses and not on_metadata:
+        metadata_clauses = [f"{prefix}id IN (SELECT vector_id FROM metadata WHERE {' AND '.join(metadata_clauses)})"]
+    clauses.extend(metadata_clauses)
+    params.extend(metadata_params)
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+def search_vectors(embedding, k: int = config.search.top_k, collection=None, source=None, document_id=None, section=None):
+    """
+    Busca KNN no sqlite-vec. Retorna [(vector_id, content, description, distance)] por distância.
+
+    `collection`, `source`, `document_id` e `section` restringem a busca (ver _knn_filters).
+    O conteúdo e a fonte de um vetor compartilhado são os do chunk mais antigo que passa nos filtros.
+    Com armazenamento quantizado, a primeira passada no vec0 traz k * rerank_oversample
+    candidatos, que são reordenados pela distância L2 exata com os vetores float32.
+    """
+    storage = _vector_storage()
+    chunk_filters = {"source": source, "document_id": document_id, "section": section}
+    if storage == "float":
+        filters, params = _knn_filters("vct.", collection, **chunk_filters)
+        clauses, chunk_params = _metadata_filters("", **chunk_filters)
+        chunk_clause = "".join(f" AND {clause}" for clause in clauses)
+        cursor = _db().cursor()
+        try:
+            cursor.execute(
+                f"""
+                SELECT vct.id, mtd.content, mtd.description, vct.distance
+                FROM vectors vct
+                JOIN metadata mtd ON mtd.id = (SELECT MIN(id) FROM metadata WHERE vector_id = vct.id{chunk_clause})
+                WHERE vct.embedding MATCH ? AND k = ?{filters}
+                ORDER BY vct.distance
+                """,
+                (*chunk_params, vector_blob(embedding), k, *params))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    filters, params = _knn_filters("", collection, **chunk_filters)
+    query = as_vector(embedding)
+    candidates = [row[0] for row in _db().execute(
+        f"SELECT id FROM vectors WHERE embedding MATCH {_VECTOR_SQL[storage]} AND k = ?{filters}",
+        (quantize_vector(query, storage), k * config.database.rerank_oversample, *params)
+    )]
+    return rerank(query, candidates, k, **chunk_filters)
+
+def rerank(query, candidate_ids: List[int], k: int, **chunk_filters):
+    """
+    Reordena candidatos pela distância L2 exata usando os vetores float32 completos.
+    `chunk_filters` escolhem o chunk devolvido para cada vetor (ver get_chunks).
+    """
+    if not candidate_ids:
+        return []
+    placeholders = ", ".join("?" for _ in candidate_ids)
+    rows = _db().execute(f"SELECT id, embedding FROM {_full_vectors_table()} WHERE id IN ({placeholders})", candidate_ids).fetchall()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    distances = np.linalg.norm(matrix - as_vector(query), axis=1)
+    order = np.argsort(distances, kind="stable")[:k]
+    chunks = get_chunks(ids[order].tolist(), **chunk_filters)
+    return [(int(ids[i]), *chunks[int(ids[i])], float(distances[i])) for i in order if int(ids[i]) in chunks]
+
+# Subconsultas KNN por instrução (o SQLite limita um SELECT composto a 500 termos)
+_KNN_QUERIES_PER_STATEMENT = 200
+
+def search_vectors_many(embeddings, k: int = config.search.top_k, collection=None, source=None, document_id=None,
+                        section=None):
+    """
+    Busca KNN para várias consultas. Retorna uma lista de resultados por consulta,
+    no mesmo formato (e com os mesmos filtros) de search_vectors.
+
+    As consultas vão em lotes num único SELECT composto (UNION ALL de buscas vec0)
+    e o conteúdo dos chunks é lido uma vez para todas elas.
+    """
+    storage = _vector_storage()
+    chunk_filters = {"source": source, "document_id": document_id, "section": section}
+    filters, filter_params = _knn_filters("", collection, **chunk_filters)
+    queries = [as_vector(embedding) for embedding in embeddings]
+    count = k * config.database.rerank_oversample if _is_quantized() else k
+    neighbours = [[] for _ in queries]
+    for start in range(0, len(queries), _KNN_QUERIES_PER_STATEMENT):
+        part = queries[start:start + _KNN_QUERIES_PER_STATEMENT]
+        sql = " UNION ALL ".join(
+            f"SELECT {start + i}, id, distance FROM "
+            f"(SELECT id, distance FROM vectors WHERE embedding MATCH {_VECTOR_SQL[storage]} AND k = ?{filters})"
+            for i in range(len(part))
+        )
+        params = [param for query in part for param in (quantize_vector(query, storage), count, *filter_params)]
+        for index, vector_id, distance in _db().execute(sql, params):
+            neighbours[index].append((vector_id, distance))
+
+    if _is_quantized():
+        return [rerank(query, [vector_id for vector_id, _ in found], k, **chunk_filters) for query, found in zip(queries, neighbours)]
+    chunks = get_chunks(list({vector_id for found in neighbours for vector_id, _ in found}), **chunk_filters)
+    return [
+        [(vector_id, *chunks[vector_id], distance) for vector_id, distance in sorted(found, key=lambda n: n[1]) if vector_id in chunks]
+        for found in neighbours
+    ]
+
+# Termos da consulta lexical: palavras com hífens, pontos etc. viram frases ("ERR-42" -> "err 42")
+_WORD = re.compile(r"\S+")
+_TOKEN = re.compile(r"\w+")
+_MAX_LEXICAL_TERMS = 32
+
+def lexical_query(text: str) -> str:
+    """Converte texto livre em uma consulta FTS5 segura: termos entre aspas unidos por OR."""
+    terms = []
+    for word in _WORD.findall(text):
+        tokens = _TOKEN.findall(word)
+        if len(tokens) > 1:
+            terms.append('"' + " ".join(tokens) + '"')
+        elif tokens and len(tokens[0]) > 1:
+            terms.append(f'"{tokens[0]}"')
+    return " OR ".join(dict.fromkeys(terms[:_MAX_LEXICAL_TERMS]))
+
+def search_lexical(text: str, k: int = config.search.top_k, collection=None, source=None, document_id=None, section=None):
+    """
+    Busca BM25 no índice FTS5 (`rank`). Retorna [(vector_id, content, description, score)] com
+    score = -bm25 (maior é melhor), nos mesmos filtros de search_vectors. Cópias de um
+    vetor compartilhado contam uma vez. Sem índice ou sem termos pesquisáveis, retorna [].
+    """
+    match = lexical_query(text)
+    if not match or not has_lexical_index():
+        return []
+    filters, params = _knn_filters("mtd.", collection, source, document_id, section, on_metadata=True)
+    return _db().execute(
+        f"""
+        SELECT vector_id, content, description, MAX(score) AS score
+        FROM (
+            SELECT mtd.vector_id, mtd.content, mtd.description, -metadata_fts.rank AS score
+            FROM metadata_fts
+            JOIN metadata mtd ON mtd.id = metadata_fts.rowid
+            WHERE metadata_fts MATCH ?{filters}
+        )
+        GROUP BY vector_id
+        ORDER BY score DESC
+        LIMIT ?
+        """,
+        (match, *params, k)
+    ).fetchall()
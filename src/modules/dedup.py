@@ -0,0 +1,175 @@
+import hashlib
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config.settings import config
+from modules import database
+
+_TOKEN = re.compile(r"\w+")
+# Primo de Mersenne 2^31 - 1: com a, x < 2^31, a * x + b cabe em uint64
+_PRIME = (1 << 31) - 1
+
+
+class MinHasher:
+    """
+    Assinaturas MinHash dos shingles de palavras de um texto.
+
+    A fração de posições iguais entre duas assinaturas estima a similaridade de Jaccard
+    dos shingles. Para o LSH, a assinatura é dividida em `bands` faixas e cada faixa
+    vira uma chave: textos parecidos coincidem em pelo menos uma faixa com alta
+    probabilidade, e só esses candidatos são comparados.
+    """
+
+    def __init__(self, num_perm: int = config.dedup.num_perm, bands: int = config.dedup.bands,
+                 shingle_size: int = config.dedup.shingle_size, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm deve ser múltiplo de bands")
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+
+    def shingles(self, text: str) -> np.ndarray:
+        tokens = _TOKEN.findall(text.casefold())
+        size = min(self.shingle_size, len(tokens))
+        return np.fromiter(
+            {zlib.crc32(" ".join(tokens[i:i + size]).encode("utf-8")) & _PRIME for i in range(len(tokens) - size + 1)} if tokens else (),
+            dtype=np.uint64
+        )
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Assinatura (uint32, num_perm posições); None para texto sem palavras."""
+        shingles = self.shingles(text)
+        if not shingles.size:
+            return None
+        return ((self.a * shingles + self.b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray, collection: str) -> List[int]:
+        """Uma chave LSH (int64) por faixa; a coleção entra na chave para não misturar partições."""
+        rows = len(signature) // self.bands
+        prefix = collection.encode("utf-8") + b"\0"
+        return [
+            int.from_bytes(
+                hashlib.blake2b(prefix + bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+                "little", signed=True
+            )
+            for band in range(self.bands)
+        ]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Similaridade de Jaccard estimada por duas assinaturas MinHash."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+@dataclass
+class DedupPlan:
+    """
+    Resultado da deduplicação de uma janela de chunks.
+
+    `unique` são as posições a embedar, com a assinatura e as chaves LSH em `signatures`
+    (ausentes para texto sem palavras). Cada item de `duplicates` é (posição, vector_id
+    já gravado ou None, posição da primeira cópia na janela ou None).
+    """
+    unique: List[int] = field(default_factory=list)
+    signatures: Dict[int, Tuple[bytes, List[int]]] = field(default_factory=dict)
+    duplicates: List[Tuple[int, Optional[int], Optional[int]]] = field(default_factory=list)
+    near_duplicates: int = 0
+
+
+class ChunkDeduplicator:
+    """
+    Separa, antes do embedding, os chunks que já têm vetor.
+
+    Duplicatas exatas são encontradas pelo chunk_hash (no banco e na própria janela);
+    as demais passam pelo MinHash/LSH e viram quase duplicatas se a similaridade
+    estimada com um candidato for >= `threshold`. A busca é sempre dentro da coleção.
+    """
+
+    def __init__(self, hasher: Optional[MinHasher] = None, threshold: float = config.dedup.threshold):
+        self.hasher = hasher or MinHasher()
+        self.threshold = threshold
+
+    def plan(self, texts: Sequence[str], fields: Sequence[dict]) -> DedupPlan:
+        """`fields` traz, por chunk, pelo menos "chunk_hash" (e "collection", se não for a padrão)."""
+        plan = DedupPlan()
+        groups: Dict[str, List[int]] = {}
+        for position, chunk_fields in enumerate(fields):
+            groups.setdefault(chunk_fields.get("collection") or config.database.default_collection, []).append(position)
+        for collection, positions in groups.items():
+            self._plan_collection(plan, collection, positions, texts, fields)
+        # Cópias exatas de um chunk que virou quase duplicata apontam direto para o alvo dele
+        targets = {position: (existing, first) for position, existing, first in plan.duplicates}
+        plan.duplicates = [
+            (position, *targets[first]) if first in targets else (position, existing, first)
+            for position, existing, first in plan.duplicates
+        ]
+        plan.unique.sort()
+        return plan
+
+    def _plan_collection(self, plan: DedupPlan, collection: str, positions: List[int],
+                         texts: Sequence[str], fields: Sequence[dict]) -> None:
+        stored = database.find_vectors_by_hash(list({fields[p]["chunk_hash"] for p in positions}), collection)
+        first_copy: Dict[str, int] = {}
+        pending = []
+        for position in positions:
+            chunk_hash = fields[position]["chunk_hash"]
+            if chunk_hash in stored:
+                plan.duplicates.append((position, stored[chunk_hash], None))
+            elif chunk_hash in first_copy:
+                plan.duplicates.append((position, None, first_copy[chunk_hash]))
+            else:
+                first_copy[chunk_hash] = position
+                pending.append(position)
+
+        signatures = {position: self.hasher.signature(texts[position]) for position in pending}
+        keys = {
+            position: self.hasher.band_keys(signature, collection)
+            for position, signature in signatures.items() if signature is not None
+        }
+        # Candidatos do banco para todas as chaves da janela, numa consulta
+        stored_buckets: Dict[int, List[int]] = {}
+        stored_signatures: Dict[int, np.ndarray] = {}
+        for band_key, vector_id, signature in database.find_lsh_candidates(list({k for ks in keys.values() for k in ks})):
+            stored_buckets.setdefault(band_key, []).append(vector_id)
+            stored_signatures[vector_id] = np.frombuffer(signature, dtype=np.uint32)
+        window_buckets: Dict[int, List[int]] = {}
+
+        for position in pending:
+            signature = signatures[position]
+            if signature is None:
+                plan.unique.append(position)
+                continue
+            match = self._best_match(
+                signature,
+                {vector_id for key in keys[position] for vector_id in stored_buckets.get(key, ())},
+                stored_signatures
+            )
+            if match is not None:
+                plan.duplicates.append((position, match, None))
+                plan.near_duplicates += 1
+                continue
+            match = self._best_match(
+                signature,
+                {other for key in keys[position] for other in window_buckets.get(key, ())},
+                signatures
+            )
+            if match is not None:
+                plan.duplicates.append((position, None, match))
+                plan.near_duplicates += 1
+                continue
+            plan.unique.append(position)
+            plan.signatures[position] = (signature.tobytes(), keys[position])
+            for key in keys[position]:
+                window_buckets.setdefault(key, []).append(position)
+
+    def _best_match(self, signature: np.ndarray, candidates, signatures) -> Optional[int]:
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            score = similarity(signature, signatures[candidate])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
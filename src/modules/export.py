@@ -0,0 +1,256 @@
+import ast
+import json
+import logging
+import os
+import struct
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+from config.settings import config
+from modules.database import add_chunk_references, get_documents, iter_vectors, store_minhash, upsert_document
+from modules.utils import Emojis
+from modules.vectors import VECTOR_DTYPE, as_vector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.jsonl"
+DOCUMENTS_FILE = "documents.jsonl"
+# Chunks que compartilham um vetor gravados por lote na importação
+_REFERENCES_BATCH_SIZE = 10_000
+
+# Cabeçalho .npy v1.0 de tamanho fixo: permite reescrever o shape ao acrescentar linhas
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128
+
+
+def _npy_header(rows: int, dimension: int) -> bytes:
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dimension)
+    header_len = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2
+    header = header.ljust(header_len - 1) + "\n"
+    if len(header) != header_len:
+        raise ValueError("Shape grande demais para o cabeçalho do arquivo de vetores")
+    return _NPY_MAGIC + struct.pack("<H", header_len) + header.encode("latin1")
+
+
+def _read_npy_shape(path: str) -> Tuple[int, int]:
+    with open(path, "rb") as f:
+        data = f.read(_NPY_HEADER_SIZE)
+    if len(data) != _NPY_HEADER_SIZE or not data.startswith(_NPY_MAGIC):
+        raise ValueError(f"Arquivo de vetores inválido: {path}")
+    header = ast.literal_eval(data[len(_NPY_MAGIC) + 2:].decode("latin1"))
+    if header["descr"] != "<f4" or header["fortran_order"]:
+        raise ValueError(f"Arquivo de vetores não é float32 em ordem C: {path}")
+    return header["shape"]
+
+
+class EmbeddingExportWriter:
+    """
+    Escreve embeddings no formato binário de exportação.
+
+    - `vectors.npy`: matriz float32 (linhas x dimensão), legível com np.load(mmap_mode='r')
+    - `records.jsonl`: uma linha JSON {"content", "source", "fields"} por linha da matriz, com
+      todas as colunas de database.METADATA_FIELDS em "fields" (coleção, documento, hash, posição, seção).
+      Um vetor compartilhado por duplicatas (ver modules.dedup) é uma linha só: os outros chunks
+      vão em "references" e a assinatura MinHash, se houver, em "minhash" (hex)
+    - `documents.jsonl` (só na exportação do banco): os documentos a que "document_id" se refere
+
+    Se o diretório já contém uma exportação, as novas linhas são acrescentadas.
+    """
+
+    def __init__(self, export_dir: str, dimension: int = config.database.embedding_dimension):
+        self.export_dir = export_dir
+        self.dimension = dimension
+        os.makedirs(export_dir, exist_ok=True)
+        self.vectors_path = os.path.join(export_dir, VECTORS_FILE)
+        self.records_path = os.path.join(export_dir, RECORDS_FILE)
+
+        self.rows = 0
+        if os.path.exists(self.vectors_path):
+            self.rows, existing_dimension = _read_npy_shape(self.vectors_path)
+            if existing_dimension != dimension:
+                raise ValueError(f"Exportação existente tem dimensão {existing_dimension}; esperado {dimension}")
+            self._vectors = open(self.vectors_path, "r+b")
+            # Descarta bytes de uma escrita interrompida além do shape registrado
+            self._vectors.truncate(_NPY_HEADER_SIZE + self.rows * dimension * 4)
+            self._vectors.seek(0, os.SEEK_END)
+        else:
+            self._vectors = open(self.vectors_path, "wb")
+            self._vectors.write(_npy_header(0, dimension))
+        self._records = open(self.records_path, "a", encoding="utf-8")
+
+    def write_many(self, rows: Iterable[Tuple]) -> int:
+        """Acrescenta (vector, content, source[, fields]). Retorna quantas linhas foram gravadas."""
+        written = 0
+        for vector, content, source, *fields in rows:
+            self._write(vector, {"content": content, "source": source, "fields": fields[0] if fields else None})
+            written += 1
+        return written
+
+    def write_vectors(self, rows: Iterable[Tuple]) -> int:
+        """Acrescenta os vetores gerados por database.iter_vectors, cada um uma única vez. Retorna quantos."""
+        written = 0
+        for vector_id, vector, chunks, signature in rows:
+            (content, source, fields), *references = chunks
+            record = {"vector_id": vector_id, "content": content, "source": source, "fields": fields}
+            if references:
+                record["references"] = [
+                    {"content": content, "source": source, "fields": fields} for content, source, fields in references
+                ]
+            if signature is not None:
+                record["minhash"] = signature.hex()
+            self._write(vector, record)
+            written += 1
+        return written
+
+    def _write(self, vector, record: dict) -> None:
+        self._vectors.write(as_vector(vector, self.dimension).tobytes())
+        self._records.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        self._records.close()
+        self._vectors.seek(0)
+        self._vectors.write(_npy_header(self.rows, self.dimension))
+        self._vectors.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ExportRecord(NamedTuple):
+    """Uma linha da exportação: o vetor, o chunk dono e os chunks que o compartilham (content, source, fields)."""
+    vector: np.ndarray
+    content: str
+    source: Optional[str]
+    fields: Optional[dict]
+    references: List[Tuple[str, Optional[str], Optional[dict]]]
+    signature: Optional[bytes]
+
+
+def read_export(export_dir: str) -> Iterator[ExportRecord]:
+    """
+    Lê uma exportação em streaming: os vetores vêm de um memmap, sem carregar a matriz inteira.
+    Exportações antigas, sem "fields", trazem None nos campos.
+    """
+    vectors_path = os.path.join(export_dir, VECTORS_FILE)
+    records_path = os.path.join(export_dir, RECORDS_FILE)
+    vectors = np.load(vectors_path, mmap_mode="r")
+    if vectors.dtype != VECTOR_DTYPE or vectors.ndim != 2:
+        raise ValueError(f"Arquivo de vetores inválido: {vectors_path}")
+    rows = 0
+    with open(records_path, "r", encoding="utf-8") as records:
+        for line in records:
+            if rows >= vectors.shape[0]:
+                raise ValueError("records.jsonl tem mais linhas que vectors.npy")
+            record = json.loads(line)
+            yield ExportRecord(
+                vectors[rows], record["content"], record.get("source"), record.get("fields"),
+                [(reference["content"], reference.get("source"), reference.get("fields")) for reference in record.get("references", ())],
+                bytes.fromhex(record["minhash"]) if record.get("minhash") else None
+            )
+            rows += 1
+    if rows != vectors.shape[0]:
+        raise ValueError("vectors.npy tem mais linhas que records.jsonl")
+
+
+def export_database(export_dir: str, batch_size: int = config.database.bulk_insert_batch_size) -> int:
+    """Exporta todos os vetores e metadados do banco para `export_dir`."""
+    start = time.time()
+    if os.path.exists(os.path.join(export_dir, VECTORS_FILE)):
+        raise FileExistsError(f"Já existe uma exportação em {export_dir}")
+    with EmbeddingExportWriter(export_dir) as writer:
+        _write_documents(export_dir)
+        rows = iter_vectors(batch_size)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            writer.write_vectors(batch)
+            logger.info(f"{Emojis.INFO.value} {writer.rows} vetores exportados.")
+    logger.info(f"{Emojis.SUCCESS.value} Exportação concluída: {writer.rows} vetores em {time.time() - start:.2f}s ({export_dir}).")
+    return writer.rows
+
+
+def _write_documents(export_dir: str) -> None:
+    with open(os.path.join(export_dir, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+        for path, (document_id, content_hash, collection) in get_documents().items():
+            f.write(json.dumps(
+                {"id": document_id, "path": path, "content_hash": content_hash, "collection": collection},
+                ensure_ascii=False
+            ) + "\n")
+
+
+def _restore_documents(export_dir: str) -> Dict[int, int]:
+    """Registra os documentos da exportação e retorna {id exportado: id no banco}."""
+    path = os.path.join(export_dir, DOCUMENTS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f]
+    return {
+        document["id"]: upsert_document(document["path"], document["content_hash"], document["collection"])
+        for document in documents
+    }
+
+
+def _remap_document(fields: Optional[dict], document_ids: Dict[int, int]) -> Optional[dict]:
+    if fields and fields.get("document_id") is not None:
+        return {**fields, "document_id": document_ids.get(fields["document_id"])}
+    return fields
+
+
+def import_export(export_dir: str, bulk_insert) -> int:
+    """
+    Importa uma exportação binária, enviando as linhas em streaming para o insert em lote.
+
+    Coleção, hashes, posições e seção dos chunks são preservados; os documentos são
+    registrados de novo e os chunks passam a apontar para os novos ids, para que a
+    reingestão incremental continue reaproveitando os vetores importados. Cada vetor
+    é inserido uma vez: os chunks que o compartilhavam voltam a apontar para ele e a
+    assinatura MinHash é regravada na mesma transação do lote.
+    """
+    from modules.dedup import MinHasher
+    start = time.time()
+    document_ids = _restore_documents(export_dir)
+    hasher = MinHasher()
+    # (posição do vetor na exportação, content, source, fields) dos chunks que compartilham vetores
+    references = []
+    signatures = deque()
+
+    def rows():
+        for position, record in enumerate(read_export(export_dir)):
+            fields = _remap_document(record.fields, document_ids)
+            references.extend(
+                (position, content, source, _remap_document(reference_fields, document_ids))
+                for content, source, reference_fields in record.references
+            )
+            if record.signature is not None:
+                signatures.append((position, record.signature, (fields or {}).get("collection")))
+            yield record.vector, record.content, record.source, fields
+
+    def store_signatures(cursor, offset, batch_ids):
+        batch = []
+        while signatures and signatures[0][0] < offset + len(batch_ids):
+            position, signature, collection = signatures.popleft()
+            band_keys = hasher.band_keys(np.frombuffer(signature, dtype=np.uint32), collection or config.database.default_collection)
+            batch.append((batch_ids[position - offset], signature, band_keys))
+        store_minhash(cursor, batch)
+
+    vector_ids = bulk_insert(rows(), on_batch=store_signatures)
+    for first in range(0, len(references), _REFERENCES_BATCH_SIZE):
+        add_chunk_references(
+            (vector_ids[position], content, source, fields)
+            for position, content, source, fields in references[first:first + _REFERENCES_BATCH_SIZE]
+        )
+    logger.info(
+        f"{Emojis.SUCCESS.value} Importação concluída: {len(vector_ids)} vetores ({len(vector_ids) + len(references)} chunks) "
+        f"em {time.time() - start:.2f}s."
+    )
+    return len(vector_ids)
@@ -0,0 +1,147 @@
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import List, Optional
+import numpy as np
+from config.settings import config
+
+
+class FakeQuotaError(Exception):
+    """Simula o ResourceExhausted (HTTP 429) da API do Google."""
+    code = 429
+
+
+class FakeEmbedder:
+    """
+    Embedder local e determinístico para desenvolvimento e testes de carga.
+
+    O mesmo texto sempre gera o mesmo vetor (normalizado). Latência e erros de
+    cota podem ser injetados para exercitar o rate limiter sem chamar a API.
+    """
+
+    def __init__(self, dimension: int = config.database.embedding_dimension, latency: float = 0.0,
+                 quota_error_rate: float = 0.0, seed: int = 0):
+        self.dimension = dimension
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.calls = 0
+        self.texts_embedded = 0
+        self.quota_errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def embed_text(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def embed(self, texts: List[str]) -> List[np.ndarray]:
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.quota_error_rate
+            if fail:
+                self.quota_errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeQuotaError("429 Resource has been exhausted (e.g. check quota).")
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [self.embed_text(text) for text in texts]
+
+    __call__ = embed
+
+
+class FakeGenerator:
+    """
+    Gerador de respostas local para testes de carga do serviço: devolve um texto
+    determinístico (derivado do prompt) em streaming, palavra por palavra.
+
+    `first_token_latency` simula a espera até o primeiro token e `latency` o tempo
+    total de geração, distribuído entre as palavras.
+    """
+
+    def __init__(self, latency: float = 0.0, first_token_latency: float = 0.0):
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def stream(self, prompt: str):
+        with self._lock:
+            self.calls += 1
+        digest = hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12]
+        words = f"Resposta simulada ({digest}) para um prompt de {len(prompt)} caracteres.".split(" ")
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        step = max(self.latency - self.first_token_latency, 0.0) / len(words)
+        for index, word in enumerate(words):
+            if index and step:
+                time.sleep(step)
+            yield word if index == 0 else " " + word
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    __call__ = generate
+
+
+class FakeGenAI:
+    """
+    Substituto local do módulo google.generativeai, com a mesma interface usada em
+    modules.google_ai_commands: `embed_content` (via FakeEmbedder) e
+    `GenerativeModel(...).generate_content(prompt, stream=...)` (via FakeGenerator).
+
+    Permite executar ingestão, busca e RAG de ponta a ponta sem rede (ver use_fake_genai).
+    """
+
+    def __init__(self, embedder: Optional[FakeEmbedder] = None, generator: Optional[FakeGenerator] = None):
+        self.embedder = embedder or FakeEmbedder()
+        self.generator = generator or FakeGenerator()
+
+    def configure(self, **kwargs) -> None:
+        pass
+
+    def embed_content(self, model: str, content, task_type: str = None, output_dimensionality: int = None) -> dict:
+        texts = [content] if isinstance(content, str) else list(content)
+        # A API devolve listas de floats
+        embeddings = [vector.tolist() for vector in self.embedder(texts)]
+        return {'embedding': embeddings[0] if isinstance(content, str) else embeddings}
+
+    def list_models(self):
+        return []
+
+    def GenerativeModel(self, model_name: str) -> "_FakeGenerativeModel":
+        return _FakeGenerativeModel(self.generator)
+
+
+class _FakeGenerativeModel:
+
+    def __init__(self, generator: FakeGenerator):
+        self.generator = generator
+
+    @staticmethod
+    def _chunk(text: str) -> SimpleNamespace:
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(text=text, candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+    def generate_content(self, prompt, stream: bool = False):
+        if stream:
+            return (self._chunk(text) for text in self.generator.stream(str(prompt)))
+        return self._chunk(self.generator.generate(str(prompt)))
+
+
+@contextmanager
+def use_fake_genai(fake: Optional[FakeGenAI] = None):
+    """Dentro do bloco, modules.google_ai_commands chama o FakeGenAI em vez da API do Google."""
+    from modules import google_ai_commands
+    fake = fake or FakeGenAI()
+    previous = google_ai_commands.genai, google_ai_commands._model
+    google_ai_commands.genai, google_ai_commands._model = fake, None
+    try:
+        yield fake
+    finally:
+        google_ai_commands.genai, google_ai_commands._model = previous
@@ -1,11 +1,13 @@
-import PyPDF2
-import markdown
-from bs4 import BeautifulSoup
+import abc
+import html
 import logging
 import os
 import csv
+import re
 import tempfile
 import sys
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from config.settings import config
 from modules.utils import Emojis
 
 logging.basicConfig(level=logging.INFO)
@@ -19,37 +21,73 @@ class FileExtractorFactory:
         if file_path.endswith('.pdf'):
             return PDFExtractor(file_path)
         elif file_path.endswith('.md'):
+            if config.ingest.markdown_extractor == "html":
+                return HtmlMarkdownExtractor(file_path)
             return MarkdownExtractor(file_path)
         else:
             raise ValueError("Unsupported file type. Only .pdf and .md files are supported.")
 
-class FileExtractor:
+class Section(NamedTuple):
+    """Trecho de um documento e o caminho de títulos (H1 > H2 > ...) em que ele está."""
+    heading_path: Tuple[str, ...]
+    text: str
+
+
+def format_heading_path(heading_path: Tuple[str, ...]) -> Optional[str]:
+    """Caminho de títulos como texto ("Guia > Instalação"); None fora de qualquer título."""
+    return " > ".join(heading_path) if heading_path else None
+
+
+class FileExtractor(abc.ABC):
 
     def __init__(self, file_path):
         self.file_path = file_path
 
-    def extract_text(file_path):
-        pass
+    def iter_sections(self) -> Iterator[Section]:
+        """
+        Gera o texto do arquivo por seção. Formatos sem títulos (PDF) geram cada pedaço
+        de iter_text com caminho vazio; "".join das seções é igual a "".join(iter_text()).
+        """
+        for text in self.iter_text():
+            yield Section((), text)
 
+    @abc.abstractmethod
+    def iter_text(self):
+        """
+        Gera o texto do arquivo em pedaços (páginas ou seções), sem montar o documento inteiro.
+
+        Yields:
+            str: O próximo pedaço de texto.
+        """
 
-class PDFExtractor(FileExtractor):
     def extract_text(self):
         """
-        Extracts text from a PDF file.
+        Extracts the whole text of the file.
 
         Returns:
-            str: The extracted text from the PDF.
+            str: The extracted text.
+        """
+        return "".join(self.iter_text()).strip()
+
+
+class PDFExtractor(FileExtractor):
+    def iter_text(self):
+        """
+        Extracts text from a PDF file, one page at a time.
+
+        Yields:
+            str: The extracted text of each page.
         """
-        text = ""
         if not self.file_path.endswith('.pdf'):
             logger.error(f"{Emojis.ERROR.value} Arquivo não é um PDF: {self.file_path}")
             raise ValueError("O arquivo fornecido não é um PDF.")
+        # Importado sob demanda: comandos que não leem arquivos não pagam o import
+        import PyPDF2
         try:
             with open(self.file_path, "rb") as file:
                 reader = PyPDF2.PdfReader(file)
                 for page in reader.pages:
-                    text += page.extract_text() or ""
-                return text.strip()
+                    yield page.extract_text() or ""
         except FileNotFoundError:
             logger.error(f"{Emojis.ERROR.value} Arquivo não encontrado: {self.file_path}")
             raise
@@ -60,20 +98,188 @@ class PDFExtractor(FileExtractor):
             logger.error(f"{Emojis.ERROR.value} Erro ao extrair texto do PDF: {e}")
             raise e
 
+# Blocos reconhecidos linha a linha pelo MarkdownExtractor
+_ATX_HEADING = re.compile(r" {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+_SETEXT_UNDERLINE = re.compile(r" {0,3}(=+|-+)[ \t]*$")
+_THEMATIC_BREAK = re.compile(r" {0,3}(?:(?:\*[ \t]*){3,}|(?:-[ \t]*){3,}|(?:_[ \t]*){3,})$")
+_FENCE = re.compile(r" {0,3}(`{3,}|~{3,})")
+_LINK_DEFINITION = re.compile(r" {0,3}\[[^\]]+\]:\s")
+_BLOCK_PREFIX = re.compile(r"[ \t]*(?:>[ \t]?)*[ \t]*(?:[-*+][ \t]+|\d{1,9}[.)][ \t]+)?(?:\[[ xX]\][ \t]+)?")
+_TABLE_DELIMITER = re.compile(r"[ \t]*\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$")
+# Marcação inline: imagens e links viram o texto, código e ênfase perdem os delimitadores
+_INLINE_CHARS = frozenset("[]`*_~<>&\\|!")
+_INLINE_PATTERNS = (
+    (re.compile(r"<!--.*?-->"), ""),
+    (re.compile(r"!?\[([^\]]*)\](?:\([^)]*\)|\[[^\]]*\])?"), r"\1"),
+    (re.compile(r"<((?:https?|ftp|mailto):[^>\s]+)>"), r"\1"),
+    (re.compile(r"</?[A-Za-z][^>]*>"), ""),
+    (re.compile(r"(`+)(.+?)\1"), r"\2"),
+    (re.compile(r"(?<!\\)(\*{1,3}|~~)(?=\S)(.+?)(?<=[^\s\\])\1"), r"\2"),
+    (re.compile(r"(?<![\w\\])(_{1,3})(?=\S)(.+?)(?<=[^\s\\])\1(?!\w)"), r"\2"),
+    (re.compile(r"\\([!-/:-@\[-`{-~])"), r"\1"),
+)
+
+
+def _inline_text(line: str) -> str:
+    if _INLINE_CHARS.isdisjoint(line):
+        return line
+    for pattern, replacement in _INLINE_PATTERNS:
+        line = pattern.sub(replacement, line)
+    if "|" in line:
+        line = " ".join(cell.strip() for cell in line.strip().strip("|").split("|"))
+    return html.unescape(line) if "&" in line else line
+
+
 class MarkdownExtractor(FileExtractor):
-    def extract_text(self):
+    """
+    Converte Markdown direto em texto, em uma passada pelas linhas do arquivo.
+
+    Sem renderizar HTML: títulos ATX e setext, blocos de código, citações, listas,
+    tabelas, links, imagens, ênfase e tags HTML são reconhecidos pela própria linha e
+    reduzidos ao texto. Cada título abre uma seção, gerada assim que a próxima começa,
+    com o caminho de títulos acima dela (ver `Section`).
+    """
+
+    def iter_text(self):
         """
-        Extracts text from a Markdown file.
+        Extracts text from a Markdown file, one section at a time.
 
-        Returns:
+        Yields:
+            str: The extracted text of each section.
+        """
+        for section in self.iter_sections():
+            yield section.text
+
+    def iter_sections(self) -> Iterator[Section]:
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                yield from self._parse(file)
+        except FileNotFoundError:
+            logger.error(f"{Emojis.ERROR.value} Arquivo não encontrado: {self.file_path}")
+            raise
+        except UnicodeDecodeError:
+            logger.error(f"{Emojis.ERROR.value} Erro de decodificação ao ler o arquivo: {self.file_path}")
+            raise
+        except Exception as e:
+            logger.error(f"{Emojis.ERROR.value} Erro ao extrair texto do Markdown: {e}")
+            raise e
+
+    @staticmethod
+    def _parse(lines) -> Iterator[Section]:
+        headings: List[Tuple[int, str]] = []
+        blocks: List[str] = []
+        paragraph: List[str] = []
+        fence = None
+        code: List[str] = []
+        in_comment = False
+        first = True
+
+        def close_paragraph():
+            if paragraph:
+                blocks.append("\n".join(paragraph))
+                paragraph.clear()
+
+        def take_section():
+            close_paragraph()
+            if not blocks:
+                return None
+            section = Section(tuple(title for _, title in headings), "".join(block + "\n\n" for block in blocks))
+            blocks.clear()
+            return section
+
+        def open_section(level, title):
+            # Fecha a seção atual e troca o fim do caminho de títulos pelo novo título
+            section = take_section()
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, title))
+            if title:
+                blocks.append(title)
+            return section
+
+        lines = iter(lines)
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if first:
+                first = False
+                if line.strip() == "---":
+                    # Front matter YAML: ignorado até o "---" de fechamento
+                    for line in lines:
+                        if line.strip() in ("---", "..."):
+                            break
+                    continue
+            if fence is not None:
+                if line.lstrip().startswith(fence):
+                    blocks.append("\n".join(code))
+                    code.clear()
+                    fence = None
+                else:
+                    code.append(line)
+                continue
+            if in_comment:
+                in_comment = "-->" not in line
+                continue
+
+            stripped = line.strip()
+            if not stripped:
+                close_paragraph()
+                continue
+            if stripped[0] == "#":
+                match = _ATX_HEADING.match(line)
+                if match:
+                    section = open_section(len(match.group(1)), _inline_text(match.group(2) or "").strip())
+                    if section:
+                        yield section
+                    continue
+            if paragraph and stripped[0] in "=-" and len(paragraph) == 1 and _SETEXT_UNDERLINE.match(line):
+                title = paragraph.pop()
+                section = open_section(1 if stripped[0] == "=" else 2, title)
+                if section:
+                    yield section
+                continue
+            if stripped[0] in "`~":
+                match = _FENCE.match(line)
+                if match:
+                    close_paragraph()
+                    fence = match.group(1)
+                    continue
+            if stripped[0] in "-*_" and _THEMATIC_BREAK.match(line):
+                close_paragraph()
+                continue
+            if stripped.startswith("<!--") and "-->" not in stripped:
+                in_comment = True
+                continue
+            if stripped[0] == "[" and _LINK_DEFINITION.match(line):
+                continue
+            if "|" in stripped and stripped[0] in "|:-" and _TABLE_DELIMITER.match(line):
+                continue
+            text = _inline_text(line[_BLOCK_PREFIX.match(line).end():]).strip()
+            if text:
+                paragraph.append(text)
+
+        if fence is not None and code:
+            blocks.append("\n".join(code))
+        section = take_section()
+        if section:
+            yield section
+
+
+class HtmlMarkdownExtractor(FileExtractor):
+    def iter_text(self):
+        """
+        Extracts text from a Markdown file by rendering it to HTML (markdown + BeautifulSoup).
+
+        Yields:
             str: The extracted text from the Markdown file.
         """
+        import markdown
+        from bs4 import BeautifulSoup
         try:
             with open(self.file_path, "r", encoding="utf-8") as file:
                 md_content = file.read()
                 html_content = markdown.markdown(md_content)
                 soup = BeautifulSoup(html_content, "html.parser")
-                return soup.get_text(separator="\n", strip=True)
+                yield soup.get_text(separator="\n", strip=True)
             
         except FileNotFoundError:
             logger.error(f"{Emojis.ERROR.value} Arquivo não encontrado: {self.file_path}")
@@ -86,28 +292,17 @@ class MarkdownExtractor(FileExtractor):
             raise e
         
 
-def save_embedding_to_csv(index, chunk, embedding, source, csv_file_path):
-    """Save embedding data to CSV file."""
-    with open(csv_file_path, 'a') as f:
-        clean_chunk = chunk.replace(',', ' ')
-        clean_chunk = clean_chunk.replace('\n', ' ')
-        clean_chunk = clean_chunk.replace('"', '""')  # Escape quotes for CSV
-        
-        embedding_str = ','.join(map(str, embedding))
-        f.write(f"\"{index}\",\"{clean_chunk}\",\"{embedding_str}\",\"{source}\"\n")
-
-def import_embeddings_from_csv(file_path, insert_vector):
+def import_embeddings_from_csv(file_path, bulk_insert):
     """Import embeddings from a CSV file."""
+    from modules.vectors import as_vector
     with open(file_path, 'r') as f:
         try:
             reader = csv.reader(f)
-            for row in reader:
-                index, content, embedding, source = row
+            # As linhas são consumidas em streaming pelo insert em lote
+            rows = ((as_vector(embedding), content, source) for _, content, embedding, source in reader)
+            vector_ids = bulk_insert(rows)
 
-                vector_id = insert_vector(embedding, content, source)
-                logger.info(f"{Emojis.INFO.value} Chunk {index} inserido com ID: {vector_id}")
-
-            logger.info(f"{Emojis.SUCCESS.value} Importação de embeddings concluída.")
+            logger.info(f"{Emojis.SUCCESS.value} Importação de embeddings concluída. {len(vector_ids)} chunks inseridos.")
             os.remove(file_path)
         except csv.Error as e:
             logger.error(f"{Emojis.ERROR.value} Erro ao ler o CSV: {e}")
@@ -133,6 +328,40 @@ def get_csv_file_path():
 
     return csv_file_path
 
+def get_export_dir_path():
+    """Get the path to the directory of the binary embeddings export."""
+    export_dir = "resources/files"
+    if getattr(sys, 'frozen', False):
+        # Executável - usar caminho absoluto
+        app_data_dir = os.path.join(tempfile.gettempdir(), 'local-rag-embeddings')
+        os.makedirs(app_data_dir, exist_ok=True)
+        export_dir_path = os.path.join(app_data_dir, 'embeddings_export')
+        logger.info(f"{Emojis.INFO.value} Executável detectado. Exportação em: {export_dir_path}")
+    else:
+        # Desenvolvimento - usar caminho relativo
+        os.makedirs(export_dir, exist_ok=True)
+        export_dir_path = os.path.join(export_dir, 'embeddings_export')
+        logger.info(f"{Emojis.INFO.value} Modo desenvolvimento. Exportação em: {export_dir_path}")
+
+    return export_dir_path
+
+def get_search_index_dir_path():
+    """Get the path to the directory of the in-process search index."""
+    index_dir = "resources/files"
+    if getattr(sys, 'frozen', False):
+        # Executável - usar caminho absoluto
+        app_data_dir = os.path.join(tempfile.gettempdir(), 'local-rag-embeddings')
+        os.makedirs(app_data_dir, exist_ok=True)
+        index_dir_path = os.path.join(app_data_dir, 'search_index')
+        logger.info(f"{Emojis.INFO.value} Executável detectado. Índice de busca em: {index_dir_path}")
+    else:
+        # Desenvolvimento - usar caminho relativo
+        os.makedirs(index_dir, exist_ok=True)
+        index_dir_path = os.path.join(index_dir, 'search_index')
+        logger.info(f"{Emojis.INFO.value} Modo desenvolvimento. Índice de busca em: {index_dir_path}")
+
+    return index_dir_path
+
 def get_cache_file_path():
     """Get the path to the cache file for embeddings."""
     cache_dir = "resources/files"
@@ -157,13 +386,13 @@ def get_metrics_file_path():
         # Executável - usar caminho absoluto
         app_data_dir = os.path.join(tempfile.gettempdir(), 'local-rag-embeddings')
         os.makedirs(app_data_dir, exist_ok=True)
-        metrics_file_path = os.path.join(app_data_dir, 'metrics.json')
+        metrics_file_path = os.path.join(app_data_dir, 'metrics.jsonl')
         logger.info(f"{Emojis.INFO.value} Executável detectado. Metrics em: {metrics_file_path}")
     else:
         # Desenvolvimento - usar caminho relativo
         os.makedirs(metrics_dir, exist_ok=True)
         os.makedirs(metrics_dir, exist_ok=True)
-        metrics_file_path = os.path.join(metrics_dir, 'metrics.json')
+        metrics_file_path = os.path.join(metrics_dir, 'metrics.jsonl')
         logger.info(f"{Emojis.INFO.value} Modo desenvolvimento. Metrics em: {metrics_file_path}")
 
     return metrics_file_path
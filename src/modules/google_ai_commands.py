@@ -1,42 +1,60 @@
 import numpy as np
-import time
 import logging
-import google.generativeai as genai
 import os
+import threading
 from config.settings import config
-from modules.files import FileExtractorFactory, save_embedding_to_csv, get_csv_file_path, get_cache_file_path
-from modules.database import query_embedding, insert_vector
+from modules.files import FileExtractorFactory, format_heading_path, get_export_dir_path, get_cache_file_path
+from modules.export import EmbeddingExportWriter
+from modules.database import add_chunk_references, bulk_insert_vectors, store_minhash
+from modules.dedup import ChunkDeduplicator
+from modules.search import HybridRetriever
+from modules.answer_cache import get_answer_cache, chunk_fingerprint
+from modules.context import build_context, build_rag_prompt
 from modules.utils import Emojis
-from modules.cache import EmbeddingCache
-from modules.metrics import metrics, track_time, MetricsDashboard
+from modules.cache import create_embedding_cache
+from modules.rate_limiter import EmbeddingScheduler
+from modules.batching import plan_batches
+from modules.vectors import as_vector
+from modules.chunking import split_text, iter_section_chunks, batched, hash_chunk
+from modules.metrics import metrics, track_time, MetricsDashboard, QuestionTimer, TimedIterator
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure com sua API Key
-genai.configure(api_key=config.google_api_key)
-
-# Inicializar o cache
-cache = EmbeddingCache(cache_dir=get_cache_file_path())
-
-dash = MetricsDashboard()
-
-# chunk_size=1536, chunk_overlap=153 config para gemini
-def split_text(text, chunk_size=config.embedding.chunk_size, chunk_overlap=config.embedding.chunk_overlap):
-    """Divide o texto em chunks com sobreposição."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - chunk_overlap
-        if end >= len(text):
-            break
-    return chunks
+# SDK do Google (ou o substituto de modules.fake_backend.use_fake_genai) e cache de embeddings,
+# criados no primeiro uso: importar este módulo não carrega o SDK nem toca o disco
+genai = None
+cache = None
+_init_lock = threading.Lock()
+
+def get_genai():
+    """Importa e configura o google.generativeai na primeira chamada à API (o import leva ~1s)."""
+    global genai
+    with _init_lock:
+        if genai is None:
+            import google.generativeai
+            google.generativeai.configure(api_key=config.google_api_key)
+            genai = google.generativeai
+        return genai
+
+def get_cache():
+    """Cache de embeddings do processo, aberto na primeira consulta."""
+    global cache
+    with _init_lock:
+        if cache is None:
+            cache = create_embedding_cache(get_cache_file_path())
+        return cache
 
 @track_time('processing_time')
-def process_embeddings(generate_type):
-    path_to_file = input("Digite o caminho do arquivo (ex: resources/files/some-file.pdf): ")
+def process_embeddings(generate_type, path_to_file=None, job=None):
+    """
+    Extrai, divide e gera os embeddings de um arquivo, gravando no banco ("db") ou exportando ("file").
+
+    No modo "db" os chunks passam pelo diário de um job (ver modules.jobs): se o processo
+    cair no meio, `--resume` continua a partir do último lote gravado.
+    """
+    if path_to_file is None:
+        path_to_file = input("Digite o caminho do arquivo (ex: resources/files/some-file.pdf): ")
     if not path_to_file:
         logger.error(f"{Emojis.ERROR.value} Nenhum caminho de arquivo fornecido.")
         return
@@ -45,67 +63,192 @@ def process_embeddings(generate_type):
         return
     logger.info(f"{Emojis.INFO.value} Iniciando o processamento do arquivo: {path_to_file}")
 
-    extracted_text = FileExtractorFactory.create_extractor(path_to_file).extract_text()
+    file_name = os.path.basename(path_to_file)
+    window_size = config.embedding.batch_size * config.embedding.max_concurrent_batches * config.embedding.pipeline_rounds
+    if generate_type != "file":
+        _process_embeddings_job(path_to_file, file_name, window_size, job)
+        return
 
-    text_chunks = split_text(extracted_text)
-    logger.info(f"{Emojis.INFO.value} Número de chunks: {len(text_chunks)}")
+    # Páginas -> chunks -> embeddings -> gravação, uma janela de lotes por vez
+    segments = TimedIterator(FileExtractorFactory.create_extractor(path_to_file).iter_sections())
+    chunks = TimedIterator(iter_section_chunks(segments))
+    writer = EmbeddingExportWriter(get_export_dir_path())
+    total_chunks = 0
+    try:
+        for window in batched(chunks, window_size):
+            fields = [
+                {"chunk_index": total_chunks + i, "start_offset": chunk.start, "end_offset": chunk.end,
+                 "section": format_heading_path(heading_path)}
+                for i, (chunk, heading_path) in enumerate(window)
+            ]
+            if not embed_and_store([chunk.text for chunk, _ in window], [file_name] * len(window), writer, fields):
+                break
+            total_chunks += len(window)
+            logger.info(f"{Emojis.INFO.value} {total_chunks} chunks processados até agora.")
+    finally:
+        writer.close()
+        # O chunker consome as páginas: o tempo de chunking é o total do iterador menos a extração
+        metrics.observe('extract_time', segments.seconds)
+        metrics.observe('chunk_time', chunks.seconds - segments.seconds)
+
+    logger.info(f"{Emojis.INFO.value} Número de embeddings gerados: {total_chunks}")
+    metrics.increment('files_processed')
+    logger.info(f"{Emojis.SUCCESS.value} Processamento concluído.")
 
-    embeddings = generate_embeddings(text_chunks)
-    file_name = os.path.basename(path_to_file)
-    if embeddings:
-        logger.info(f"{Emojis.INFO.value} Número de embeddings gerados: {len(embeddings)}")
-        csv_file_path = get_csv_file_path()
+def _process_embeddings_job(path_to_file, file_name, window_size, job=None):
+    """Grava os chunks do arquivo no diário do job e embeda os pendentes, uma janela por vez."""
+    from modules.jobs import JobJournal
+    path = os.path.abspath(path_to_file)
+    if job is None:
+        job = JobJournal.start("file", {"path": path})
+    if path not in job.files():
+        # Extração e chunking em streaming direto para o diário, numa única transação
+        segments = TimedIterator(FileExtractorFactory.create_extractor(path).iter_sections())
+        chunks = TimedIterator(iter_section_chunks(segments))
+        job.plan((
+            (chunk.text, file_name, {"chunk_index": index, "start_offset": chunk.start, "end_offset": chunk.end,
+                                     "section": format_heading_path(heading_path)})
+            for index, (chunk, heading_path) in enumerate(chunks)
+        ), path)
+        metrics.observe('extract_time', segments.seconds)
+        metrics.observe('chunk_time', chunks.seconds - segments.seconds)
+
+    total_chunks = 0
+    try:
+        for window in batched(job.iter_pending(path), window_size):
+            seqs = [seq for seq, _, _, _ in window]
+            if not embed_and_store([text for _, text, _, _ in window], [source for _, _, source, _ in window],
+                                   fields=[fields for *_, fields in window], on_batch=job.recorder(seqs)):
+                job.log_interrupted()
+                return
+            total_chunks += len(window)
+            logger.info(f"{Emojis.INFO.value} {total_chunks} chunks processados até agora.")
+    except KeyboardInterrupt:
+        job.log_interrupted()
+        raise
+    job.complete_file(path)
+    job.finish()
+
+    logger.info(f"{Emojis.INFO.value} Número de embeddings gerados: {total_chunks}")
+    metrics.increment('files_processed')
+    logger.info(f"{Emojis.SUCCESS.value} Processamento concluído.")
 
-        for i, (chunk, embedding) in enumerate(zip(text_chunks, embeddings)):
+def embed_and_store(chunks, sources, writer=None, fields=None, on_batch=None):
+    """
+    Gera os embeddings de uma janela de chunks e grava no banco (ou na exportação, se `writer` for informado).
 
-            if generate_type == "file":
-                save_embedding_to_csv(i+1, chunk, embedding, source=file_name, csv_file_path=csv_file_path)
-            elif generate_type == "db":
-                insert_vector(str().join(map(str, embedding)), chunk, description=file_name)
-    else:
+    `fields` opcional traz, por chunk, as colunas extras de metadata (ver database.METADATA_FIELDS).
+    `on_batch` é repassado ao bulk_insert_vectors (ver JobJournal.recorder).
+    No banco, duplicatas e quase duplicatas reaproveitam o vetor existente (ver DedupConfig).
+    Retorna False se a geração de embeddings falhar.
+    """
+    if writer is None and config.dedup.enabled:
+        return _embed_and_store_deduplicated(chunks, sources, fields, on_batch)
+    embeddings = generate_embeddings(chunks)
+    if embeddings is None:
         logger.error(f"{Emojis.ERROR.value} Falha ao gerar embeddings.")
+        return False
 
-    metrics.increment('files_processed')
-    logger.info(f"{Emojis.SUCCESS.value} Processamento concluído.")
-    dash.save_metrics_to_file()
+    fields = fields or [None] * len(chunks)
+    if writer is not None:
+        writer.write_many(zip(embeddings, chunks, sources, fields))
+    else:
+        bulk_insert_vectors((
+            (embedding, chunk, source, chunk_fields)
+            for chunk, embedding, source, chunk_fields in zip(chunks, embeddings, sources, fields)
+        ), on_batch=on_batch)
+    return True
+
+def _record_positions(on_batch, cursor, positions, vector_ids):
+    """Repassa ao on_batch da janela linhas em posições esparsas, agrupando as posições contíguas."""
+    start = 0
+    for end in range(1, len(positions) + 1):
+        if end == len(positions) or positions[end] != positions[end - 1] + 1:
+            on_batch(cursor, positions[start], vector_ids[start:end])
+            start = end
 
-def generate_embeddings(texts, model_name=config.embedding.model_name, wait_time=config.embedding.rate_limit_delay, range_limit=config.embedding.batch_size):
+def _embed_and_store_deduplicated(chunks, sources, fields, on_batch):
+    """
+    Só as cópias únicas da janela são embedadas e ganham vetor (e assinatura MinHash);
+    duplicatas exatas e quase duplicatas são gravadas como chunks que apontam para o
+    vetor da primeira cópia, com a própria fonte e posição.
+    """
+    fields = [
+        {**(chunk_fields or {}), "chunk_hash": (chunk_fields or {}).get("chunk_hash") or hash_chunk(chunk)}
+        for chunk, chunk_fields in zip(chunks, fields or [None] * len(chunks))
+    ]
+    plan = ChunkDeduplicator().plan(chunks, fields)
+    if plan.duplicates:
+        metrics.increment('duplicate_chunks', len(plan.duplicates))
+        logger.info(f"{Emojis.INFO.value} {len(plan.duplicates)} chunks duplicados ({plan.near_duplicates} quase idênticos) reaproveitam vetores existentes.")
+
+    embeddings = generate_embeddings([chunks[position] for position in plan.unique]) if plan.unique else []
+    if embeddings is None:
+        logger.error(f"{Emojis.ERROR.value} Falha ao gerar embeddings.")
+        return False
+
+    def on_vectors(cursor, offset, vector_ids):
+        positions = plan.unique[offset:offset + len(vector_ids)]
+        store_minhash(cursor, (
+            (vector_id, *plan.signatures[position])
+            for position, vector_id in zip(positions, vector_ids) if position in plan.signatures
+        ))
+        if on_batch is not None:
+            _record_positions(on_batch, cursor, positions, vector_ids)
+
+    vector_ids = dict(zip(plan.unique, bulk_insert_vectors((
+        (embedding, chunks[position], sources[position], fields[position])
+        for position, embedding in zip(plan.unique, embeddings)
+    ), on_batch=on_vectors)))
+    references = [(position, existing if existing is not None else vector_ids[first]) for position, existing, first in plan.duplicates]
+    references.sort()
+    add_chunk_references(
+        ((vector_id, chunks[position], sources[position], fields[position]) for position, vector_id in references),
+        on_batch=(lambda cursor, offset, ids: _record_positions(on_batch, cursor, [position for position, _ in references], ids))
+        if on_batch is not None else None
+    )
+    return True
+
+def embed_documents(texts, model_name=config.embedding.model_name, task_type="RETRIEVAL_DOCUMENT"):
+    """Chama a API de embeddings para um lote de textos de documento (ou de consultas, com task_type RETRIEVAL_QUERY)."""
+    result = get_genai().embed_content(
+            model=model_name,
+            content=texts,
+            task_type=task_type,
+            output_dimensionality=config.database.embedding_dimension
+        )
+    metrics.increment('api_calls')
+    return [as_vector(embedding) for embedding in result['embedding']]
+
+def generate_embeddings(texts, model_name=config.embedding.model_name, range_limit=config.embedding.batch_size, embed_fn=None,
+                        task_type="RETRIEVAL_DOCUMENT"):
     """Gera embeddings para uma lista de textos."""
     try:
-        all_embeddings = []
-        
-        # Processa a lista em chunks de 5
-        for i in range(0, len(texts), range_limit):
-            # Cria lista secundária da posição i até i+5 (ou final da lista)
-            chunk = texts[i:i+range_limit]
-            logger.info(f"{Emojis.LOADING.value} Processando chunk {i//range_limit + 1}: posições {i} até {min(i+(range_limit - 1), len(texts)-1)}")
-            logger.info(f"{Emojis.INFO.value} Tamanho do chunk: {len(chunk)}")
-
-            chunk_in_cache = False
-            for text in chunk:
-                cached_embedding = cache.get(text, model_name)
-
-                if cached_embedding is not None:
-                    print(f"{Emojis.INFO.value} Usando embedding do cache.")
-                    all_embeddings.append([cached_embedding])
-                    chunk_in_cache = True
-
-            if chunk_in_cache == False:
-                time.sleep(wait_time)  # Pausa maior entre chunks
-                result = genai.embed_content(
-                        model=model_name,
-                        content=chunk, 
-                        task_type="RETRIEVAL_DOCUMENT",
-                        output_dimensionality=config.database.embedding_dimension
-                    )
-                metrics.increment('api_calls')
-
-                cache.set_batch(chunk, model_name, [np.array(embedding) for embedding in result['embedding']])
-                for embedding in result['embedding']:
-                    all_embeddings.append([np.array(embedding)])
-
-            logger.info(f"{Emojis.INFO.value} Chunk processado. Total de embeddings até agora: {len(all_embeddings)}")
-
+        if embed_fn is None:
+            embed_fn = lambda batch: embed_documents(batch, model_name, task_type)
+        cache_model = model_name if task_type == "RETRIEVAL_DOCUMENT" else query_cache_model(model_name)
+
+        def embed_and_cache(batch):
+            # Cada lote vai para o cache assim que volta da API: uma falha em outro lote
+            # da janela (ou um Ctrl+C) não descarta embeddings já pagos
+            embeddings = list(embed_fn(batch))
+            if len(embeddings) == len(batch):
+                get_cache().set_batch(batch, cache_model, embeddings)
+            return embeddings
+
+        scheduler = EmbeddingScheduler(embed_and_cache)
+
+        # Só os textos fora do cache vão para a API, em lotes cheios
+        plan = plan_batches(texts, lambda text: get_cache().get(text, cache_model), range_limit)
+        metrics.increment('cache_hits', plan.hit_count)
+        metrics.increment('cache_misses', plan.miss_count)
+        logger.info(f"{Emojis.INFO.value} Cache: {plan.hit_count}/{plan.total} hits ({plan.hit_rate:.1%}). {plan.miss_count} textos em {len(plan.batches)} lotes para a API.")
+
+        logger.info(f"{Emojis.PROCESSING.value} Enviando {len(plan.batches)} lotes para a API ({scheduler.max_workers} em paralelo)")
+        batch_results = scheduler.run(plan.batches)
+        metrics.increment('embeddings_generated', plan.miss_count)
+
+        all_embeddings = [as_vector(embedding) for embedding in plan.assemble(batch_results)]
         logger.info(f"{Emojis.INFO.value} Total de embeddings gerados: {len(all_embeddings)}")
 
         return all_embeddings
@@ -116,7 +259,7 @@ def generate_embeddings(texts, model_name=config.embedding.model_name, wait_time
 def check_embedding_dimensions(text="test", model_name="text-embedding-004"):
     """Verifica a dimensão dos embeddings do modelo atual"""
     try:
-        result = genai.embed_content(
+        result = get_genai().embed_content(
             model=model_name,
             content=[text],
             task_type="RETRIEVAL_DOCUMENT"
@@ -131,14 +274,15 @@ def check_embedding_dimensions(text="test", model_name="text-embedding-004"):
 def get_embedding(text, model_name="text-embedding-004"):
     """Gera um embedding para um único texto."""
     try:
-        result = genai.embed_content(
+        result = get_genai().embed_content(
             model=model_name,
             content=[text],
             task_type="RETRIEVAL_QUERY",
             output_dimensionality=config.database.embedding_dimension
         )
         metrics.increment('api_calls')
-        return np.array(result['embedding'])
+        metrics.increment('embeddings_generated')
+        return as_vector(result['embedding'])
     except Exception as e:
         print(f"{Emojis.ERROR.value} Erro ao gerar embedding: {e}")
         return None
@@ -146,7 +290,7 @@ def get_embedding(text, model_name="text-embedding-004"):
 def carregar_modelos():
     print("Modelos disponíveis:")
 
-    for model in genai.list_models():
+    for model in get_genai().list_models():
         # Imprime o nome (identificador) do modelo
         print(f"- Nome: {model.name}")
 
@@ -166,7 +310,7 @@ def carregar_modelos():
     metrics.increment('api_calls')
 
 
-def prompt_request():
+def prompt_request(k=None, collection=None, source=None, section=None):
     print("✨IA com RAG ✨")
     print("⭐" * 30)
     ia_name = input(f"{Emojis.QUESTION.value} Qual o nome da sua IA?: ")
@@ -181,34 +325,109 @@ def prompt_request():
 
     while text != "sair":
         print(f"{Emojis.LOADING.value * 3} Processando sua pergunta...")
-        processar_pergunta(text, ia_name)
+        processar_pergunta(text, ia_name, k, collection, source, section)
         text = input(f"{Emojis.QUESTION.value} Digite sua pergunta (ou 'sair' para encerrar): ")
 
     print(f"{Emojis.STAR.value} Que pena, volte sempre! {Emojis.STAR.value}")
+    MetricsDashboard().save_metrics_to_file()
 
-def processar_pergunta(text, ia_name):
-
-    cached_embedding = cache.get(text, config.embedding.model_name)
-
-    embedding = None
-    if cached_embedding is not None:
-        print(f"{Emojis.INFO.value} Usando embedding do cache.")
-        embedding = cached_embedding
-    else:
-        embedding = get_embedding(text)
-        cache.set(text, config.embedding.model_name, embedding)
-
-    context = query_embedding(text, str(embedding[0]))
-
-    rag_prompt = f"""
-    Use o seguinte contexto para responder à pergunta. Se a resposta não estiver no contexto, diga que não sabe.
-
-    Contexto: {context}
+def query_cache_model(model_name=config.embedding.model_name):
+    """
+    Modelo usado como chave no cache para embeddings de consulta.
 
-    Pergunta: {text}
+    Perguntas usam task_type RETRIEVAL_QUERY e não podem compartilhar entradas com
+    os chunks (RETRIEVAL_DOCUMENT) de mesmo texto.
     """
+    return f"{model_name}/RETRIEVAL_QUERY"
 
-    model = genai.GenerativeModel(config.gen_ai_model)
+def search_many(queries, k=config.search.top_k, model_name=config.embedding.model_name, embed_fn=None, **filters):
+    """
+    Busca em lote para avaliações e perguntas em massa: retorna, por pergunta, a lista de SearchHit.
 
-    response = model.generate_content(rag_prompt)
-    print(f"{Emojis.ROBOT.value} {ia_name} : {response.candidates[0].content.parts[0].text}\n")
\ No newline at end of file
+    As perguntas são embedadas em lotes (com cache e rate limit, como os documentos)
+    e as buscas vão juntas ao backend; no modo híbrido, as que o BM25 resolve sozinho
+    não são embedadas (ver HybridRetriever). `filters` (collection, source, document_id, section)
+    restringem a busca antes do KNN. Retorna None se a geração de embeddings falhar.
+    """
+    results = HybridRetriever().retrieve_many(
+        list(queries), lambda texts: generate_embeddings(texts, model_name, embed_fn=embed_fn, task_type="RETRIEVAL_QUERY"),
+        k, **filters
+    )
+    return [result.hits for result in results] if results is not None else None
+
+def get_query_embedding(text, model_name=config.embedding.model_name):
+    """Embedding de consulta com cache. Retorna None em caso de erro."""
+    embedding = get_cache().get(text, query_cache_model(model_name))
+    if embedding is not None:
+        metrics.increment('cache_hits')
+        print(f"{Emojis.INFO.value} Usando embedding do cache.")
+        # O cache em pickle legado pode devolver (1, dim)
+        return as_vector(embedding)
+    metrics.increment('cache_misses')
+    embedding = get_embedding(text, model_name)
+    if embedding is not None:
+        get_cache().set(text, query_cache_model(model_name), embedding)
+    return embedding
+
+_model = None
+
+def get_generative_model():
+    """Cliente do modelo de geração, criado uma vez e reaproveitado entre perguntas."""
+    global _model
+    if _model is None:
+        _model = get_genai().GenerativeModel(config.gen_ai_model)
+    return _model
+
+def stream_answer(prompt):
+    """Gera a resposta em streaming, devolvendo os trechos de texto à medida que chegam."""
+    response = get_generative_model().generate_content(prompt, stream=True)
+    metrics.increment('api_calls')
+    for chunk in response:
+        for candidate in chunk.candidates:
+            for part in candidate.content.parts:
+                if part.text:
+                    yield part.text
+
+def generate_answer(prompt):
+    """Gera a resposta do modelo para um prompt já montado."""
+    return "".join(stream_answer(prompt))
+
+def processar_pergunta(text, ia_name, k=None, collection=None, source=None, section=None):
+    timer = QuestionTimer()
+
+    # Embedding da pergunta só se o atalho lexical não resolver a busca
+    retrieval = HybridRetriever().retrieve(text, get_query_embedding, k or config.search.top_k, timer,
+                                           collection=collection, source=source, section=section)
+    if retrieval is None:
+        return None
+    hits, embedding = retrieval.hits, retrieval.embedding
+    with timer.stage('retrieval_time'):
+        context = build_context(hits)
+
+    # Respostas repetidas (ou de perguntas quase iguais) com o mesmo contexto não chamam o modelo
+    answer_cache = get_answer_cache()
+    fingerprint = chunk_fingerprint((hit.vector_id, hit.content) for hit in hits)
+    answer = answer_cache.get(text, fingerprint, embedding) if answer_cache is not None else None
+    if answer is not None:
+        metrics.increment('answer_cache_hits')
+        timer.first_token()
+        print(f"{Emojis.ROBOT.value} {ia_name} : {answer}\n")
+    else:
+        # Cada trecho é impresso assim que chega
+        print(f"{Emojis.ROBOT.value} {ia_name} : ", end="", flush=True)
+        parts = []
+        timer.start_generation()
+        for part in stream_answer(build_rag_prompt(text, context)):
+            timer.first_token()
+            parts.append(part)
+            print(part, end="", flush=True)
+        print("\n")
+        answer = "".join(parts)
+        if answer_cache is not None:
+            metrics.increment('answer_cache_misses')
+            answer_cache.set(text, answer, fingerprint, embedding)
+
+    timer.finish()
+    timer.record()
+    logger.info(f"{Emojis.INFO.value} Tempos: {timer.summary()}")
+    return answer
@@ -0,0 +1,336 @@
+import fnmatch
+import glob
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from config.settings import config
+from modules import database
+from modules.chunking import Chunk, iter_section_chunks, hash_chunk
+from modules.files import FileExtractorFactory, format_heading_path
+from modules.jobs import JobJournal
+from modules.metrics import metrics, track_time, TimedIterator
+from modules.utils import Emojis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ExtractedFile(NamedTuple):
+    path: str
+    content_hash: str
+    chunks: List[Chunk]
+    size: int
+    seconds: float
+    unchanged: bool
+    extract_seconds: float = 0.0
+    chunk_seconds: float = 0.0
+    # Caminho de títulos de cada chunk (ver files.format_heading_path)
+    sections: Tuple[Optional[str], ...] = ()
+
+
+def discover_files(target: str, extensions=config.ingest.extensions) -> List[str]:
+    """Lista os arquivos suportados em um diretório (recursivo) ou que casam com um glob."""
+    if os.path.isdir(target):
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(target)
+            for name in names
+        ]
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(os.path.abspath(path) for path in paths if os.path.isfile(path) and path.endswith(tuple(extensions)))
+
+
+def hash_file(path: str) -> str:
+    """Hash SHA-256 do conteúdo do arquivo."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_and_chunk(path: str, known_hash: Optional[str] = None) -> ExtractedFile:
+    """
+    Extrai e divide um arquivo em chunks. Executado nos processos do pool.
+
+    Se o hash do arquivo for igual a `known_hash`, a extração é pulada. Os tempos de
+    extração (leitura, hash e texto das páginas) e de chunking vão no resultado, já que
+    as métricas do processo do pool não chegam ao processo principal.
+    """
+    start = time.perf_counter()
+    content_hash = hash_file(path)
+    size = os.path.getsize(path)
+    if content_hash == known_hash:
+        return ExtractedFile(path, content_hash, [], size, time.perf_counter() - start, True)
+    hashed = time.perf_counter()
+    sections = TimedIterator(FileExtractorFactory.create_extractor(path).iter_sections())
+    chunks, headings = [], []
+    for chunk, heading_path in iter_section_chunks(sections):
+        chunks.append(chunk)
+        headings.append(format_heading_path(heading_path))
+    elapsed = time.perf_counter() - start
+    extract_seconds = hashed - start + sections.seconds
+    return ExtractedFile(path, content_hash, chunks, size, elapsed, False, extract_seconds, elapsed - extract_seconds,
+                         tuple(headings))
+
+
+class _EmbeddingStage:
+    """
+    Acumula chunks de vários arquivos e envia janelas cheias para embedding e gravação.
+
+    Cada arquivo pode registrar um callback chamado quando todos os seus chunks já foram gravados.
+    Com um `journal`, cada chunk leva o seu `seq` no job e as faixas gravadas são registradas
+    na mesma transação que insere os vetores.
+    """
+
+    def __init__(self, embed_and_store, window_size: int, journal: Optional[JobJournal] = None):
+        self.embed_and_store = embed_and_store
+        self.window_size = window_size
+        self.journal = journal
+        self.chunks: List[str] = []
+        self.sources: List[str] = []
+        self.fields: List[Optional[dict]] = []
+        self.seqs: List[int] = []
+        self.added = 0
+        self.stored = 0
+        self.failed = False
+        self._completions: List[tuple] = []
+
+    def add(self, chunks: List[str], source: str, fields: Optional[List[dict]] = None,
+            on_complete: Optional[Callable[[], None]] = None, seqs: Optional[List[int]] = None) -> None:
+        self.chunks.extend(chunks)
+        self.sources.extend([source] * len(chunks))
+        self.fields.extend(fields or [None] * len(chunks))
+        self.seqs.extend(seqs or [])
+        self.added += len(chunks)
+        if on_complete is not None:
+            self._completions.append((self.added, on_complete))
+        while len(self.chunks) >= self.window_size and not self.failed:
+            self._flush(self.window_size)
+        self._run_completions()
+
+    def _flush(self, size: int) -> None:
+        chunks, self.chunks = self.chunks[:size], self.chunks[size:]
+        sources, self.sources = self.sources[:size], self.sources[size:]
+        fields, self.fields = self.fields[:size], self.fields[size:]
+        seqs, self.seqs = self.seqs[:size], self.seqs[size:]
+        on_batch = self.journal.recorder(seqs) if self.journal is not None else None
+        if self.embed_and_store(chunks, sources, fields=fields, on_batch=on_batch):
+            self.stored += len(chunks)
+        else:
+            self.failed = True
+
+    def _run_completions(self) -> None:
+        while self._completions and self._completions[0][0] <= self.stored and not self.failed:
+            _, callback = self._completions.pop(0)
+            callback()
+
+    def close(self) -> None:
+        if self.chunks and not self.failed:
+            self._flush(len(self.chunks))
+        self._run_completions()
+
+
+def _in_scope(path: str, target: str) -> bool:
+    """Indica se um documento registrado pertence ao diretório/glob sendo ingerido."""
+    if os.path.isdir(target):
+        return path.startswith(os.path.join(os.path.abspath(target), ""))
+    return fnmatch.fnmatch(path, os.path.abspath(target))
+
+
+def _complete_file(job: JobJournal, path: str, content_hash: str, collection: str) -> None:
+    database.upsert_document(path, content_hash, collection)
+    job.complete_file(path)
+
+
+def _reindex_file(extracted: ExtractedFile, known: Dict[str, tuple], stage: _EmbeddingStage, incremental: bool,
+                  collection: str, job: JobJournal) -> int:
+    """
+    Atualiza o banco para um arquivo novo ou alterado e retorna quantos chunks serão embedados.
+
+    No modo incremental, chunks com hash inalterado mantêm seus vetores; os demais são
+    removidos ou enviados ao estágio de embedding. O hash do documento é apagado antes
+    de remover os chunks antigos e só é gravado de novo depois que todos os chunks novos
+    foram persistidos, para que uma falha no meio não faça o arquivo ser pulado na
+    próxima execução incremental. Vetores não mudam de coleção
+    (partição do vec0): se o documento foi para outra coleção, todos os chunks são refeitos.
+    Os chunks novos são registrados no diário do job antes de seguir para o embedding.
+    """
+    path = extracted.path
+    previous = known.get(path)
+    # Sem hash até o fim: um documento com os chunks antigos já removidos nunca parece inalterado
+    document_id = database.upsert_document(path, "", collection)
+    reuse = incremental and previous is not None and previous[2] == collection
+
+    existing: Dict[str, List[int]] = {}
+    for chunk_id, chunk_hash in database.get_document_chunks(document_id):
+        existing.setdefault(chunk_hash, []).append(chunk_id)
+
+    new_chunks, new_fields, reused = [], [], []
+    for index, (chunk, section) in enumerate(zip(extracted.chunks, extracted.sections)):
+        chunk_hash = hash_chunk(chunk.text)
+        if reuse and existing.get(chunk_hash):
+            reused.append((index, chunk.start, chunk.end, section, existing[chunk_hash].pop()))
+            continue
+        new_chunks.append(chunk.text)
+        new_fields.append({
+            "document_id": document_id,
+            "chunk_hash": chunk_hash,
+            "chunk_index": index,
+            "start_offset": chunk.start,
+            "end_offset": chunk.end,
+            "collection": collection,
+            "section": section,
+        })
+
+    stale = [chunk_id for chunk_ids in existing.values() for chunk_id in chunk_ids]
+    if stale:
+        database.delete_chunks(stale)
+    if reused:
+        database.update_chunk_positions(reused)
+    logger.info(
+        f"{Emojis.INFO.value} {os.path.basename(path)}: {len(reused)} chunks reaproveitados, "
+        f"{len(new_chunks)} novos, {len(stale)} removidos."
+    )
+
+    source = os.path.basename(path)
+    seqs = job.plan(((text, source, fields) for text, fields in zip(new_chunks, new_fields)), path, extracted.content_hash)
+    stage.add(
+        new_chunks, source, new_fields,
+        on_complete=lambda: _complete_file(job, path, extracted.content_hash, collection), seqs=seqs
+    )
+    return len(new_chunks)
+
+
+def _resume_planned_files(job: JobJournal, stage: _EmbeddingStage, collection: str) -> int:
+    """Reenvia ao estágio de embedding os chunks ainda não gravados dos arquivos que o job já dividiu."""
+    resumed = 0
+    for path, (content_hash, done) in job.files().items():
+        if done:
+            continue
+        pending = list(job.iter_pending(path))
+        stage.add(
+            [text for _, text, _, _ in pending], os.path.basename(path), [fields for *_, fields in pending],
+            on_complete=lambda path=path, content_hash=content_hash: _complete_file(job, path, content_hash, collection),
+            seqs=[seq for seq, *_ in pending]
+        )
+        resumed += len(pending)
+    return resumed
+
+
+def _remove_missing_documents(target: str, paths: List[str], known: Dict[str, tuple]) -> int:
+    present = set(paths)
+    missing = [(path, document_id) for path, (document_id, *_) in known.items() if path not in present and _in_scope(path, target)]
+    for path, document_id in missing:
+        database.delete_document(document_id)
+        logger.info(f"{Emojis.INFO.value} Documento removido do índice: {path}")
+    return len(missing)
+
+
+@track_time('processing_time')
+def ingest(target: str, workers: Optional[int] = config.ingest.workers, incremental: bool = False,
+           collection: str = config.database.default_collection, job: Optional[JobJournal] = None) -> int:
+    """
+    Ingestão não interativa de um diretório ou glob.
+
+    Extração e chunking rodam em um pool de processos (PyPDF2 e BeautifulSoup não
+    liberam o GIL); os chunks alimentam um único estágio de embedding/inserção.
+    Cada arquivo é registrado em `documents` com o hash do conteúdo: reingerir um
+    arquivo substitui seus vetores. Com `incremental=True`, arquivos inalterados são
+    pulados, apenas chunks alterados são embedados e documentos que sumiram são removidos.
+    Os chunks vão para a partição `collection` do índice vetorial.
+    O progresso fica no diário de um job: se a ingestão for interrompida, `job`
+    (ver `resume_job`) retoma sem extrair de novo os arquivos já divididos.
+    Retorna o número de chunks gravados.
+    """
+    # Importado aqui para que os processos do pool não carreguem o SDK do Google
+    from modules.google_ai_commands import embed_and_store
+
+    paths = discover_files(target)
+    known = database.get_documents()
+    removed = _remove_missing_documents(target, paths, known) if incremental else 0
+    if not paths:
+        logger.error(f"{Emojis.ERROR.value} Nenhum arquivo suportado encontrado em: {target}")
+        return 0
+    if job is None:
+        job = JobJournal.start("ingest", {"target": target, "incremental": incremental, "collection": collection})
+    window_size = config.embedding.batch_size * config.embedding.max_concurrent_batches * config.embedding.pipeline_rounds
+    stage = _EmbeddingStage(embed_and_store, window_size, job)
+    planned = job.files()
+    if planned:
+        resumed = _resume_planned_files(job, stage, collection)
+        logger.info(f"{Emojis.INFO.value} {len(planned)} arquivos já divididos pelo job; {resumed} chunks pendentes.")
+        paths = [path for path in paths if path not in planned]
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"{Emojis.INFO.value} {len(paths)} arquivos para ingestão com {workers} processos{' (incremental)' if incremental else ''}.")
+
+    start = time.time()
+    total_bytes = 0
+    total_chunks = 0
+    done = 0
+    skipped = 0
+    pending_paths = iter(paths)
+
+    def submit(executor, path):
+        known_hash = known[path][1] if incremental and path in known and known[path][2] == collection else None
+        return executor.submit(extract_and_chunk, path, known_hash)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Limita os arquivos extraídos à frente do estágio de embedding para não acumular memória
+            in_flight = set()
+            for path in pending_paths:
+                in_flight.add(submit(executor, path))
+                if len(in_flight) >= workers * 2:
+                    break
+            while in_flight and not stage.failed:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = next(pending_paths, None)
+                    if path is not None:
+                        in_flight.add(submit(executor, path))
+                    done += 1
+                    try:
+                        extracted = future.result()
+                    except Exception as e:
+                        metrics.increment('errors')
+                        logger.error(f"{Emojis.ERROR.value} [{done}/{len(paths)}] Falha ao extrair arquivo: {e}")
+                        continue
+                    total_bytes += extracted.size
+                    metrics.observe('extract_time', extracted.extract_seconds or extracted.seconds)
+                    if extracted.unchanged:
+                        skipped += 1
+                        logger.info(f"{Emojis.DONE.value} [{done}/{len(paths)}] {extracted.path}: inalterado, pulando.")
+                        continue
+                    metrics.observe('chunk_time', extracted.chunk_seconds)
+                    total_chunks += _reindex_file(extracted, known, stage, incremental, collection, job)
+                    metrics.increment('files_processed')
+                    elapsed = time.time() - start
+                    logger.info(
+                        f"{Emojis.PROCESSING.value} [{done}/{len(paths)}] {extracted.path}: {len(extracted.chunks)} chunks "
+                        f"(extração {extracted.seconds:.2f}s) | {total_chunks / elapsed:.1f} chunks/s, "
+                        f"{total_bytes / elapsed / 1e6:.2f} MB/s"
+                    )
+            if stage.failed:
+                for future in in_flight:
+                    future.cancel()
+        stage.close()
+    except KeyboardInterrupt:
+        job.log_interrupted()
+        raise
+    if stage.failed:
+        job.log_interrupted()
+    else:
+        job.finish()
+
+    elapsed = time.time() - start
+    logger.info(
+        f"{Emojis.SUCCESS.value} Ingestão concluída: {done} arquivos ({skipped} inalterados, {removed} removidos), "
+        f"{stage.stored} chunks gravados em {elapsed:.2f}s "
+        f"({done / elapsed:.2f} arquivos/s, {stage.stored / elapsed:.1f} chunks/s)."
+    )
+    return stage.stored
@@ -0,0 +1,244 @@
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from modules import database
+from modules.utils import Emojis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chunk planejado: (texto, fonte, campos de metadata ou None)
+PlannedChunk = Tuple[str, str, Optional[dict]]
+
+
+class JobJournal:
+    """
+    Diário de um job de embedding, gravado no próprio banco para sobreviver a falhas e Ctrl+C.
+
+    - `jobs`: tipo do job ("ingest" ou "file"), parâmetros em JSON e estado ("running"/"done")
+    - `job_files`: arquivos já extraídos e divididos, com o hash do conteúdo e se já foram concluídos
+    - `job_chunks`: os chunks planejados (texto, fonte e metadata), numerados por `seq`
+    - `job_batches`: faixas de `seq` já gravadas e a faixa de ids de vetor correspondente
+
+    Os chunks de um arquivo são gravados de uma vez, antes do embedding, e cada faixa é
+    registrada na mesma transação que insere os vetores (ver `recorder`). Ao retomar, nada
+    é extraído, dividido ou inserido de novo; os lotes já embedados vêm do cache de embeddings.
+    """
+
+    def __init__(self, job_id: int, kind: str, params: Dict[str, Any]):
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self._next_seq = database.db.execute(
+            "SELECT COALESCE(MAX(seq), -1) + 1 FROM job_chunks WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+
+    @staticmethod
+    def create_tables() -> None:
+        db = database.db
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_files(
+                job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                path TEXT NOT NULL,
+                content_hash TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, path)
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_chunks(
+                job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                path TEXT,
+                content TEXT NOT NULL,
+                source TEXT,
+                fields TEXT,
+                PRIMARY KEY (job_id, seq)
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_batches(
+                job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                first_seq INTEGER NOT NULL,
+                last_seq INTEGER NOT NULL,
+                first_vector_id INTEGER NOT NULL,
+                last_vector_id INTEGER NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (job_id, first_seq)
+            )
+            """
+        )
+        db.commit()
+
+    @classmethod
+    def start(cls, kind: str, params: Dict[str, Any]) -> "JobJournal":
+        """Registra um novo job."""
+        cls.create_tables()
+        now = time.time()
+        cursor = database.db.execute(
+            "INSERT INTO jobs (kind, params, status, created_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+            (kind, json.dumps(params), now, now)
+        )
+        database.db.commit()
+        logger.info(f"{Emojis.INFO.value} Job {cursor.lastrowid} ({kind}) iniciado.")
+        return cls(cursor.lastrowid, kind, params)
+
+    @classmethod
+    def find_unfinished(cls, job_id: Optional[int] = None) -> Optional["JobJournal"]:
+        """O job não concluído mais recente (ou o job `job_id`, se ainda não concluído)."""
+        cls.create_tables()
+        query = "SELECT id, kind, params FROM jobs WHERE status = 'running'"
+        args: tuple = ()
+        if job_id is not None:
+            query += " AND id = ?"
+            args = (job_id,)
+        row = database.db.execute(query + " ORDER BY id DESC LIMIT 1", args).fetchone()
+        return cls(row[0], row[1], json.loads(row[2])) if row else None
+
+    def files(self) -> Dict[str, Tuple[Optional[str], bool]]:
+        """{path: (content_hash, concluído)} dos arquivos já planejados."""
+        return {
+            path: (content_hash, bool(done))
+            for path, content_hash, done in database.db.execute(
+                "SELECT path, content_hash, done FROM job_files WHERE job_id = ?", (self.job_id,)
+            )
+        }
+
+    def plan(self, chunks: Iterable[PlannedChunk], path: Optional[str] = None,
+             content_hash: Optional[str] = None) -> List[int]:
+        """
+        Grava os chunks (e o arquivo de origem) numa única transação e retorna os `seq` atribuídos.
+
+        `chunks` pode ser um gerador: é consumido em streaming pelo executemany.
+        """
+        seqs: List[int] = []
+
+        def rows():
+            for text, source, fields in chunks:
+                seq = self._next_seq + len(seqs)
+                seqs.append(seq)
+                yield self.job_id, seq, path, text, source, json.dumps(fields) if fields else None
+
+        db = database.db
+        try:
+            db.executemany(
+                "INSERT INTO job_chunks (job_id, seq, path, content, source, fields) VALUES (?, ?, ?, ?, ?, ?)", rows()
+            )
+            if path is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO job_files (job_id, path, content_hash, done) VALUES (?, ?, ?, 0)",
+                    (self.job_id, path, content_hash)
+                )
+            self._touch()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self._next_seq += len(seqs)
+        return seqs
+
+    def iter_pending(self, path: Optional[str] = None, page_size: int = 1_000) -> Iterator[Tuple[int, str, str, Optional[dict]]]:
+        """(seq, texto, fonte, campos) dos chunks planejados ainda não gravados, em ordem de `seq`."""
+        query = """
+            SELECT seq, content, source, fields FROM job_chunks c
+            WHERE job_id = ? AND seq > ? {path_filter}
+              AND NOT EXISTS (
+                  SELECT 1 FROM job_batches b
+                  WHERE b.job_id = c.job_id AND c.seq BETWEEN b.first_seq AND b.last_seq
+              )
+            ORDER BY seq LIMIT ?
+        """.format(path_filter="AND path = ?" if path is not None else "")
+        last = -1
+        while True:
+            args = (self.job_id, last, path, page_size) if path is not None else (self.job_id, last, page_size)
+            page = database.db.execute(query, args).fetchall()
+            for seq, text, source, fields in page:
+                yield seq, text, source, json.loads(fields) if fields else None
+            if len(page) < page_size:
+                return
+            last = page[-1][0]
+
+    def recorder(self, seqs: List[int]) -> Callable:
+        """Callback `on_batch` do bulk_insert_vectors que registra as faixas gravadas de `seqs`."""
+        def record(cursor, offset: int, vector_ids: List[int]) -> None:
+            now = time.time()
+            ranges = []
+            for seq, vector_id in zip(seqs[offset:offset + len(vector_ids)], vector_ids):
+                # Faixas contíguas de seq e de id viram uma linha só
+                if ranges and seq == ranges[-1][2] + 1 and vector_id == ranges[-1][4] + 1:
+                    ranges[-1][2], ranges[-1][4] = seq, vector_id
+                else:
+                    ranges.append([self.job_id, seq, seq, vector_id, vector_id, now])
+            cursor.executemany(
+                "INSERT INTO job_batches (job_id, first_seq, last_seq, first_vector_id, last_vector_id, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", ranges
+            )
+        return record
+
+    def complete_file(self, path: str) -> None:
+        database.db.execute("UPDATE job_files SET done = 1 WHERE job_id = ? AND path = ?", (self.job_id, path))
+        self._touch()
+        database.db.commit()
+
+    def progress(self) -> Tuple[int, int]:
+        """(chunks planejados, chunks gravados)."""
+        db = database.db
+        stored = db.execute(
+            "SELECT COALESCE(SUM(last_seq - first_seq + 1), 0) FROM job_batches WHERE job_id = ?", (self.job_id,)
+        ).fetchone()[0]
+        return self._next_seq, stored
+
+    def finish(self) -> None:
+        """Marca o job como concluído e descarta o texto dos chunks (as faixas gravadas ficam como histórico)."""
+        db = database.db
+        db.execute("DELETE FROM job_chunks WHERE job_id = ?", (self.job_id,))
+        db.execute("UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ?", (time.time(), self.job_id))
+        db.commit()
+        logger.info(f"{Emojis.SUCCESS.value} Job {self.job_id} concluído.")
+
+    def log_interrupted(self) -> None:
+        planned, stored = self.progress()
+        logger.warning(
+            f"{Emojis.WARNING.value} Job {self.job_id} interrompido com {stored}/{planned} chunks gravados. "
+            f"Continue de onde parou com --resume."
+        )
+
+    def _touch(self) -> None:
+        database.db.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), self.job_id))
+
+
+def resume_job(job_id: Optional[int] = None, workers: Optional[int] = None) -> Optional[int]:
+    """Retoma o job não concluído mais recente (ou `job_id`). Retorna o número de chunks gravados."""
+    job = JobJournal.find_unfinished(job_id)
+    if job is None:
+        logger.info(f"{Emojis.INFO.value} Nenhum job pendente para retomar.")
+        return None
+    planned, stored = job.progress()
+    logger.info(f"{Emojis.PROCESSING.value} Retomando job {job.job_id} ({job.kind}): {stored}/{planned} chunks já gravados.")
+    if job.kind == "ingest":
+        from modules.ingest import ingest
+        return ingest(job.params["target"], workers=workers, incremental=job.params["incremental"],
+                      collection=job.params["collection"], job=job)
+    if job.kind == "file":
+        from modules.google_ai_commands import process_embeddings
+        process_embeddings("db", job.params["path"], job=job)
+        return job.progress()[1]
+    raise ValueError(f"Tipo de job desconhecido: {job.kind}")
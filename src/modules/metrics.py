@@ -1,6 +1,9 @@
+import math
+import threading
 import time
+from contextlib import contextmanager
 from functools import wraps
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 import logging
 import json
 from modules.files import get_metrics_file_path
@@ -8,46 +11,281 @@ from modules.utils import Emojis
 
 logger = logging.getLogger(__name__)
 
+COUNTERS = (
+    'embeddings_generated',
+    'files_processed',
+    'api_calls',
+    'cache_hits',
+    'cache_misses',
+    'answer_cache_hits',
+    'answer_cache_misses',
+    # Chunks que reaproveitaram o vetor de uma cópia (quase) idêntica, sem embedding
+    'duplicate_chunks',
+    # Perguntas respondidas pelo atalho lexical, sem embedding da consulta
+    'lexical_fast_path',
+    'errors',
+)
+
+# Latências (em segundos) guardadas em histogramas
+HISTOGRAMS = (
+    'processing_time',
+    # Etapas da ingestão e da busca
+    'extract_time',
+    'chunk_time',
+    'embed_time',
+    'insert_time',
+    'search_time',
+    'lexical_time',
+    # Tempos por pergunta do RAG (ver QuestionTimer)
+    'embedding_time',
+    'retrieval_time',
+    'time_to_first_token',
+    'generation_time',
+    'question_time',
+)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Histograma de latências com buckets logarítmicos e memória fixa.
+
+    Cada oitava entre `min_value` e `max_value` é dividida em `buckets_per_octave`
+    buckets (16 -> erro relativo de ~2% nos percentis). Valores fora do intervalo
+    caem no primeiro ou no último bucket; min, max, soma e contagem são exatos.
+    """
+
+    def __init__(self, min_value: float = 1e-6, max_value: float = 3600.0, buckets_per_octave: int = 16):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.buckets_per_octave = buckets_per_octave
+        self.counts = [0] * (math.ceil(math.log2(max_value / min_value) * buckets_per_octave) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return min(len(self.counts) - 1, int(math.log2(value / self.min_value) * self.buckets_per_octave) + 1)
+
+    def _bucket_value(self, index: int) -> float:
+        # Média geométrica das bordas do bucket
+        if index == 0:
+            return self.min_value
+        return self.min_value * 2 ** ((index - 0.5) / self.buckets_per_octave)
+
+    def record(self, value: float) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Histogramas com buckets diferentes")
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def summary(self) -> Dict[str, Any]:
+        stats = {'count': self.count, 'mean': self.mean}
+        for q in PERCENTILES:
+            stats[f'p{q * 100:g}'] = self.percentile(q)
+        stats['max'] = self.max if self.count else None
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Formato compacto para o arquivo de métricas: só os buckets não vazios."""
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'buckets': {str(index): count for index, count in enumerate(self.counts) if count},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls()
+        for index, count in data.get('buckets', {}).items():
+            histogram.counts[int(index)] += count
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('sum', 0.0)
+        if histogram.count:
+            histogram.min = data['min']
+            histogram.max = data['max']
+        return histogram
+
+
 class MetricsCollector:
     def __init__(self):
-        self.metrics = {
-            'embeddings_generated': 0,
-            'files_processed': 0,
-            'api_calls': 0,
-            'errors': 0,
-            'processing_time': []
-        }
-    
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.metrics = {name: 0 for name in COUNTERS}
+        self.histograms = {name: LatencyHistogram() for name in HISTOGRAMS}
+
     def increment(self, metric: str, value: int = 1):
-        if metric in self.metrics:
-            if isinstance(self.metrics[metric], list):
-                self.metrics[metric].append(value)
-            else:
+        if metric in self.histograms:
+            self.observe(metric, value)
+            return
+        with self._lock:
+            if metric in self.metrics:
                 self.metrics[metric] += value
-    
+
+    def observe(self, metric: str, seconds: float):
+        """Registra uma latência (em segundos) no histograma da etapa."""
+        with self._lock:
+            if metric in self.histograms:
+                self.histograms[metric].record(seconds)
+
+    @contextmanager
+    def time(self, metric: str):
+        """Cronometra o bloco e registra a duração no histograma `metric`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, time.perf_counter() - start)
+
+    def _report(self) -> Dict[str, Any]:
+        return {
+            'counters': dict(self.metrics),
+            'histograms': {name: h.to_dict() for name, h in self.histograms.items() if h.count},
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Contadores e histogramas (só os com amostras) no formato do arquivo de métricas."""
+        with self._lock:
+            return self._report()
+
+    def drain(self) -> Dict[str, Any]:
+        """Retorna o snapshot e zera o coletor: cada registro salvo traz só o que mudou desde o anterior."""
+        with self._lock:
+            report = self._report()
+            self._clear()
+        return report
+
     def get_stats(self) -> Dict[str, Any]:
-        stats = self.metrics.copy()
-        if stats['processing_time']:
-            stats['avg_processing_time'] = sum(stats['processing_time']) / len(stats['processing_time'])
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.metrics)
+            for name, histogram in self.histograms.items():
+                if histogram.count:
+                    stats[name] = histogram.summary()
         return stats
-    
-    def get_stats_from_file(self, filename: str) -> Dict[str, Any]:
-        """Load metrics from a JSON file"""
+
+    def to_prometheus(self) -> str:
+        """Métricas atuais no formato de exposição texto do Prometheus."""
+        snapshot = self.snapshot()
+        return format_prometheus(snapshot['counters'], {
+            name: LatencyHistogram.from_dict(data) for name, data in snapshot['histograms'].items()
+        })
+
+    def get_stats_from_file(self, filename: str) -> List[Dict[str, Any]]:
+        """Load the metric records (one per run) from the JSONL history file"""
+        return list(MetricsStore(filename).read())
+
+metrics = MetricsCollector()
+
+
+class MetricsStore:
+    """
+    Série temporal de métricas em JSON Lines: cada execução acrescenta uma linha.
+
+    Gravar é um único append (o histórico nunca é reescrito). Na leitura, linhas
+    truncadas por uma execução interrompida são ignoradas.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def read(self) -> Iterator[Dict[str, Any]]:
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-            return data
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"{Emojis.WARNING.value} Linha inválida ignorada em {self.path}.")
+                        continue
+                    if isinstance(record, dict) and 'counters' in record:
+                        yield record
         except FileNotFoundError:
-            logger.error(f"{Emojis.ERROR.value} Metrics file {filename} not found.")
-            return {}
+            logger.error(f"{Emojis.ERROR.value} Metrics file {self.path} not found.")
+
+
+def merge_records(records: Iterable[Dict[str, Any]]):
+    """Soma os contadores e combina os histogramas de vários registros."""
+    counters: Dict[str, int] = {}
+    histograms: Dict[str, LatencyHistogram] = {}
+    for record in records:
+        for name, value in record.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, data in record.get('histograms', {}).items():
+            histogram = LatencyHistogram.from_dict(data)
+            if name in histograms:
+                histograms[name].merge(histogram)
+            else:
+                histograms[name] = histogram
+    return counters, histograms
+
+
+def format_prometheus(counters: Dict[str, int], histograms: Dict[str, LatencyHistogram], prefix: str = 'rag') -> str:
+    """Contadores como `counter` e latências como `summary` (p50/p95/p99, soma e contagem)."""
+    lines = []
+    for name, value in counters.items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    if histograms:
+        metric = f"{prefix}_stage_seconds"
+        lines.append(f"# HELP {metric} Latência por etapa do pipeline.")
+        lines.append(f"# TYPE {metric} summary")
+        for name, histogram in histograms.items():
+            stage = name[:-len('_time')] if name.endswith('_time') else name
+            for q in PERCENTILES:
+                lines.append(f'{metric}{{stage="{stage}",quantile="{q:g}"}} {histogram.percentile(q):.6g}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.total:.6g}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
 
-metrics = MetricsCollector()
 
 def track_time(metric_name: str = 'processing_time'):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = time.perf_counter()
             try:
                 result = func(*args, **kwargs)
                 return result
@@ -55,54 +293,153 @@ def track_time(metric_name: str = 'processing_time'):
                 metrics.increment('errors')
                 raise
             finally:
-                duration = time.time() - start_time
-                metrics.increment(metric_name, duration)
+                duration = time.perf_counter() - start_time
+                metrics.observe(metric_name, duration)
         return wrapper
     return decorator
 
+class TimedIterator:
+    """Iterador que acumula em `seconds` o tempo gasto produzindo cada item (ex.: extração de páginas)."""
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+class QuestionTimer:
+    """
+    Cronometra as etapas de uma pergunta do RAG: embedding, busca, primeiro token e geração.
+
+    `timings` guarda os segundos de cada etapa; `record()` envia tudo para o MetricsCollector.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self._generation_start = None
+
+    @contextmanager
+    def stage(self, name: str):
+        # Etapas repetidas (ex.: busca lexical e depois vetorial) acumulam
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def start_generation(self) -> None:
+        self._generation_start = time.perf_counter()
+
+    def first_token(self) -> None:
+        # Tempo percebido pelo usuário: desde o início da pergunta
+        if 'time_to_first_token' not in self.timings:
+            self.timings['time_to_first_token'] = time.perf_counter() - self.start
+
+    def finish(self) -> Dict[str, float]:
+        now = time.perf_counter()
+        if self._generation_start is not None:
+            self.timings['generation_time'] = now - self._generation_start
+        self.timings['question_time'] = now - self.start
+        return self.timings
+
+    def record(self) -> None:
+        for name, seconds in self.timings.items():
+            metrics.observe(name, seconds)
+
+    def summary(self) -> str:
+        return " | ".join(f"{name.replace('_', ' ')}: {seconds * 1000:.0f}ms" for name, seconds in self.timings.items())
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.1f}ms"
+
 class MetricsDashboard:
     def __init__(self):
         pass
-    
-    def print_dashboard(self):
+
+    def print_dashboard(self, filename: Optional[str] = None, last_runs: int = 10):
         """Print formatted metrics dashboard"""
-        
+
         print("\n" + "="*60)
         print("📊 EMBEDDINGS DASHBOARD")
         print("="*60)
-        
-        # Basic Statistics
-        print("\n🔢 Basic Statistics:")
-        basic_stats = metrics.get_stats_from_file(get_metrics_file_path())
-        if not basic_stats:
+
+        records = metrics.get_stats_from_file(filename or get_metrics_file_path())
+        if not records:
             print(f"{Emojis.WARNING.value}  No metrics data available.")
             return
+        counters, histograms = merge_records(records)
 
-        for key, value in basic_stats.items():
-            if key == 'processing_time':
-                continue
+        # Basic Statistics
+        print(f"\n🔢 Basic Statistics ({len(records)} execuções):")
+        for key, value in counters.items():
             print(f"   {key.replace('_', ' ').title()}: {value}")
-        
+
         # Timing Information
-        times = basic_stats.get('processing_time', [])
-        if times:
-            print(f"\n⏱️  Timing Information:")
-            print(f"   Total Requests: {len(times)}")
-            print(f"   Fastest Request: {min(times):.2f}s")
-            print(f"   Slowest Request: {max(times):.2f}s")
-            print(f"   Average Time: {sum(times)/len(times):.2f}s")
-        
+        if histograms:
+            print(f"\n⏱️  Latência por etapa:")
+            print(f"   {'Etapa':<22}{'n':>8}{'p50':>11}{'p95':>11}{'p99':>11}{'máx':>11}")
+            for name in HISTOGRAMS:
+                if name not in histograms:
+                    continue
+                h = histograms[name]
+                print(f"   {name:<22}{h.count:>8}{_ms(h.percentile(0.5)):>11}{_ms(h.percentile(0.95)):>11}"
+                      f"{_ms(h.percentile(0.99)):>11}{_ms(h.max):>11}")
+
+        # Trends
+        recent = records[-last_runs:]
+        stages = [name for name in HISTOGRAMS if any(name in record.get('histograms', {}) for record in recent)]
+        if len(recent) > 1:
+            print(f"\n📈 Tendência (últimas {len(recent)} execuções, p95):")
+            for record in recent:
+                p95 = []
+                for name in stages:
+                    data = record.get('histograms', {}).get(name)
+                    if data:
+                        p95.append(f"{name.replace('_time', '')} {_ms(LatencyHistogram.from_dict(data).percentile(0.95))}")
+                counts = record.get('counters', {})
+                print(f"   {record.get('readable_time', '-')}: {counts.get('files_processed', 0)} arquivos, "
+                      f"{counts.get('embeddings_generated', 0)} embeddings | " + (", ".join(p95) or "sem latências"))
+            for name in stages:
+                values = [LatencyHistogram.from_dict(record['histograms'][name]).percentile(0.95)
+                          for record in recent[:-1] if name in record.get('histograms', {})]
+                last = recent[-1].get('histograms', {}).get(name)
+                if values and last:
+                    baseline = sum(values) / len(values)
+                    change = LatencyHistogram.from_dict(last).percentile(0.95) / baseline - 1
+                    print(f"   {name}: p95 da última execução {change:+.0%} vs média das anteriores")
+
         print("="*60)
-    
-    def save_metrics_to_file(self, filename: str = get_metrics_file_path()):
-        """Save metrics to JSON file"""
-        report = metrics.get_stats()
-        
+
+    def print_prometheus(self, filename: Optional[str] = None, output: Optional[str] = None):
+        """Histórico agregado no formato de exposição texto do Prometheus (stdout ou arquivo)."""
+        counters, histograms = merge_records(metrics.get_stats_from_file(filename or get_metrics_file_path()))
+        text = format_prometheus(counters, histograms)
+        if output:
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(text)
+            print(f"📁 Prometheus metrics saved to {output}")
+        else:
+            print(text, end="")
+
+    def save_metrics_to_file(self, filename: Optional[str] = None):
+        """Append the metrics collected since the last save to the JSONL history"""
+        # Resolvido na chamada: o caminho cria o diretório de métricas
+        filename = filename or get_metrics_file_path()
+        report = metrics.drain()
+
         # Add timestamp
         report['timestamp'] = time.time()
         report['readable_time'] = time.strftime('%Y-%m-%d %H:%M:%S')
-        
-        with open(filename, 'w') as f:
-            json.dump(report, f, indent=2)
-        
-        print(f"📁 Metrics saved to {filename}")
\ No newline at end of file
+
+        MetricsStore(filename).append(report)
+
+        print(f"📁 Metrics saved to {filename}")
@@ -0,0 +1,201 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+from config.settings import config
+from modules.metrics import metrics
+from modules.utils import Emojis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Verifica se a exceção representa um erro de cota (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    # google.api_core.exceptions.ResourceExhausted expõe code == HTTPStatus.TOO_MANY_REQUESTS
+    if getattr(error, 'code', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'resource_exhausted' in message or 'resource exhausted' in message
+
+
+class TokenBucket:
+    """Token bucket thread-safe com taxa expressa em tokens por minuto."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate_per_minute <= 0:
+            raise ValueError("A taxa do token bucket deve ser maior que zero")
+        self.rate_per_minute = float(rate_per_minute)
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_minute / 60.0)
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Reserva tokens e retorna quantos segundos é preciso esperar para usá-los."""
+        with self._lock:
+            self._refill()
+            # O saldo pode ficar negativo: quem reserva depois espera o débito ser pago
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens * 60.0 / self.rate_per_minute
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Bloqueia até que os tokens estejam disponíveis. Retorna o tempo esperado."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def set_rate(self, rate_per_minute: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate_per_minute = float(rate_per_minute)
+
+    def drain(self) -> None:
+        """Zera o saldo de tokens (usado após um erro de cota)."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveRateLimiter:
+    """
+    Limita requisições e textos por minuto com dois token buckets.
+
+    A taxa só é reduzida quando a API retorna erro de cota (redução multiplicativa)
+    e volta a subir gradualmente a cada sucesso (aumento aditivo), até o limite configurado.
+    """
+
+    def __init__(self, requests_per_minute: int = config.embedding.requests_per_minute,
+                 texts_per_minute: int = config.embedding.texts_per_minute,
+                 min_rate_fraction: float = 0.1, recovery_step: float = 0.05,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.max_requests_per_minute = requests_per_minute
+        self.max_texts_per_minute = texts_per_minute
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_step = recovery_step
+        self.rate_fraction = 1.0
+        self.requests = TokenBucket(requests_per_minute, clock=clock, sleep=sleep)
+        self.texts = TokenBucket(texts_per_minute, clock=clock, sleep=sleep)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def acquire(self, text_count: int) -> float:
+        """Espera até que uma requisição com `text_count` textos possa ser enviada."""
+        # Um lote maior que a capacidade nunca caberia no bucket de textos
+        text_tokens = min(text_count, self.texts.capacity)
+        wait = max(self.requests.reserve(1), self.texts.reserve(text_tokens))
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def _apply_rate(self) -> None:
+        self.requests.set_rate(self.max_requests_per_minute * self.rate_fraction)
+        self.texts.set_rate(self.max_texts_per_minute * self.rate_fraction)
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.rate_fraction < 1.0:
+                self.rate_fraction = min(1.0, self.rate_fraction + self.recovery_step)
+                self._apply_rate()
+
+    def on_quota_error(self) -> None:
+        with self._lock:
+            self.rate_fraction = max(self.min_rate_fraction, self.rate_fraction / 2)
+            self._apply_rate()
+            self.requests.drain()
+            self.texts.drain()
+        logger.warning(f"{Emojis.WARNING.value} Cota excedida. Taxa reduzida para {self.rate_fraction:.0%} do limite configurado.")
+
+
+_default_limiter: Optional[AdaptiveRateLimiter] = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_default_limiter() -> AdaptiveRateLimiter:
+    """Limiter compartilhado pelo processo: a cota da API é global, não por chamada."""
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = AdaptiveRateLimiter()
+        return _default_limiter
+
+
+def set_default_limiter(limiter: Optional[AdaptiveRateLimiter]) -> Optional[AdaptiveRateLimiter]:
+    """Troca o limiter compartilhado (ex.: sem limite nos benchmarks com embedder falso) e retorna o anterior."""
+    global _default_limiter
+    with _default_limiter_lock:
+        previous, _default_limiter = _default_limiter, limiter
+        return previous
+
+
+class EmbeddingScheduler:
+    """
+    Executa lotes de embeddings em paralelo respeitando o rate limiter.
+
+    `embed_fn` recebe uma lista de textos e devolve um embedding por texto,
+    o que permite trocar a API real por um embedder local (ver modules.fake_backend).
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], Sequence[Any]],
+                 limiter: Optional[AdaptiveRateLimiter] = None,
+                 max_workers: int = config.embedding.max_concurrent_batches,
+                 max_retries: int = config.embedding.max_retries,
+                 backoff_initial_delay: float = config.embedding.backoff_initial_delay,
+                 backoff_max_delay: float = config.embedding.rate_limit_delay,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.embed_fn = embed_fn
+        self.limiter = limiter or get_default_limiter()
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff_initial_delay = backoff_initial_delay
+        self.backoff_max_delay = backoff_max_delay
+        self._sleep = sleep
+
+    def _backoff_delay(self, attempt: int) -> float:
+        delay = min(self.backoff_max_delay, self.backoff_initial_delay * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def embed_batch(self, batch: List[str]) -> List[Any]:
+        """Envia um lote, repetindo com backoff exponencial apenas em erros de cota."""
+        attempt = 0
+        while True:
+            self.limiter.acquire(len(batch))
+            try:
+                with metrics.time('embed_time'):
+                    embeddings = list(self.embed_fn(batch))
+            except Exception as e:
+                if not is_quota_error(e) or attempt >= self.max_retries:
+                    raise
+                self.limiter.on_quota_error()
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"{Emojis.WARNING.value} Tentativa {attempt + 1}/{self.max_retries} falhou por cota. Aguardando {delay:.1f}s.")
+                self._sleep(delay)
+                attempt += 1
+                continue
+            if len(embeddings) != len(batch):
+                raise ValueError("Numero de embeddings retornados difere do numero de textos")
+            self.limiter.on_success()
+            return embeddings
+
+    def run(self, batches: List[List[str]]) -> List[List[Any]]:
+        """Processa os lotes com até `max_workers` em voo e devolve os resultados na ordem de entrada."""
+        if not batches:
+            return []
+        if self.max_workers == 1 or len(batches) == 1:
+            return [self.embed_batch(batch) for batch in batches]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.embed_batch, batches))
@@ -0,0 +1,505 @@
+import json
+import logging
+import math
+import os
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from config.settings import config
+from modules import database
+from modules.files import get_search_index_dir_path
+from modules.metrics import metrics
+from modules.utils import Emojis
+from modules.vectors import VECTOR_DTYPE, as_vector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SearchHit(NamedTuple):
+    vector_id: int
+    content: str
+    description: Optional[str]
+    distance: float
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices dos k menores scores, em ordem crescente (argpartition + sort só dos k)."""
+    if k >= scores.shape[0]:
+        return np.argsort(scores, kind="stable")
+    top = np.argpartition(scores, k - 1)[:k]
+    return top[np.argsort(scores[top], kind="stable")]
+
+
+def _squared_norms(vectors: np.ndarray, block: int = 65_536) -> np.ndarray:
+    norms = np.empty(vectors.shape[0], dtype=VECTOR_DTYPE)
+    for start in range(0, vectors.shape[0], block):
+        part = np.asarray(vectors[start:start + block])
+        norms[start:start + block] = np.einsum("ij,ij->i", part, part)
+    return norms
+
+
+class ExactIndex:
+    """
+    Busca exata por força bruta: um matmul (BLAS) + argpartition.
+
+    Usa distância L2, a mesma do vec0, com ||x - q||² = ||x||² - 2 x·q + ||q||².
+    `vectors` pode ser um memmap: só as normas ficam em memória.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray, norms: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.ids = ids
+        self.norms = norms if norms is not None else _squared_norms(vectors)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def search(self, query, k: int = config.search.top_k) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, distâncias) dos k vizinhos mais próximos."""
+        q = as_vector(query, self.vectors.shape[1])
+        if len(self) == 0:
+            return self.ids[:0], np.empty(0, dtype=VECTOR_DTYPE)
+        scores = self.norms - 2 * (self.vectors @ q)
+        top = _top_k(scores, k)
+        return self.ids[top], np.sqrt(np.maximum(scores[top] + q @ q, 0))
+
+    def search_many(self, queries, k: int = config.search.top_k, block: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca várias consultas com um matmul por bloco de `block` consultas.
+
+        Retorna (ids, distâncias) com shape (consultas, min(k, len(self))).
+        """
+        q = _as_matrix(queries, self.vectors.shape[1])
+        k = min(k, len(self))
+        ids = np.empty((q.shape[0], k), dtype=self.ids.dtype)
+        distances = np.empty((q.shape[0], k), dtype=VECTOR_DTYPE)
+        if k == 0:
+            return ids, distances
+        query_norms = np.einsum("ij,ij->i", q, q)
+        for start in range(0, q.shape[0], block):
+            part = q[start:start + block]
+            scores = self.norms[None, :] - 2 * (part @ self.vectors.T)
+            top = _top_k_rows(scores, k)
+            ids[start:start + block] = self.ids[top]
+            best = np.take_along_axis(scores, top, axis=1)
+            distances[start:start + block] = np.sqrt(np.maximum(best + query_norms[start:start + block, None], 0))
+        return ids, distances
+
+
+def _as_matrix(queries, dimension: int) -> np.ndarray:
+    """Empilha as consultas numa matriz float32 (consultas x dimensão)."""
+    if isinstance(queries, np.ndarray) and queries.ndim == 2:
+        matrix = np.ascontiguousarray(queries, dtype=VECTOR_DTYPE)
+        if matrix.shape[1] != dimension:
+            raise ValueError(f"Embedding com {matrix.shape[1]} dimensões; esperado {dimension}")
+        return matrix
+    return np.stack([as_vector(query, dimension) for query in queries]) if len(queries) else np.empty((0, dimension), dtype=VECTOR_DTYPE)
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """_top_k aplicado a cada linha de uma matriz de scores."""
+    if k < scores.shape[1]:
+        top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def kmeans(data: np.ndarray, n_clusters: int, iterations: int = config.search.kmeans_iterations,
+           seed: int = 0) -> np.ndarray:
+    """K-means (Lloyd) em NumPy. Retorna os centróides (n_clusters x dim)."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=VECTOR_DTYPE)
+    centroids = data[rng.choice(data.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_clusters(data, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Clusters vazios recebem um ponto aleatório
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            centroids[empty] = data[rng.choice(data.shape[0], empty.size, replace=False)]
+    return centroids
+
+
+def assign_clusters(vectors: np.ndarray, centroids: np.ndarray, block: int = 65_536) -> np.ndarray:
+    """Centróide mais próximo de cada vetor, processando em blocos para limitar memória."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], block):
+        part = np.asarray(vectors[start:start + block], dtype=VECTOR_DTYPE)
+        labels[start:start + block] = np.argmin(centroid_norms - 2 * (part @ centroids.T), axis=1)
+    return labels
+
+
+class IVFIndex:
+    """
+    Índice IVF: vetores agrupados por k-means e armazenados contíguos por lista.
+
+    A busca compara a consulta com os centróides e faz busca exata apenas nas
+    `nprobe` listas mais próximas. `nprobe` maior aumenta recall e latência.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, vectors: np.ndarray,
+                 ids: np.ndarray, norms: Optional[np.ndarray] = None, nprobe: int = config.search.nprobe):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self.norms = norms if norms is not None else _squared_norms(vectors)
+        self.nprobe = nprobe
+        self._centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def default_lists(count: int) -> int:
+        return max(1, min(count, int(4 * math.sqrt(count))))
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, n_lists: Optional[int] = config.search.ivf_lists,
+              sample_size: int = config.search.kmeans_sample_size, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Treina os centróides numa amostra e retorna (centróides, lista de cada vetor)."""
+        n_lists = n_lists or cls.default_lists(vectors.shape[0])
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(vectors.shape[0], min(sample_size, vectors.shape[0]), replace=False))
+        centroids = kmeans(np.asarray(vectors[sample_rows]), min(n_lists, sample_rows.size), seed=seed)
+        return centroids, assign_clusters(vectors, centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ids: np.ndarray, n_lists: Optional[int] = config.search.ivf_lists,
+              nprobe: int = config.search.nprobe, seed: int = 0) -> "IVFIndex":
+        """Constrói o índice em memória (reordena uma cópia dos vetores por lista)."""
+        centroids, labels = cls.train(vectors, n_lists, seed=seed)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=centroids.shape[0]))])
+        return cls(centroids, offsets, np.ascontiguousarray(vectors[order]), ids[order], nprobe=nprobe)
+
+    def search(self, query, k: int = config.search.top_k, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        q = as_vector(query, self.vectors.shape[1])
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probes = _top_k(self._centroid_norms - 2 * (self.centroids @ q), nprobe)
+        rows = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes])
+        if rows.size == 0:
+            return self.ids[:0], np.empty(0, dtype=VECTOR_DTYPE)
+        # As listas são fatias contíguas: leitura sequencial no memmap
+        rows.sort()
+        scores = self.norms[rows] - 2 * (self.vectors[rows] @ q)
+        top = _top_k(scores, k)
+        return self.ids[rows[top]], np.sqrt(np.maximum(scores[top] + q @ q, 0))
+
+    def search_many(self, queries, k: int = config.search.top_k, nprobe: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Busca várias consultas; os centróides de todas são comparados num único matmul."""
+        q = _as_matrix(queries, self.vectors.shape[1])
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probes = _top_k_rows(self._centroid_norms[None, :] - 2 * (q @ self.centroids.T), nprobe)
+        results = []
+        for query, query_probes in zip(q, probes):
+            rows = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in query_probes])
+            if rows.size == 0:
+                results.append((self.ids[:0], np.empty(0, dtype=VECTOR_DTYPE)))
+                continue
+            rows.sort()
+            scores = self.norms[rows] - 2 * (self.vectors[rows] @ query)
+            top = _top_k(scores, k)
+            results.append((self.ids[rows[top]], np.sqrt(np.maximum(scores[top] + query @ query, 0))))
+        return results
+
+
+def _has_filters(filters: dict) -> bool:
+    return any(value is not None for value in filters.values())
+
+
+class SqliteVecBackend:
+    """
+    Busca direto na tabela virtual vec0.
+
+    Os filtros (`collection`, `source`, `document_id`, `section`) são aplicados pelo vec0
+    durante o KNN: a coleção restringe a varredura a uma partição.
+    """
+
+    def search(self, embedding, k: int = config.search.top_k, **filters) -> List[SearchHit]:
+        return [SearchHit(*row) for row in database.search_vectors(embedding, k, **filters)]
+
+    def search_many(self, embeddings, k: int = config.search.top_k, **filters) -> List[List[SearchHit]]:
+        return [[SearchHit(*row) for row in rows] for rows in database.search_vectors_many(embeddings, k, **filters)]
+
+
+class NumpyBackend:
+    """
+    Busca em processo sobre um snapshot dos vetores do banco.
+
+    O snapshot (vectors.npy, ids.npy, norms.npy e, para IVF, centroids.npy/offsets.npy)
+    fica em `index_dir` e é aberto como memmap. É reconstruído automaticamente quando
+    a quantidade ou o maior id de vetor no banco mudam.
+    """
+
+    def __init__(self, index_dir: Optional[str] = None, use_ivf: bool = False,
+                 n_lists: Optional[int] = config.search.ivf_lists, nprobe: int = config.search.nprobe):
+        self.index_dir = index_dir or get_search_index_dir_path()
+        self.use_ivf = use_ivf
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.index = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._path("manifest.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _is_fresh(self, manifest: dict) -> bool:
+        count, max_id = database.get_index_version()
+        return (
+            manifest.get("count") == count
+            and manifest.get("max_id") == max_id
+            and manifest.get("dimension") == config.database.embedding_dimension
+            and manifest.get("ivf") == self.use_ivf
+        )
+
+    def build(self) -> None:
+        """Exporta os vetores do banco para o snapshot (e treina o IVF, se habilitado)."""
+        start = time.time()
+        os.makedirs(self.index_dir, exist_ok=True)
+        count, max_id = database.get_index_version()
+        dimension = config.database.embedding_dimension
+        vectors = np.lib.format.open_memmap(self._path("vectors.npy"), mode="w+", dtype=VECTOR_DTYPE, shape=(count, dimension))
+        ids = np.empty(count, dtype=np.int64)
+        for row, (vector_id, embedding) in enumerate(database.iter_embeddings()):
+            vectors[row] = as_vector(embedding)
+            ids[row] = vector_id
+
+        manifest = {"count": count, "max_id": max_id, "dimension": dimension, "ivf": self.use_ivf}
+        if self.use_ivf and count:
+            centroids, labels = IVFIndex.train(vectors, self.n_lists)
+            order = np.argsort(labels, kind="stable")
+            # Reescreve os vetores agrupados por lista, em blocos
+            ordered = np.lib.format.open_memmap(self._path("vectors.ivf.npy"), mode="w+", dtype=VECTOR_DTYPE, shape=(count, dimension))
+            for block in range(0, count, 65_536):
+                ordered[block:block + 65_536] = vectors[order[block:block + 65_536]]
+            ordered.flush()
+            del vectors, ordered
+            os.replace(self._path("vectors.ivf.npy"), self._path("vectors.npy"))
+            ids = ids[order]
+            np.save(self._path("centroids.npy"), centroids)
+            np.save(self._path("offsets.npy"), np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=centroids.shape[0]))]))
+            manifest["lists"] = int(centroids.shape[0])
+        else:
+            vectors.flush()
+            del vectors
+        np.save(self._path("ids.npy"), ids)
+        np.save(self._path("norms.npy"), _squared_norms(np.load(self._path("vectors.npy"), mmap_mode="r")))
+        with open(self._path("manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        logger.info(f"{Emojis.SUCCESS.value} Índice de busca construído: {count} vetores em {time.time() - start:.2f}s.")
+
+    def load(self) -> None:
+        if not self._is_fresh(self._read_manifest()):
+            logger.info(f"{Emojis.PROCESSING.value} Índice de busca ausente ou desatualizado. Reconstruindo...")
+            self.build()
+        vectors = np.load(self._path("vectors.npy"), mmap_mode="r")
+        ids = np.load(self._path("ids.npy"))
+        norms = np.load(self._path("norms.npy"))
+        if self.use_ivf and len(ids):
+            self.index = IVFIndex(np.load(self._path("centroids.npy")), np.load(self._path("offsets.npy")),
+                                  vectors, ids, norms, nprobe=self.nprobe)
+        else:
+            self.index = ExactIndex(vectors, ids, norms)
+
+    def search(self, embedding, k: int = config.search.top_k, **filters) -> List[SearchHit]:
+        if _has_filters(filters):
+            # O snapshot não guarda coleção/fonte: buscas filtradas usam as partições do vec0
+            return SqliteVecBackend().search(embedding, k, **filters)
+        if self.index is None:
+            self.load()
+        ids, distances = self.index.search(embedding, k)
+        return self._hits([(ids, distances)])[0]
+
+    def search_many(self, embeddings, k: int = config.search.top_k, **filters) -> List[List[SearchHit]]:
+        """Busca várias consultas de uma vez (um matmul por bloco na busca exata)."""
+        if _has_filters(filters):
+            return SqliteVecBackend().search_many(embeddings, k, **filters)
+        if self.index is None:
+            self.load()
+        results = self.index.search_many(embeddings, k)
+        if isinstance(results, tuple):
+            results = list(zip(*results))
+        return self._hits(results)
+
+    @staticmethod
+    def _hits(results: List[Tuple[np.ndarray, np.ndarray]]) -> List[List[SearchHit]]:
+        # Conteúdo de todos os resultados lido de uma vez
+        chunks = database.get_chunks(list({int(vector_id) for ids, _ in results for vector_id in ids}))
+        return [
+            [
+                SearchHit(int(vector_id), *chunks[int(vector_id)], float(distance))
+                for vector_id, distance in zip(ids, distances)
+                if int(vector_id) in chunks
+            ]
+            for ids, distances in results
+        ]
+
+
+_backend = None
+
+
+def get_search_backend(name: str = config.search.backend):
+    """Retorna (e reaproveita) o backend de busca configurado."""
+    global _backend
+    if _backend is None:
+        if name == "sqlite":
+            _backend = SqliteVecBackend()
+        elif name in ("numpy", "ivf"):
+            _backend = NumpyBackend(use_ivf=name == "ivf")
+        else:
+            raise ValueError(f"Backend de busca desconhecido: {name}")
+    return _backend
+
+
+class Retrieval(NamedTuple):
+    hits: List[SearchHit]
+    # None quando o atalho lexical dispensou o embedding da consulta
+    embedding: Any
+    lexical_only: bool
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[SearchHit]], k: int, rrf_k: int = config.search.rrf_k) -> List[SearchHit]:
+    """
+    Funde listas ordenadas (ex.: BM25 e vetorial) por reciprocal rank fusion.
+
+    Cada chunk soma 1 / (rrf_k + posição) em cada lista em que aparece: só a posição
+    conta, então scores de escalas diferentes não precisam ser normalizados. No
+    resultado, `distance` é o score de fusão negado (menor continua sendo melhor).
+    """
+    scores: Dict[int, float] = {}
+    hits: Dict[int, SearchHit] = {}
+    for ranking in rankings:
+        for position, hit in enumerate(ranking, 1):
+            scores[hit.vector_id] = scores.get(hit.vector_id, 0.0) + 1.0 / (rrf_k + position)
+            hits.setdefault(hit.vector_id, hit)
+    best = sorted(scores, key=lambda vector_id: -scores[vector_id])[:k]
+    return [hits[vector_id]._replace(distance=-scores[vector_id]) for vector_id in best]
+
+
+def _no_stage(name: str):
+    return nullcontext()
+
+
+class HybridRetriever:
+    """
+    Recuperação dos chunks de uma pergunta: vetorial ou híbrida (BM25 + vetorial).
+
+    No modo "hybrid" a busca lexical (FTS5) roda primeiro. Se o BM25 for confiante
+    (ver `is_confident`), seus resultados são usados direto e a consulta nem é embedada:
+    buscas por identificadores e códigos de erro não esperam a API de embeddings.
+    Senão, as duas listas são fundidas por reciprocal rank fusion. `connection` envolve
+    o acesso ao banco (ex.: ConnectionPool.connection), sem prendê-lo durante o embedding.
+    """
+
+    def __init__(self, backend=None, mode: str = config.search.retrieval,
+                 connection: Callable[[], Any] = nullcontext,
+                 fast_path: bool = config.search.lexical_fast_path,
+                 min_score: float = config.search.lexical_min_score,
+                 margin: float = config.search.lexical_margin,
+                 oversample: int = config.search.hybrid_oversample,
+                 rrf_k: int = config.search.rrf_k):
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"Modo de recuperação desconhecido: {mode}")
+        self.backend = backend
+        self.mode = mode
+        self.connection = connection
+        self.fast_path = fast_path
+        self.min_score = min_score
+        self.margin = margin
+        self.oversample = max(1, oversample)
+        self.rrf_k = rrf_k
+
+    def _backend(self):
+        return self.backend or get_search_backend()
+
+    def _candidates(self, k: int) -> int:
+        return k * self.oversample if self.mode == "hybrid" else k
+
+    def lexical(self, query: str, k: int, **filters) -> List[SearchHit]:
+        """Resultados do BM25, com `distance` = -score."""
+        return [
+            SearchHit(vector_id, content, description, -score)
+            for vector_id, content, description, score in database.search_lexical(query, k, **filters)
+        ]
+
+    def is_confident(self, hits: List[SearchHit]) -> bool:
+        """O melhor resultado lexical tem score mínimo e se destaca do segundo por `margin` vezes."""
+        if not self.fast_path or not hits:
+            return False
+        best = -hits[0].distance
+        if best < self.min_score:
+            return False
+        return len(hits) == 1 or best >= self.margin * -hits[1].distance
+
+    def _fuse(self, vector: List[SearchHit], lexical: List[SearchHit], k: int) -> List[SearchHit]:
+        # Sem nenhum termo encontrado, as distâncias vetoriais são mantidas
+        return reciprocal_rank_fusion([vector, lexical], k, self.rrf_k) if lexical else vector[:k]
+
+    def retrieve(self, query: str, embed: Callable[[str], Any], k: int = config.search.top_k,
+                 timer=None, **filters) -> Optional[Retrieval]:
+        """
+        Recupera os k chunks de uma pergunta. `embed(query)` só é chamado se a busca
+        vetorial for necessária; retorna None se ele falhar. `timer` (QuestionTimer)
+        recebe embedding_time e, sem contar o embedding, search_time e retrieval_time.
+        """
+        stage = timer.stage if timer is not None else _no_stage
+        lexical: List[SearchHit] = []
+        if self.mode == "hybrid":
+            with stage("retrieval_time"), stage("search_time"), stage("lexical_time"), self.connection():
+                lexical = self.lexical(query, self._candidates(k), **filters)
+            if self.is_confident(lexical):
+                metrics.increment("lexical_fast_path")
+                return Retrieval(lexical[:k], None, True)
+
+        with stage("embedding_time"):
+            embedding = embed(query)
+        if embedding is None:
+            return None
+        with stage("retrieval_time"), stage("search_time"), self.connection():
+            vector = self._backend().search(embedding, self._candidates(k), **filters)
+        return Retrieval(self._fuse(vector, lexical, k), embedding, False)
+
+    def retrieve_many(self, queries: List[str], embed_many: Callable[[List[str]], Optional[Sequence[Any]]],
+                      k: int = config.search.top_k, **filters) -> Optional[List[Retrieval]]:
+        """
+        Versão em lote: só as consultas sem atalho lexical são embedadas, numa chamada
+        `embed_many`, e buscadas juntas no backend. Retorna None se o embedding falhar.
+        """
+        lexical: List[List[SearchHit]] = [[] for _ in queries]
+        if self.mode == "hybrid":
+            with metrics.time("lexical_time"), self.connection():
+                lexical = [self.lexical(query, self._candidates(k), **filters) for query in queries]
+
+        results: List[Optional[Retrieval]] = [None] * len(queries)
+        pending = []
+        for index, hits in enumerate(lexical):
+            if self.is_confident(hits):
+                metrics.increment("lexical_fast_path")
+                results[index] = Retrieval(hits[:k], None, True)
+            else:
+                pending.append(index)
+        if pending:
+            embeddings = embed_many([queries[index] for index in pending])
+            if embeddings is None:
+                return None
+            with metrics.time("search_time"), self.connection():
+                found = self._backend().search_many(embeddings, self._candidates(k), **filters)
+            for index, embedding, vector in zip(pending, embeddings, found):
+                results[index] = Retrieval(self._fuse(vector, lexical[index], k), embedding, False)
+        return results
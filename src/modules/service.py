@@ -0,0 +1,408 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+from config.settings import config
+from modules import database
+from modules.answer_cache import AnswerCache, chunk_fingerprint
+from modules.context import build_context, build_rag_prompt
+from modules.metrics import MetricsDashboard, QuestionTimer, metrics
+from modules.search import HybridRetriever, SearchHit, get_search_backend
+from modules.utils import Emojis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+_FILTERS = ("collection", "source", "document_id", "section")
+# Limite do vec0 para k
+_MAX_K = 4096
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def _hit_json(hit: SearchHit) -> dict:
+    return {"vector_id": hit.vector_id, "content": hit.content, "source": hit.description, "distance": hit.distance}
+
+
+def _search_params(payload: dict) -> Tuple[int, dict]:
+    try:
+        k = int(payload["k"] if payload.get("k") is not None else config.search.top_k)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "k deve ser um inteiro")
+    if not 1 <= k <= _MAX_K:
+        raise HTTPError(400, f"k deve estar entre 1 e {_MAX_K}")
+    return k, {name: payload[name] for name in _FILTERS if payload.get(name) is not None}
+
+
+class TextResponse:
+    """Resposta em texto puro (ex.: métricas no formato do Prometheus)."""
+
+    def __init__(self, text: str, content_type: str = "text/plain; version=0.0.4; charset=utf-8"):
+        self.text = text
+        self.content_type = content_type
+
+
+class StreamingResponse:
+    """Resposta enviada em NDJSON com Transfer-Encoding: chunked; `events` é um gerador assíncrono de dicts."""
+
+    def __init__(self, events: AsyncIterator[dict]):
+        self.events = events
+
+
+class RagService:
+    """
+    Serviço HTTP (asyncio, só biblioteca padrão) com os endpoints de busca e RAG.
+
+    - GET /health: estado e contadores
+    - GET /metrics: contadores e latências por etapa no formato texto do Prometheus
+    - POST /search: {"query": "..."} ou {"queries": [...]}, com "k", "collection", "source",
+      "section" (caminho de títulos; inclui as subseções) opcionais
+    - POST /ask: {"question": "..."} com os mesmos parâmetros; devolve a resposta, as fontes
+      e os tempos por etapa. Com "stream": true, a resposta vem em NDJSON (chunked):
+      uma linha {"token": ...} por trecho gerado e uma linha final {"done": true, ...}
+
+    Embedding, busca e geração são bloqueantes e rodam em um pool de threads; as buscas
+    (híbridas por padrão, ver HybridRetriever) usam conexões somente leitura de um
+    database.ConnectionPool. No máximo
+    `max_concurrency` requisições executam ao mesmo tempo e até `max_pending` esperam;
+    além disso o serviço responde 503 com Retry-After (backpressure).
+    """
+
+    def __init__(self, embed_queries: Callable[[List[str]], Sequence[Any]], stream_answer: Callable[[str], Iterable[str]],
+                 pool: database.ConnectionPool, answer_cache: Optional[AnswerCache] = None,
+                 max_concurrency: int = config.service.max_concurrency,
+                 max_pending: int = config.service.max_pending,
+                 request_timeout: float = config.service.request_timeout,
+                 max_body_bytes: int = config.service.max_body_bytes):
+        self.embed_queries = embed_queries
+        self.stream_answer = stream_answer
+        self.pool = pool
+        self.answer_cache = answer_cache
+        # Conexão do pool só durante as buscas, não durante o embedding da consulta
+        self.retriever = HybridRetriever(connection=pool.connection)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.max_body_bytes = max_body_bytes
+        self.stats = {"requests": 0, "rejected": 0, "timeouts": 0, "errors": 0, "in_flight": 0, "pending": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="rag-service")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._routes = {
+            "/health": ("GET", self.health),
+            "/metrics": ("GET", self.prometheus_metrics),
+            "/search": ("POST", self.search),
+            "/ask": ("POST", self.ask),
+        }
+
+    # Trabalho bloqueante, executado nas threads do pool
+
+    def _retrieve(self, queries: List[str], k: int, filters: dict):
+        results = self.retriever.retrieve_many(queries, self.embed_queries, k, **filters)
+        if results is None:
+            raise RuntimeError("Falha ao gerar embeddings das consultas")
+        return [result.embedding for result in results], [result.hits for result in results]
+
+    def _embed_question(self, question: str):
+        embeddings = self.embed_queries([question])
+        return embeddings[0] if embeddings is not None else None
+
+    def _answer(self, question: str, k: int, filters: dict, emit: Optional[Callable[[str], None]] = None) -> dict:
+        """Pipeline do RAG; `emit` recebe cada trecho da resposta assim que é gerado."""
+        timer = QuestionTimer()
+        retrieval = self.retriever.retrieve(question, self._embed_question, k, timer, **filters)
+        if retrieval is None:
+            raise RuntimeError("Falha ao gerar embedding da pergunta")
+        hits, embedding = retrieval.hits, retrieval.embedding
+        with timer.stage("retrieval_time"), self.pool.connection():
+            context = build_context(hits)
+
+        fingerprint = chunk_fingerprint((hit.vector_id, hit.content) for hit in hits)
+        answer = self.answer_cache.get(question, fingerprint, embedding) if self.answer_cache is not None else None
+        cached = answer is not None
+        if cached:
+            metrics.increment("answer_cache_hits")
+            timer.first_token()
+            if emit is not None:
+                emit(answer)
+        else:
+            parts = []
+            timer.start_generation()
+            for part in self.stream_answer(build_rag_prompt(question, context)):
+                timer.first_token()
+                parts.append(part)
+                if emit is not None:
+                    emit(part)
+            answer = "".join(parts)
+            if self.answer_cache is not None:
+                metrics.increment("answer_cache_misses")
+                self.answer_cache.set(question, answer, fingerprint, embedding)
+        timer.finish()
+        timer.record()
+        return {
+            "answer": answer,
+            "cached": cached,
+            "sources": [_hit_json(hit) for hit in hits],
+            "timings_ms": {name: seconds * 1000 for name, seconds in timer.timings.items()},
+        }
+
+    def warm_up(self) -> None:
+        """Carrega o backend de busca (e reconstrói o snapshot numpy/ivf, se preciso) antes de aceitar conexões."""
+        backend = get_search_backend()
+        if hasattr(backend, "load"):
+            with self.pool.connection():
+                backend.load()
+
+    # Admissão e backpressure
+
+    def _check_capacity(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked() and self.stats["pending"] >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Serviço sobrecarregado, tente novamente.", {"Retry-After": "1"})
+
+    async def _run(self, fn: Callable, *args):
+        self._check_capacity()
+        self.stats["pending"] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats["pending"] -= 1
+        self.stats["in_flight"] += 1
+
+        def release(_):
+            # Só libera a vaga quando a thread termina, mesmo após um timeout
+            self.stats["in_flight"] -= 1
+            self._semaphore.release()
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise HTTPError(504, "Tempo limite excedido")
+
+    # Endpoints
+
+    async def health(self, payload: dict) -> dict:
+        return {"status": "ok", **self.stats}
+
+    async def prometheus_metrics(self, payload: dict) -> TextResponse:
+        return TextResponse(metrics.to_prometheus())
+
+    async def search(self, payload: dict) -> dict:
+        k, filters = _search_params(payload)
+        if isinstance(payload.get("queries"), list) and all(isinstance(q, str) for q in payload["queries"]):
+            queries = payload["queries"]
+        elif isinstance(payload.get("query"), str):
+            queries = [payload["query"]]
+        else:
+            raise HTTPError(400, "Informe 'query' (texto) ou 'queries' (lista de textos)")
+        _, results = await self._run(self._retrieve, queries, k, filters)
+        hits = [[_hit_json(hit) for hit in hits] for hits in results]
+        return {"results": hits} if "queries" in payload else {"hits": hits[0]}
+
+    async def ask(self, payload: dict):
+        question = payload.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "Informe 'question'")
+        k, filters = _search_params(payload)
+        if not payload.get("stream"):
+            return await self._run(self._answer, question, k, filters)
+
+        # Recusa antes de enviar o status 200 do streaming
+        self._check_capacity()
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue = asyncio.Queue()
+
+        def emit(token: str) -> None:
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+        async def events():
+            task = asyncio.ensure_future(self._run(self._answer, question, k, filters, emit))
+            # Os tokens são enfileirados pela thread antes do resultado: a ordem é preservada
+            task.add_done_callback(lambda _: tokens.put_nowait(None))
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                yield {"token": token}
+            try:
+                result = task.result()
+            except HTTPError as e:
+                yield {"done": True, "error": e.message, "status": e.status}
+                return
+            except Exception as e:
+                self.stats["errors"] += 1
+                yield {"done": True, "error": str(e), "status": 500}
+                return
+            result.pop("answer")
+            yield {"done": True, **result}
+
+        return StreamingResponse(events())
+
+    # HTTP/1.1 mínimo, com keep-alive
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Any, Dict[str, str]]:
+        self.stats["requests"] += 1
+        try:
+            route = self._routes.get(path)
+            if route is None:
+                raise HTTPError(404, "Rota não encontrada")
+            if method != route[0]:
+                raise HTTPError(405, f"Use {route[0]}", {"Allow": route[0]})
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise HTTPError(400, "Corpo JSON inválido")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "O corpo deve ser um objeto JSON")
+            return 200, await route[1](payload), {}
+        except HTTPError as e:
+            return e.status, {"error": e.message}, e.headers
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"{Emojis.ERROR.value} Erro ao processar {method} {path}: {e}")
+            return 500, {"error": str(e)}, {}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Any,
+                       keep_alive: bool, headers: Optional[Dict[str, str]] = None) -> None:
+        if isinstance(payload, StreamingResponse):
+            await self._respond_stream(writer, payload, keep_alive)
+            return
+        if isinstance(payload, TextResponse):
+            body, content_type = payload.text.encode("utf-8"), payload.content_type
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *(f"{name}: {value}" for name, value in (headers or {}).items()),
+        ]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _respond_stream(self, writer: asyncio.StreamWriter, response: StreamingResponse, keep_alive: bool) -> None:
+        lines = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: application/x-ndjson; charset=utf-8",
+            "Transfer-Encoding: chunked",
+            "Cache-Control: no-cache",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        async for event in response.events:
+            data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            # drain a cada evento: o cliente recebe cada token assim que é gerado
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._respond(writer, 400, {"error": "Requisição inválida"}, False)
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= self.max_body_bytes:
+                    await self._respond(writer, 413 if length > 0 else 400, {"error": "Content-Length inválido"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload, extra_headers = await self._dispatch(method, urlsplit(target).path, body)
+                await self._respond(writer, status, payload, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Conexões keep-alive abertas no encerramento do servidor
+            pass
+        finally:
+            # Sem wait_closed: no encerramento do loop a espera seria cancelada no meio
+            writer.close()
+
+    async def start(self, host: str = config.service.host, port: int = config.service.port) -> asyncio.AbstractServer:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.warm_up)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def create_service(fake: bool = False) -> RagService:
+    """
+    Cria o serviço com o banco configurado.
+
+    Com `fake=True`, embeddings e respostas vêm de modules.fake_backend (sem chamadas
+    à API, com latências de ServiceConfig), para testes de carga locais.
+    """
+    # Criação/migração de tabelas usa a conexão de escrita, antes de abrir o pool somente leitura
+    database.initialize_database()
+    pool = database.ConnectionPool(config.service.pool_size)
+    answer_cache = AnswerCache(database.open_connection()) if config.cache.answer_cache_enabled else None
+    if fake:
+        from modules.fake_backend import FakeEmbedder, FakeGenerator
+        embed_queries = FakeEmbedder(latency=config.service.fake_embedding_latency)
+        stream_answer = FakeGenerator(config.service.fake_generation_latency, config.service.fake_first_token_latency).stream
+    else:
+        from modules.google_ai_commands import generate_embeddings, stream_answer
+        embed_queries = lambda texts: generate_embeddings(texts, task_type="RETRIEVAL_QUERY")
+    return RagService(embed_queries, stream_answer, pool, answer_cache)
+
+
+def run_service(host: str = config.service.host, port: int = config.service.port, fake: bool = False) -> None:
+    """Inicia o serviço e atende até ser interrompido (Ctrl+C)."""
+    service = create_service(fake)
+
+    async def main():
+        server = await service.start(host, port)
+        logger.info(
+            f"{Emojis.SUCCESS.value} Serviço RAG em http://{host}:{port} "
+            f"({'backend falso' if fake else config.gen_ai_model}, {service.max_concurrency} em paralelo, "
+            f"fila de {service.max_pending})"
+        )
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info(f"{Emojis.INFO.value} Serviço encerrado.")
+    finally:
+        service.close()
+        MetricsDashboard().save_metrics_to_file()
@@ -0,0 +1,63 @@
+import json
+from typing import Any, Optional
+import numpy as np
+from config.settings import config
+
+VECTOR_DTYPE = np.float32
+
+
+def as_vector(value: Any, dimension: Optional[int] = config.database.embedding_dimension) -> np.ndarray:
+    """
+    Converte um embedding para o tipo único usado no sistema: np.float32 1-D e contíguo.
+
+    Aceita arrays/listas (inclusive no formato (1, dim) devolvido pela API), blobs
+    float32 vindos do sqlite-vec e os formatos texto legados (JSON ou separado por vírgulas).
+    Nenhuma cópia é feita quando o valor já está no formato correto.
+    """
+    if isinstance(value, str):
+        vector = parse_vector(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        vector = np.frombuffer(value, dtype=VECTOR_DTYPE)
+    else:
+        vector = np.ascontiguousarray(value, dtype=VECTOR_DTYPE).reshape(-1)
+    if dimension is not None and vector.size != dimension:
+        raise ValueError(f"Embedding com {vector.size} dimensões; esperado {dimension}")
+    return vector
+
+
+def parse_vector(text: str) -> np.ndarray:
+    """Converte a representação texto de um vetor ("[0.1, 0.2]", "0.1,0.2" ou "[0.1 0.2]")."""
+    text = text.strip()
+    if text.startswith('[') and ',' in text:
+        return np.asarray(json.loads(text), dtype=VECTOR_DTYPE)
+    separator = ',' if ',' in text else ' '
+    return np.fromstring(text.strip('[]'), dtype=VECTOR_DTYPE, sep=separator)
+
+
+def vector_blob(vector: Any, dimension: Optional[int] = config.database.embedding_dimension) -> memoryview:
+    """Retorna o buffer float32 do vetor para ser passado ao sqlite-vec como blob, sem cópia."""
+    return memoryview(as_vector(vector, dimension))
+
+
+def format_vector(vector: Any) -> str:
+    """Serializa o vetor como números separados por vírgula (formato CSV legado)."""
+    return ','.join(map(str, as_vector(vector, dimension=None).tolist()))
+
+
+def quantize_vector(vector: Any, storage: str = config.database.vector_storage,
+                    int8_range: float = config.database.int8_range, dimension: Optional[int] = config.database.embedding_dimension):
+    """
+    Converte o vetor para o formato de armazenamento do índice vec0.
+
+    - "float": buffer float32 (sem cópia)
+    - "int8": quantização escalar simétrica, componentes em [-int8_range, int8_range] -> [-127, 127]
+    - "bit": 1 bit por dimensão (sinal), em ordem little-endian como o sqlite-vec espera
+    """
+    vector = as_vector(vector, dimension)
+    if storage == "float":
+        return memoryview(vector)
+    if storage == "int8":
+        return np.clip(np.rint(vector * (127 / int8_range)), -127, 127).astype(np.int8).tobytes()
+    if storage == "bit":
+        return np.packbits(vector > 0, bitorder="little").tobytes()
+    raise ValueError(f"Formato de armazenamento de vetor desconhecido: {storage}")